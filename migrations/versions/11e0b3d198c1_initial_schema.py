@@ -0,0 +1,48 @@
+"""initial schema
+
+Revision ID: 11e0b3d198c1
+Revises: 
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '11e0b3d198c1'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# начальная схема - таблицы persons, phones и emails в том виде, в котором их создавала команда flask db migrate до
+# появления миграций в репозитории. Такую БД отмечают этой ревизией командой flask db stamp 11e0b3d198c1
+
+
+def upgrade():
+    op.create_table('persons',
+                    sa.Column('person_id', sa.Integer(), nullable=False),
+                    sa.Column('file_path', sa.String(length=100), nullable=False),
+                    sa.Column('full_name', sa.String(length=100), nullable=False),
+                    sa.Column('gender', sa.String(length=30), nullable=False),
+                    sa.Column('birthday', sa.Date(), nullable=False),
+                    sa.Column('address', sa.String(), nullable=False),
+                    sa.PrimaryKeyConstraint('person_id'))
+    op.create_table('phones',
+                    sa.Column('person_id', sa.Integer(), nullable=False),
+                    sa.Column('phone_type', sa.String(length=30), nullable=False),
+                    sa.Column('phone_number', sa.String(length=30), nullable=False),
+                    sa.ForeignKeyConstraint(['person_id'], ['persons.person_id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('phone_number'))
+    op.create_table('emails',
+                    sa.Column('person_id', sa.Integer(), nullable=False),
+                    sa.Column('email_type', sa.String(length=30), nullable=False),
+                    sa.Column('email_address', sa.String(length=254), nullable=False),
+                    sa.ForeignKeyConstraint(['person_id'], ['persons.person_id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('email_address'))
+
+
+def downgrade():
+    op.drop_table('emails')
+    op.drop_table('phones')
+    op.drop_table('persons')
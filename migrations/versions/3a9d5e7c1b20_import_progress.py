@@ -0,0 +1,32 @@
+"""import progress
+
+Revision ID: 3a9d5e7c1b20
+Revises: 11e0b3d198c1
+Create Date: 2026-10-18 12:41:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a9d5e7c1b20'
+down_revision = '11e0b3d198c1'
+branch_labels = None
+depends_on = None
+
+# состояние массового импорта контактов (команда flask orion import, модуль importer)
+
+
+def upgrade():
+    op.create_table('import_progress',
+                    sa.Column('source', sa.String(length=500), nullable=False),
+                    sa.Column('rows_done', sa.BigInteger(), nullable=False),
+                    sa.Column('rows_imported', sa.BigInteger(), nullable=False),
+                    sa.Column('rows_rejected', sa.BigInteger(), nullable=False),
+                    sa.Column('finished', sa.Boolean(), nullable=False),
+                    sa.PrimaryKeyConstraint('source'))
+
+
+def downgrade():
+    op.drop_table('import_progress')
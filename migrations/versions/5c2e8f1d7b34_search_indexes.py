@@ -0,0 +1,43 @@
+"""search indexes
+
+Revision ID: 5c2e8f1d7b34
+Revises: a711942da941
+Create Date: 2026-10-18 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8f1d7b34'
+down_revision = 'a711942da941'
+branch_labels = None
+depends_on = None
+
+# GIN индексы для поиска контактов (модуль orion/search.py): полнотекстовый индекс по ФИО и адресу с русской
+# морфологией и триграммные индексы (pg_trgm) для поиска с опечатками и по подстроке email и номера телефона.
+# Выражение индекса ix_persons_search_document должно совпадать с выражением в запросе поиска
+indexes = [
+    ('ix_persons_search_document', 'persons',
+     "USING gin (to_tsvector('russian', full_name || ' ' || address))"),
+    ('ix_persons_full_name_trgm', 'persons', 'USING gin (full_name gin_trgm_ops)'),
+    ('ix_persons_address_trgm', 'persons', 'USING gin (address gin_trgm_ops)'),
+    ('ix_emails_email_address_trgm', 'emails', 'USING gin (email_address gin_trgm_ops)'),
+    ('ix_phones_phone_number_trgm', 'phones', 'USING gin (phone_number gin_trgm_ops)'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        for name, table, definition in indexes:
+            # индекс, построение которого было прервано, остается в статусе INVALID, его нужно удалить и построить заново
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            op.execute(f'CREATE INDEX CONCURRENTLY {name} ON {table} {definition}')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, definition in reversed(indexes):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
@@ -0,0 +1,31 @@
+"""version markers
+
+Revision ID: 6b1f4d2a9e57
+Revises: 3a9d5e7c1b20
+Create Date: 2026-10-18 12:42:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b1f4d2a9e57'
+down_revision = '3a9d5e7c1b20'
+branch_labels = None
+depends_on = None
+
+# столбец версии контакта и счетчики изменений таблиц для ETag
+
+
+def upgrade():
+    op.add_column('persons', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.create_table('table_versions',
+                    sa.Column('table_name', sa.String(length=50), nullable=False),
+                    sa.Column('version', sa.BigInteger(), nullable=False),
+                    sa.PrimaryKeyConstraint('table_name'))
+
+
+def downgrade():
+    op.drop_table('table_versions')
+    op.drop_column('persons', 'version')
@@ -0,0 +1,69 @@
+"""canonical phone numbers
+
+Revision ID: 8d4b0c6e2f19
+Revises: 5c2e8f1d7b34
+Create Date: 2026-10-18 13:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4b0c6e2f19'
+down_revision = '5c2e8f1d7b34'
+branch_labels = None
+depends_on = None
+
+# Номера телефонов приводятся к каноническому виду +7хххххххххх (как в data_validation.canonical_phone_number):
+# из номера удаляются все символы, кроме цифр, и к последним 10 цифрам добавляется +7. Номер можно привести к
+# каноническому виду, если в нем 10 цифр или 11 цифр, первая из которых 7 или 8
+digits = "regexp_replace(phone_number, '[^0-9]', '', 'g')"
+canonical = f"'+7' || right({digits}, 10)"
+
+
+def upgrade():
+    # номер с другим количеством цифр после преобразования не прошел бы проверку ck_phones_phone_number_canonical
+    # (или был бы обрезан до другого номера) - миграция останавливается со списком таких номеров до изменения данных
+    malformed = op.get_bind().execute(sa.text(f'''
+        SELECT phone_number, person_id FROM phones
+        WHERE {digits} !~ '^[78]?[0-9]{{10}}$'
+        ORDER BY person_id, phone_number
+        LIMIT 20''')).all()
+    if malformed:
+        raise RuntimeError('Номера телефонов нельзя привести к виду +7хххххххххх (нужно 10 цифр или 11, начиная с 7 или '
+                           '8): ' + '; '.join(f'{number} (person_id {person_id})' for number, person_id in malformed))
+    # один номер, записанный в разных форматах у разных контактов, нельзя объединить автоматически - миграция
+    # останавливается со списком таких номеров, чтобы их исправили вручную
+    conflicts = op.get_bind().execute(sa.text(f'''
+        SELECT {canonical} AS phone_number, array_agg(DISTINCT person_id ORDER BY person_id) AS person_ids
+        FROM phones GROUP BY 1 HAVING count(DISTINCT person_id) > 1
+        LIMIT 20''')).all()
+    if conflicts:
+        raise RuntimeError('Номера телефонов принадлежат разным контактам в разных форматах: '
+                           + '; '.join(f'{number} (person_id {", ".join(map(str, person_ids))})'
+                                       for number, person_ids in conflicts))
+    # у одного контакта из нескольких записей одного номера остается запись в каноническом виде (или первая)
+    # (версия контакта увеличивается, чтобы ETag контакта, отданные до миграции, стали недействительны)
+    op.execute(f'''
+        WITH deleted AS (
+            DELETE FROM phones p USING (
+                SELECT phone_number, row_number() OVER (PARTITION BY {canonical}
+                                                        ORDER BY phone_number <> {canonical}, phone_number) AS position
+                FROM phones) d
+            WHERE p.phone_number = d.phone_number AND d.position > 1 RETURNING p.person_id)
+        UPDATE persons SET version = version + 1 WHERE person_id IN (SELECT person_id FROM deleted)''')
+    op.execute(f'''
+        WITH changed AS (
+            UPDATE phones SET phone_number = {canonical} WHERE phone_number <> {canonical} RETURNING person_id)
+        UPDATE persons SET version = version + 1 WHERE person_id IN (SELECT person_id FROM changed)''')
+    # счетчик изменений таблицы phones увеличивается, чтобы ETag списков, отданные до миграции, стали недействительны
+    op.execute('''
+        INSERT INTO table_versions (table_name, version) VALUES ('persons', 1), ('phones', 1)
+        ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1''')
+    op.create_check_constraint('ck_phones_phone_number_canonical', 'phones', "phone_number ~ '^\\+7[0-9]{10}$'")
+
+
+def downgrade():
+    # исходный формат номеров не сохраняется, поэтому откат только снимает ограничение
+    op.drop_constraint('ck_phones_phone_number_canonical', 'phones', type_='check')
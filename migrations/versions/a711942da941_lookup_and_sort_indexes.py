@@ -0,0 +1,46 @@
+"""lookup and sort indexes
+
+Revision ID: a711942da941
+Revises: 6b1f4d2a9e57
+Create Date: 2026-10-18 12:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a711942da941'
+down_revision = '6b1f4d2a9e57'
+branch_labels = None
+depends_on = None
+
+# индексы строятся через CREATE INDEX CONCURRENTLY, чтобы не блокировать запись в таблицы на время построения.
+# CONCURRENTLY нельзя выполнять внутри транзакции, поэтому миграция использует autocommit_block
+indexes = [
+    # поиск телефонов и email контакта по person_id и сортировка по person_id
+    ('ix_phones_person_id_phone_number', 'phones', ['person_id', 'phone_number']),
+    ('ix_emails_person_id_email_address', 'emails', ['person_id', 'email_address']),
+    # постраничная выборка и сортировка списков: (столбец сортировки, первичный ключ)
+    ('ix_phones_phone_type_phone_number', 'phones', ['phone_type', 'phone_number']),
+    ('ix_emails_email_type_email_address', 'emails', ['email_type', 'email_address']),
+    ('ix_persons_full_name_person_id', 'persons', ['full_name', 'person_id']),
+    ('ix_persons_birthday_person_id', 'persons', ['birthday', 'person_id']),
+    ('ix_persons_file_path_person_id', 'persons', ['file_path', 'person_id']),
+    ('ix_persons_gender_person_id', 'persons', ['gender', 'person_id']),
+    ('ix_persons_address_person_id', 'persons', ['address', 'person_id']),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in indexes:
+            # индекс, построение которого было прервано, остается в статусе INVALID, его нужно удалить и построить заново
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(indexes):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
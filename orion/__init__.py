@@ -1,9 +1,20 @@
 import os
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from flask_migrate import Migrate
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
 import configparser
 
+try:
+    # сессия SQLAlchemy своя для каждого greenlet: в асинхронном режиме (модуль asgi) каждый запрос обрабатывается
+    # в отдельном greenlet одного потока, в синхронном режиме у каждого потока свой главный greenlet
+    from greenlet import getcurrent as session_scope
+except ImportError:
+    from threading import get_ident as session_scope
+
 # В данном модуле происходит создание приложения Flask и подключение к БД SQLAlchemy и flask_migrate
 
 
@@ -18,12 +29,57 @@ db_name = config['DEFAULT']['db_name']
 host = config['DEFAULT']['host']
 port = config['DEFAULT']['port']
 
+
+class RoutingSession(SignallingSession):
+    """Класс сессии, которая выполняет чтение на реплике, выбранной для запроса модулем replicas (g.read_bind).
+    Изменение данных (flush, INSERT, UPDATE, DELETE) всегда выполняется на основной БД"""
+
+    def get_bind(self, mapper=None, clause=None):
+        read_bind = g.get('read_bind') if has_app_context() else None
+        if read_bind is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return read_bind
+        return super().get_bind(mapper, clause)
+
+
+class OrionSQLAlchemy(SQLAlchemy):
+    """Класс подключения к БД с сессией RoutingSession. Для асинхронного драйвера (postgresql+asyncpg, модуль asgi)
+    движок создается через create_async_engine. Методы моделей работают с его синхронным интерфейсом sync_engine, а
+    ожидание ответа БД передается циклу событий asyncio"""
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        if getattr(make_url(sa_url).get_dialect(), 'is_async', False):
+            from sqlalchemy.ext.asyncio import create_async_engine
+            engine = create_async_engine(sa_url, **engine_opts).sync_engine
+            event.listen(engine, 'do_connect', connect_async)
+        else:
+            engine = create_engine(sa_url, **engine_opts)
+        from orion.metrics import instrument_engine
+        return instrument_engine(engine)
+
+
+def connect_async(dialect, connection_record, cargs, cparams):
+    """Функция подключается к БД асинхронным драйвером. asyncpg сообщает о недоступности сервера исключением OSError,
+    которое заменяется на OperationalError, как у psycopg2, чтобы методы моделей возвращали ту же ошибку"""
+    try:
+        return dialect.connect(*cargs, **cparams)
+    except OSError as oe:
+        raise dialect.dbapi.OperationalError(str(oe)) from oe
+
+
 app = Flask(__name__)
 db_uri = f"postgresql://{db_user}:{db_password}@{host}:{port}/{db_name}"
 app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
 app.config['JSON_AS_ASCII'] = False
-db = SQLAlchemy(app)
+db = OrionSQLAlchemy(app, session_options={'scopefunc': session_scope})
 migrate = Migrate(app,  db)
 
 
 from orion.api import handlers
+from orion import cli
+from orion import compression
+from orion import profiler
+from orion import replicas
+from orion import metrics
@@ -1,9 +1,16 @@
 from orion import app
 from flask import request, jsonify
 from orion.models import Person, Phone, Email
+from orion.streaming import ndjson_response, ndjson_mimetype
+from orion.cache import contact_cache
+from orion.autocomplete import autocomplete
+from orion.serialization import json_response
+from orion.etag import person_etag, list_etag, etag_matches, not_modified, with_etag, etag_response
 from werkzeug.exceptions import BadRequest
 import traceback
-from orion.data_validation import PersonData, SortedData, EmailData, PhoneData, IdData
+from orion.data_validation import PersonData, SortedData, EmailData, PhoneData, IdData, PageData, ExpandData, \
+    IdsData, SearchData, AutocompleteData, PhoneNumberData, EmailAddressData, PersonFilterData, FieldsData, \
+    PhoneFieldsData, EmailFieldsData, validate_persons, validate_person_patches
 from pydantic.error_wrappers import ValidationError as PydanticValilationError
 
 # В данном модуле описаны методы обработки запросов к API по сущностям Person, Phone и Email.
@@ -15,22 +22,47 @@ def page_not_found():
     return jsonify({'Ошибка URL адреса': 'URL в запросе не соответствует ни одному из маршрутов'})
 
 
+def parse_list_request():
+    """Функция проводит валидацию данных запроса к маршрутам получения списков и возвращает параметры сортировки и
+    выборки. Потоковая выдача в формате NDJSON включается атрибутом stream или заголовком Accept: application/x-ndjson"""
+    request_data = request.get_json() or {}
+    wants_ndjson = request.accept_mimetypes.best_match(['application/json', ndjson_mimetype]) == ndjson_mimetype
+    page_data = PageData(**request_data)
+    if page_data.stream is None:
+        page_data.stream = wants_ndjson
+    # Данные для сортировки необязательны при любом наборе остальных атрибутов (expand, fields, limit, stream): без них
+    # список возвращается несортированным, а постраничная выборка сортируется по первичному ключу. Если передан
+    # sorted_by или order, проверяются оба атрибута
+    if 'sorted_by' not in request_data and 'order' not in request_data:
+        return None, page_data
+    return SortedData(**request_data), page_data
+
+
 # Обработчики запросов к сущности Person
 @app.route('/api/get_persons_list', methods=['POST'])
 def get_persons_list():
     """Функция принимает POST-запрос с данными для сортировки и возвращает отсортированные
     записи из таблицы persons в формате JSON. Если данных для сортировки нет, возвращается несортированный список"""
     try:
-        if not request.get_json():
-            # Если данных для сортировки нет, то вызываем метод get_all_persons() модели Person без аргументов
-            all_persons = Person.get_all_persons()
-            return jsonify(all_persons)
-        request_data = request.get_json()
         # Проводим валидацию полученных данных в модуле data_validation
-        sorted_data = SortedData(**request_data)
-        # Передаем данные в метод get_all_persons модели Person с данными для сортировки
-        all_persons = Person.get_all_persons(sorted_data)
-        return jsonify(all_persons)
+        sorted_data, page_data = parse_list_request()
+        # Связанные телефоны и email, которые нужно вернуть вместе с контактами
+        expand = ExpandData(**(request.get_json() or {})).expand
+        # Атрибуты контактов, которые нужно вернуть (из БД выбираются только эти столбцы)
+        fields = FieldsData(**(request.get_json() or {})).fields
+        # Если таблицы не изменились с предыдущего запроса клиента, отвечаем 304 без выборки данных
+        etag = list_etag('persons', *(expand or []))
+        if etag_matches(etag):
+            return not_modified(etag)
+        if page_data.stream:
+            # Потоковая выдача всех записей таблицы persons в формате NDJSON
+            all_persons = Person.stream_all_persons(sorted_data, expand, fields)
+            if 'error' in all_persons:
+                return jsonify(all_persons)
+            return with_etag(ndjson_response(all_persons['response']), etag)
+        # Передаем данные в метод get_all_persons модели Person с данными для сортировки и постраничной выборки
+        all_persons = Person.get_all_persons(sorted_data, page_data, expand, fields)
+        return etag_response(all_persons, etag)
     except BadRequest as be:
         return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
                         be.__class__.__name__, 'info': traceback.format_exc()})
@@ -40,6 +72,9 @@ def get_persons_list():
     except PydanticValilationError as pve:
         return jsonify({'error': pve.errors(),
                         'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()})
+    except TypeError as te:
+        return jsonify({'error': f'Нет доступных данных для обработки',
+                        'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
 
 
 @app.route('/api/get_person', methods=['POST'])
@@ -50,18 +85,141 @@ def get_person():
         request_data = request.get_json()
         # Проводим валидацию полученных арибутов в модуле data_validation
         person_id_obj = IdData(**request_data)
-        # Передаем person_id_obj в метод get_person модели Person
-        person = Person.get_person(person_id_obj)
-        return jsonify(person)
+        expand_data = ExpandData(**request_data)
+        fields_data = FieldsData(**request_data)
+        # Если контакт не изменился с предыдущего запроса клиента, отвечаем 304 без выборки данных
+        etag = person_etag(person_id_obj.person_id)
+        if etag_matches(etag):
+            return not_modified(etag)
+        # Передаем person_id_obj и связанные сущности для подгрузки в метод get_person модели Person
+        person = Person.get_person(person_id_obj, expand_data.expand, fields_data.fields)
+        return etag_response(person, etag)
+    except BadRequest as be:
+        return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
+                        be.__class__.__name__, 'info': traceback.format_exc()})
+    except TypeError as te:
+        return jsonify({'error': f'Нет доступных данных для обработки',
+                        'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
+    except PydanticValilationError as pve:
+        return jsonify({'error': pve.errors(),
+                        'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()})
+
+
+@app.route('/api/get_persons', methods=['POST'])
+def get_persons():
+    """Функция принимает POST-запрос cо списком person_id в формате JSON и одним запросом к БД возвращает
+    соответствующие записи из таблицы persons в виде словаря по person_id"""
+    try:
+        # Из запроса получаем JSON cо списком person_id
+        request_data = request.get_json()
+        # Проводим валидацию полученных арибутов в модуле data_validation
+        ids_obj = IdsData(**request_data)
+        expand_data = ExpandData(**request_data)
+        fields_data = FieldsData(**request_data)
+        # Передаем ids_obj и связанные сущности для подгрузки в метод get_persons модели Person
+        persons = Person.get_persons(ids_obj, expand_data.expand, fields_data.fields)
+        return json_response(persons)
+    except BadRequest as be:
+        return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
+                        be.__class__.__name__, 'info': traceback.format_exc()})
+    except TypeError as te:
+        return jsonify({'error': f'Нет доступных данных для обработки',
+                        'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
+    except PydanticValilationError as pve:
+        return jsonify({'error': pve.errors(),
+                        'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()})
+
+
+@app.route('/api/get_person_by_phone', methods=['POST'])
+def get_person_by_phone():
+    """Функция принимает POST-запрос c номером телефона в формате JSON и возвращает контакт, которому принадлежит
+    номер. Номер можно передать в любом из допустимых форматов, он приводится к каноническому виду"""
+    try:
+        # Из запроса получаем JSON c номером телефона
+        request_data = request.get_json()
+        # Проводим валидацию полученных арибутов в модуле data_validation
+        phone_number_data = PhoneNumberData(**request_data)
+        expand_data = ExpandData(**request_data)
+        # Передаем номер и связанные сущности для подгрузки в метод get_person_by_phone модели Person
+        return json_response(Person.get_person_by_phone(phone_number_data, expand_data.expand))
+    except BadRequest as be:
+        return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
+                        be.__class__.__name__, 'info': traceback.format_exc()})
+    except TypeError as te:
+        return jsonify({'error': f'Нет доступных данных для обработки',
+                        'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
+    except PydanticValilationError as pve:
+        return jsonify({'error': pve.errors(),
+                        'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()})
+
+
+@app.route('/api/get_person_by_email', methods=['POST'])
+def get_person_by_email():
+    """Функция принимает POST-запрос c адресом почты в формате JSON и возвращает контакт, которому принадлежит адрес"""
+    try:
+        # Из запроса получаем JSON c адресом почты
+        request_data = request.get_json()
+        # Проводим валидацию полученных арибутов в модуле data_validation
+        email_address_data = EmailAddressData(**request_data)
+        expand_data = ExpandData(**request_data)
+        # Передаем адрес и связанные сущности для подгрузки в метод get_person_by_email модели Person
+        return json_response(Person.get_person_by_email(email_address_data, expand_data.expand))
+    except BadRequest as be:
+        return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
+                        be.__class__.__name__, 'info': traceback.format_exc()})
+    except TypeError as te:
+        return jsonify({'error': f'Нет доступных данных для обработки',
+                        'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
+    except PydanticValilationError as pve:
+        return jsonify({'error': pve.errors(),
+                        'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()})
+
+
+@app.route('/api/search_persons', methods=['POST'])
+def search_persons():
+    """Функция принимает POST-запрос с поисковым запросом в формате JSON и возвращает страницу найденных по ФИО и
+    адресу (и, если указано в search_in, по email и номеру телефона) контактов, отсортированных по релевантности"""
+    try:
+        # Из запроса получаем JSON с поисковым запросом
+        request_data = request.get_json()
+        # Проводим валидацию полученных арибутов в модуле data_validation
+        search_data = SearchData(**request_data)
+        expand = ExpandData(**request_data).expand
+        # Если таблицы не изменились с предыдущего запроса клиента, отвечаем 304 без выполнения поиска
+        etag = list_etag('persons', 'phones', 'emails')
+        if etag_matches(etag):
+            return not_modified(etag)
+        return etag_response(Person.search_persons(search_data, expand), etag)
     except BadRequest as be:
         return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
                         be.__class__.__name__, 'info': traceback.format_exc()})
+    except PydanticValilationError as pve:
+        return jsonify({'error': pve.errors(),
+                        'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()})
     except TypeError as te:
         return jsonify({'error': f'Нет доступных данных для обработки',
                         'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
+
+
+@app.route('/api/autocomplete', methods=['POST'])
+def autocomplete_contacts():
+    """Функция принимает POST-запрос с полем (full_name, phone_number, email_address) и началом его значения в формате
+    JSON и возвращает подсказки для автодополнения из индекса в памяти процесса"""
+    try:
+        # Из запроса получаем JSON с полем и префиксом
+        request_data = request.get_json()
+        # Проводим валидацию полученных арибутов в модуле data_validation
+        autocomplete_data = AutocompleteData(**request_data)
+        return json_response(Person.autocomplete(autocomplete_data))
+    except BadRequest as be:
+        return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
+                        be.__class__.__name__, 'info': traceback.format_exc()})
     except PydanticValilationError as pve:
         return jsonify({'error': pve.errors(),
                         'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()})
+    except TypeError as te:
+        return jsonify({'error': f'Нет доступных данных для обработки',
+                        'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
 
 
 @app.route('/api/add_person', methods=['PUT'])
@@ -72,11 +230,14 @@ def add_person():
     try:
         # Из запроса получаем JSON c данными Person и related cущностей и сохраняем их в request_data
         request_data = request.get_json()
-        persons_list = []
-        # Для каждого объекта в списоке контактов проводим валидацию и создаем объект person
-        for item in request_data:
-            person = PersonData(**item)
-            persons_list.append(person)
+        if not isinstance(request_data, list):
+            raise TypeError('Ожидается список контактов')
+        # Проверяем весь список контактов за один проход и возвращаем ошибки всех невалидных контактов сразу
+        persons_list, validation_errors = validate_persons(request_data)
+        if validation_errors:
+            return jsonify({'error': f'При валидации данных {len(validation_errors)} из {len(request_data)} '
+                                     f'контактов произошли ошибки. Индексы контактов указаны в атрибуте index',
+                            'errors': validation_errors, 'exception_name': PydanticValilationError.__name__})
         # Передаем список контактов в add_person сущности Person для добавления их в БД
         add_person_result = Person.add_person(persons_list)
         return add_person_result
@@ -86,10 +247,6 @@ def add_person():
     except BadRequest as be:
         return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
                         be.__class__.__name__, 'info': traceback.format_exc()})
-    except PydanticValilationError as pve:
-        return jsonify({f'При валидации данных контакта номер {len(persons_list) + 1} произошла ошибка':
-                        {'error': pve.errors(),
-                         'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()}})
 
 
 @app.route('/api/update_person', methods=['PATCH'])
@@ -117,6 +274,30 @@ def update_person():
                         'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
 
 
+@app.route('/api/update_persons', methods=['PATCH'])
+def update_persons():
+    """Функция принимает список изменений контактов в формате JSON (person_id и изменяемые атрибуты контакта) и
+    изменяет данные в таблице persons пакетно. person_id, которых нет в БД, возвращаются в атрибуте not_found"""
+    try:
+        # Из запроса получаем JSON cо списком изменений
+        request_data = request.get_json()
+        if not isinstance(request_data, list):
+            raise TypeError('Ожидается список изменений контактов')
+        # Проверяем весь список изменений за один проход и возвращаем ошибки всех невалидных изменений сразу
+        patches, validation_errors = validate_person_patches(request_data)
+        if validation_errors:
+            return jsonify({'error': f'При валидации данных {len(validation_errors)} из {len(request_data)} '
+                                     f'изменений произошли ошибки. Индексы изменений указаны в атрибуте index',
+                            'errors': validation_errors, 'exception_name': PydanticValilationError.__name__})
+        return jsonify(Person.update_persons(patches))
+    except TypeError as te:
+        return jsonify({'error': 'структура данных не соответствует ожидаемому формату. Ожидается список изменений '
+                                 'контактов', 'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
+    except BadRequest as be:
+        return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
+                        be.__class__.__name__, 'info': traceback.format_exc()})
+
+
 @app.route('/api/delete_person', methods=['DELETE'])
 def delete_person():
     """Функция получает JSON и по указанному в нем person_id каскадно удаляет данные из таблицы persons и связанных
@@ -142,22 +323,53 @@ def delete_person():
                         'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
 
 
+@app.route('/api/delete_persons', methods=['DELETE'])
+def delete_persons():
+    """Функция получает JSON со списком person_ids или с атрибутами контакта в filter и одним запросом к БД каскадно
+    удаляет соответствующие контакты из таблицы persons и связанных таблиц"""
+    try:
+        # Из запроса получаем JSON cо списком person_id или фильтром
+        request_data = request.get_json()
+        if 'filter' in request_data and 'person_ids' in request_data:
+            return jsonify({'error': 'Запрос должен содержать только один из атрибутов - person_ids или filter',
+                            'exception_name': TypeError.__name__})
+        # Проводим валидацию полученных арибутов в модуле data_validation
+        if 'filter' in request_data:
+            return jsonify(Person.delete_persons_by_filter(PersonFilterData(**request_data['filter'])))
+        return jsonify(Person.delete_persons_by_ids(IdsData(**request_data)))
+    except BadRequest as be:
+        return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
+                        be.__class__.__name__, 'info': traceback.format_exc()})
+    except PydanticValilationError as pve:
+        return jsonify({'error': pve.errors(),
+                        'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()})
+    except TypeError as te:
+        return jsonify({'error': f'Нет доступных данных для обработки',
+                        'exception_name': te.__class__.__name__, 'info': traceback.format_exc()})
+
+
 # Обработчики запросов к сущности Phone
 @app.route('/api/get_phones_list', methods=['POST'])
 def get_phones_list():
     """Функция принимает POST-запрос с данными для сортировки и возвращает отсортированные
     записи из таблицы phones в формате JSON. Если данных для сортировки нет, возвращается несортированный список"""
     try:
-        if not request.get_json():
-            # Если данных для сортировки нет, то вызываем метод get_all_phones() модели Phone без аргументов
-            all_phones = Phone.get_all_phones()
-            return jsonify(all_phones)
-        request_data = request.get_json()
         # Проводим валидацию полученных данных в модуле data_validation
-        sorted_data = SortedData(**request_data)
-        # Передаем данные в метод get_all_phones модели Phone с данными для сортировки
-        all_phones = Phone.get_all_phones(sorted_data)
-        return jsonify(all_phones)
+        sorted_data, page_data = parse_list_request()
+        fields = PhoneFieldsData(**(request.get_json() or {})).fields
+        # Если таблицы не изменились с предыдущего запроса клиента, отвечаем 304 без выборки данных
+        etag = list_etag('phones')
+        if etag_matches(etag):
+            return not_modified(etag)
+        if page_data.stream:
+            # Потоковая выдача всех записей таблицы phones в формате NDJSON
+            all_phones = Phone.stream_all_phones(sorted_data, fields)
+            if 'error' in all_phones:
+                return jsonify(all_phones)
+            return with_etag(ndjson_response(all_phones['response']), etag)
+        # Передаем данные в метод get_all_phones модели Phone с данными для сортировки и постраничной выборки
+        all_phones = Phone.get_all_phones(sorted_data, page_data, fields)
+        return etag_response(all_phones, etag)
     except BadRequest as be:
         return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
                         be.__class__.__name__, 'info': traceback.format_exc()})
@@ -181,9 +393,14 @@ def get_phone():
         request_data = request.get_json()
         # Проводим валидацию полученных арибутов в модуле data_validation
         person_id_obj = IdData(**request_data)
+        fields_data = PhoneFieldsData(**request_data)
+        # Изменение телефонов увеличивает версию контакта, поэтому ETag вычисляется по ней
+        etag = person_etag(person_id_obj.person_id)
+        if etag_matches(etag):
+            return not_modified(etag)
         # Передаем person_id_obj в метод get_phone модели Phone
-        phone = Phone.get_phone(person_id_obj)
-        return jsonify(phone)
+        phone = Phone.get_phone(person_id_obj, fields_data.fields)
+        return etag_response(phone, etag)
     except BadRequest as be:
         return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
                         be.__class__.__name__, 'info': traceback.format_exc()})
@@ -281,16 +498,22 @@ def get_emails_list():
     """Функция принимает POST-запрос с данными для сортировки и возвращает отсортированные записи из таблицы emails
     в формате JSON. Если данных для сортировки нет, возвращается несортированный список"""
     try:
-        if not request.get_json():
-            # Если данных для сортировки нет, то вызываем метод get_all_phones() модели Phone без аргументов
-            all_emails = Email.get_all_emails()
-            return jsonify(all_emails)
-        request_data = request.get_json()
         # Проводим валидацию полученных данных в модуле data_validation
-        sorted_data = SortedData(**request_data)
-        # Передаем данные в метод get_all_phones модели Email с данными для сортировки
-        all_emails = Email.get_all_emails(sorted_data)
-        return jsonify(all_emails)
+        sorted_data, page_data = parse_list_request()
+        fields = EmailFieldsData(**(request.get_json() or {})).fields
+        # Если таблицы не изменились с предыдущего запроса клиента, отвечаем 304 без выборки данных
+        etag = list_etag('emails')
+        if etag_matches(etag):
+            return not_modified(etag)
+        if page_data.stream:
+            # Потоковая выдача всех записей таблицы emails в формате NDJSON
+            all_emails = Email.stream_all_emails(sorted_data, fields)
+            if 'error' in all_emails:
+                return jsonify(all_emails)
+            return with_etag(ndjson_response(all_emails['response']), etag)
+        # Передаем данные в метод get_all_emails модели Email с данными для сортировки и постраничной выборки
+        all_emails = Email.get_all_emails(sorted_data, page_data, fields)
+        return etag_response(all_emails, etag)
     except BadRequest as be:
         return jsonify({'error': 'Структура данных не соответсвует формату JSON',
                         'exception_name': be.__class__.__name__, 'info': traceback.format_exc()})
@@ -314,9 +537,14 @@ def get_email():
         request_data = request.get_json()
         # Проводим валидацию полученных арибутов в модуле data_validation
         person_id_obj = IdData(**request_data)
-        # Передаем person_id_obj в метод get_phone модели Phone
-        email = Email.get_email(person_id_obj)
-        return jsonify(email)
+        fields_data = EmailFieldsData(**request_data)
+        # Изменение email увеличивает версию контакта, поэтому ETag вычисляется по ней
+        etag = person_etag(person_id_obj.person_id)
+        if etag_matches(etag):
+            return not_modified(etag)
+        # Передаем person_id_obj в метод get_email модели Email
+        email = Email.get_email(person_id_obj, fields_data.fields)
+        return etag_response(email, etag)
     except BadRequest as be:
         return jsonify({'error': 'Структура данных не соответсвует формату JSON', 'exception_name':
                         be.__class__.__name__, 'info': traceback.format_exc()})
@@ -405,3 +633,15 @@ def delete_email():
     except PydanticValilationError as pve:
         return jsonify({'error': pve.errors(),
                         'exception_name': pve.__class__.__name__, 'info': traceback.format_exc()})
+
+
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    """Функция возвращает счетчики попаданий, промахов и вытеснений read-through кэша контактов"""
+    return jsonify({'response': contact_cache.stats()})
+
+
+@app.route('/api/autocomplete_stats', methods=['GET'])
+def autocomplete_stats():
+    """Функция возвращает количество записей и занимаемую память индексов автодополнения"""
+    return jsonify({'response': autocomplete.stats()})
@@ -0,0 +1,139 @@
+import io
+import sys
+from sqlalchemy.util import greenlet_spawn, await_only
+from orion import app, db, config, db_user, db_password, host, port, db_name
+from orion.autocomplete import autocomplete, autocomplete_enabled
+
+# В данном модуле находится асинхронный режим работы приложения (ASGI). Маршруты /api/*, методы моделей и валидация
+# данных те же, что и в синхронном режиме: каждый запрос обрабатывается приложением Flask в отдельном greenlet
+# (sqlalchemy greenlet_spawn), а запросы к БД выполняются асинхронным драйвером asyncpg через пул соединений
+# create_async_engine. Пока запрос ждет ответа БД, greenlet передает управление циклу событий asyncio, поэтому один
+# процесс обслуживает тысячи одновременных запросов. Импорт модуля переводит процесс в асинхронный режим.
+# Запуск: uvicorn orion.asgi:application (требуются библиотеки asyncpg и uvicorn) или python runserver.py --asgi
+
+asgi_driver = config.get('ASGI', 'driver', fallback='postgresql+asyncpg')
+# пул соединений асинхронного движка: запросы сверх pool_size + max_overflow ждут свободного соединения pool_timeout
+# секунд, не блокируя цикл событий
+asgi_engine_options = {'pool_size': config.getint('ASGI', 'pool_size', fallback=20),
+                       'max_overflow': config.getint('ASGI', 'max_overflow', fallback=20),
+                       'pool_timeout': config.getint('ASGI', 'pool_timeout', fallback=30)}
+
+app.config['SQLALCHEMY_DATABASE_URI'] = f'{asgi_driver}://{db_user}:{db_password}@{host}:{port}/{db_name}'
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = asgi_engine_options
+app.config['ORION_ASYNC_DB'] = True
+
+
+def wsgi_environ(scope, body):
+    """Функция возвращает окружение WSGI для HTTP запроса ASGI"""
+    root_path = scope.get('root_path', '')
+    path = scope['path'][len(root_path):] if scope['path'].startswith(root_path) else scope['path']
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin1'), value.decode('latin1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def run_request(environ, send):
+    """Функция обрабатывает запрос приложением Flask внутри greenlet и отправляет ответ клиенту. Отправка ответа и
+    запросы к БД ожидаются через await_only, поэтому потоковые ответы отдаются частями по мере сериализации"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response.get('started'):
+            raise exc_info[1].with_traceback(exc_info[2])
+        response['start'] = {'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                             'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                                         for name, value in headers]}
+        return send_body
+
+    def send_body(data):
+        if not response.get('started'):
+            await_only(send(response['start']))
+            response['started'] = True
+        if data:
+            await_only(send({'type': 'http.response.body', 'body': data, 'more_body': True}))
+
+    result = app.wsgi_app(environ, start_response)
+    try:
+        for chunk in result:
+            send_body(chunk)
+        send_body(b'')
+        await_only(send({'type': 'http.response.body', 'body': b'', 'more_body': False}))
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+        # сессия потокового ответа создается после teardown контекста приложения, поэтому закрывается здесь
+        db.session.remove()
+
+
+def build_autocomplete():
+    """Функция строит индексы автодополнения при запуске приложения"""
+    with app.app_context():
+        autocomplete.ensure_built()
+        db.session.remove()
+
+
+def dispose_engine():
+    """Функция закрывает соединения пула при остановке приложения"""
+    with app.app_context():
+        db.engine.dispose()
+
+
+async def lifespan(receive, send):
+    """Функция обрабатывает события запуска и остановки приложения. Индексы автодополнения строятся до приема
+    запросов, чтобы запросы не строили их одновременно"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                if autocomplete_enabled:
+                    await greenlet_spawn(build_autocomplete)
+            except Exception:
+                # как и в синхронном режиме, приложение запускается и без индексов, они будут построены при первом
+                # запросе автодополнения
+                app.logger.exception('Не удалось построить индексы автодополнения')
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await greenlet_spawn(dispose_engine)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI приложение с теми же маршрутами /api/*, что и приложение Flask"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise ValueError(f'Тип соединения {scope["type"]} не поддерживается')
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    await greenlet_spawn(run_request, wsgi_environ(scope, b''.join(chunks)), send)
@@ -0,0 +1,252 @@
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from heapq import merge
+from itertools import groupby
+from sqlalchemy import text, event
+from orion import app, db, config
+
+# В данном модуле находится индекс автодополнения по ФИО, номеру телефона и email. Для каждого поля в памяти процесса
+# хранится отсортированный список строк-записей вида "ключ\0person_id" (или "ключ\0person_id\0значение", если
+# значение отличается от нормализованного ключа), поиск по префиксу выполняется двоичным поиском (bisect) без
+# обращения к БД. Индекс строится из таблиц при первом запросе к приложению и обновляется методами записи моделей
+# после commit. Каждый процесс приложения хранит свой индекс, изменения из других процессов и команд импорта и
+# генерации данных подхватываются перестроением индекса раз в refresh_interval секунд, если счетчики изменений таблиц
+# (table_versions) выросли больше, чем их увеличили зафиксированные транзакции этого процесса.
+
+autocomplete_enabled = config.getboolean('AUTOCOMPLETE', 'enabled', fallback=True)
+# количество подсказок в ответе по умолчанию и максимальное
+autocomplete_default_limit = config.getint('AUTOCOMPLETE', 'default_limit', fallback=10)
+autocomplete_max_limit = config.getint('AUTOCOMPLETE', 'max_limit', fallback=50)
+# интервал проверки счетчиков изменений таблиц в секундах, 0 - индекс обновляется только записями этого процесса
+refresh_interval = config.getint('AUTOCOMPLETE', 'refresh_interval', fallback=30)
+# количество пар, начиная с которого изменение применяется к индексу слиянием списков за один проход, а не вставкой
+# или удалением каждой записи (каждая вставка в список сдвигает все записи после нее)
+merge_threshold = 32
+# поля индекса и таблицы, из которых они строятся
+autocomplete_tables = {'full_name': 'persons', 'phone_number': 'phones', 'email_address': 'emails'}
+
+
+def normalize(field, value):
+    """Функция возвращает ключ индекса для значения поля: для номеров телефонов - только цифры, для ФИО и email -
+    значение в нижнем регистре. Префикс запроса нормализуется так же"""
+    if field == 'phone_number':
+        # номера хранятся в виде +7хххххххххх, поэтому префикс 8(912... ищется как 7912...
+        return re.sub(r'^8', '7', re.sub(r'\D', '', value))
+    return value.casefold()
+
+
+class PrefixIndex:
+    """Класс индекса автодополнения одного поля - отсортированного списка строк-записей с поиском по префиксу"""
+
+    def __init__(self, field):
+        self.field = field
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def entry(self, value, person_id):
+        """Метод возвращает строку-запись индекса для значения поля контакта"""
+        key = normalize(self.field, value)
+        return f'{key}\0{person_id}' if key == value else f'{key}\0{person_id}\0{value}'
+
+    def replace(self, entries):
+        """Метод заменяет все записи индекса отсортированным списком записей"""
+        with self._lock:
+            self._entries = entries
+
+    def add(self, pairs):
+        """Метод добавляет в индекс пары (значение, person_id), уже имеющиеся записи не дублируются. Большие пачки
+        сливаются с индексом за один проход (heapq.merge), и новый список заменяет старый"""
+        items = sorted({self.entry(value, person_id) for value, person_id in pairs})
+        with self._lock:
+            if len(items) >= merge_threshold:
+                self._entries = [item for item, _ in groupby(merge(self._entries, items))]
+                return
+            for item in items:
+                position = bisect_left(self._entries, item)
+                if position == len(self._entries) or self._entries[position] != item:
+                    self._entries.insert(position, item)
+
+    def remove(self, pairs):
+        """Метод удаляет из индекса пары (значение, person_id). Для больших пачек индекс фильтруется по множеству
+        удаляемых записей за один проход"""
+        items = {self.entry(value, person_id) for value, person_id in pairs}
+        with self._lock:
+            if len(items) >= merge_threshold:
+                self._entries = [item for item in self._entries if item not in items]
+                return
+            for item in items:
+                position = bisect_left(self._entries, item)
+                if position < len(self._entries) and self._entries[position] == item:
+                    del self._entries[position]
+
+    def complete(self, prefix, limit):
+        """Метод возвращает до limit подсказок - словарей с person_id и значением поля, начинающимся с prefix"""
+        key = normalize(self.field, prefix)
+        result = []
+        with self._lock:
+            position = bisect_left(self._entries, key)
+            for item in self._entries[position:position + limit]:
+                if not item.startswith(key):
+                    break
+                value, person_id, *original = item.split('\0')
+                result.append({'person_id': int(person_id), self.field: original[0] if original else value})
+        return result
+
+    def stats(self):
+        """Метод возвращает количество записей и занимаемую индексом память в байтах (список и строки записей)"""
+        with self._lock:
+            entries = self._entries
+            size = sys.getsizeof(entries) + sum(sys.getsizeof(item) for item in entries)
+        return {'entries': len(entries), 'bytes': size,
+                'bytes_per_million_entries': round(size * 1000000 / len(entries)) if entries else None}
+
+
+class Autocomplete:
+    """Класс индексов автодополнения по всем полям. Индексы строятся из таблиц при первом обращении, изменения,
+    сделанные во время построения, записываются в журнал и применяются к построенному индексу"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.indexes = {field: PrefixIndex(field) for field in tables}
+        self.versions = None
+        self.built_at = None
+        self.build_seconds = None
+        # построение может быть вызвано из ensure_built, уже удерживающего блокировку
+        self._build_lock = threading.RLock()
+        self._journal_lock = threading.Lock()
+        self._journal = None
+        self._checked_at = 0
+        # увеличения счетчиков изменений таблиц транзакциями этого процесса после чтения счетчиков versions
+        self._own_bumps = Counter()
+
+    def table_versions(self):
+        """Метод возвращает счетчики изменений таблиц индекса"""
+        rows = db.session.execute(text('SELECT table_name, version FROM table_versions WHERE table_name = ANY(:tables)'),
+                                  {'tables': list(self.tables.values())}).all()
+        versions = dict(rows)
+        return {table: versions.get(table, 0) for table in self.tables.values()}
+
+    def build(self):
+        """Метод строит индексы всех полей из таблиц БД. Счетчики изменений читаются до чтения данных, поэтому
+        изменение, сделанное во время построения, приведет к повторному построению, а не будет пропущено"""
+        with self._build_lock:
+            start = time.perf_counter()
+            with self._journal_lock:
+                self._journal = []
+                self._own_bumps = Counter()
+            try:
+                versions = self.table_versions()
+                for field, table in self.tables.items():
+                    index = self.indexes[field]
+                    result = db.session.execute(text(f'SELECT {field}, person_id FROM {table}')
+                                                .execution_options(stream_results=True))
+                    entries = [index.entry(value, person_id) for value, person_id in result]
+                    entries.sort()
+                    index.replace(entries)
+                db.session.rollback()
+            finally:
+                with self._journal_lock:
+                    journal, self._journal = self._journal, None
+            for operation, field, pairs in journal:
+                getattr(self.indexes[field], operation)(pairs)
+            self.versions = versions
+            self.built_at = time.time()
+            self.build_seconds = round(time.perf_counter() - start, 3)
+
+    def ensure_built(self):
+        """Метод строит индексы, если они еще не построены, и перестраивает их, если прошло refresh_interval секунд с
+        последней проверки и таблицы изменили другие процессы"""
+        if self.built_at is None:
+            with self._build_lock:
+                if self.built_at is None:
+                    self.build()
+            return
+        if refresh_interval and time.monotonic() - self._checked_at >= refresh_interval:
+            self._checked_at = time.monotonic()
+            versions = self.table_versions()
+            with self._journal_lock:
+                # каждое изменение увеличивает счетчик таблицы на 1: если рост счетчиков совпадает с количеством
+                # изменений этого процесса, они уже применены к индексу и перестраивать его не нужно
+                if versions == {table: version + self._own_bumps[table] for table, version in self.versions.items()}:
+                    self.versions, self._own_bumps = versions, Counter()
+                    return
+            self.build()
+
+    def record_bumps(self, tables):
+        """Метод учитывает увеличение счетчиков изменений таблиц зафиксированной транзакцией этого процесса"""
+        with self._journal_lock:
+            self._own_bumps.update(table for table in tables if table in self.tables.values())
+
+    def update(self, operation, field, pairs):
+        """Метод применяет к индексу поля добавление (add) или удаление (remove) пар (значение, person_id)"""
+        pairs = list(pairs)
+        if not autocomplete_enabled or not pairs:
+            return
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.append((operation, field, pairs))
+        getattr(self.indexes[field], operation)(pairs)
+
+    def complete(self, field, prefix, limit):
+        """Метод возвращает подсказки по префиксу значения поля"""
+        self.ensure_built()
+        return self.indexes[field].complete(prefix, limit)
+
+    def stats(self):
+        """Метод возвращает размер индексов и время их построения"""
+        return {'built_at': self.built_at, 'build_seconds': self.build_seconds, 'refresh_interval': refresh_interval,
+                'fields': {field: index.stats() for field, index in self.indexes.items()}}
+
+
+autocomplete = Autocomplete(autocomplete_tables)
+
+
+def index_add(field, pairs):
+    """Функция добавляет в индекс поля пары (значение, person_id) после сохранения изменений в БД"""
+    autocomplete.update('add', field, pairs)
+
+
+def index_remove(field, pairs):
+    """Функция удаляет из индекса поля пары (значение, person_id) после сохранения изменений в БД"""
+    autocomplete.update('remove', field, pairs)
+
+
+def note_bumps(*tables):
+    """Функция отмечает счетчики изменений таблиц, увеличенные текущей транзакцией. После commit они учитываются
+    индексом как изменения этого процесса"""
+    db.session.info.setdefault('bumped_tables', []).extend(tables)
+
+
+@event.listens_for(db.session, 'after_commit')
+def record_committed_bumps(session):
+    # фиксация точки сохранения (begin_nested) не завершает транзакцию
+    if session.in_nested_transaction():
+        return
+    tables = session.info.pop('bumped_tables', None)
+    if tables:
+        autocomplete.record_bumps(tables)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_rolled_back_bumps(session, previous_transaction):
+    session.info.pop('bumped_tables', None)
+
+
+def build_in_background():
+    """Функция строит индексы в отдельном потоке, чтобы первые запросы к приложению не ждали построения. В
+    асинхронном режиме индексы строятся при запуске приложения модулем asgi"""
+    if app.config.get('ORION_ASYNC_DB'):
+        return
+
+    def target():
+        with app.app_context():
+            autocomplete.ensure_built()
+    threading.Thread(target=target, name='autocomplete-build', daemon=True).start()
+
+
+if autocomplete_enabled:
+    app.before_first_request(build_in_background)
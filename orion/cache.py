@@ -0,0 +1,248 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import json, g, has_request_context
+from orion import config
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# В данном модуле находится read-through кэш для чтения отдельных контактов (методы get_person, get_phone, get_email).
+# По умолчанию используется ограниченный по размеру LRU кэш с временем жизни записей в памяти процесса. Если в
+# config.ini указан redis_url, кэш хранится в общем для всех процессов хранилище Redis. Методы записи моделей точечно
+# заменяют ключи затронутых контактов метками инвалидации.
+
+# метка инвалидации: пока она не истекла, ключ не заполняется при промахе. Иначе чтение, которое при промахе выбрало
+# запись из БД до фиксации изменения, сохранило бы ее в кэш уже после инвалидации
+tombstone = '__invalidated__'
+
+
+def cache_key(entity, person_id):
+    """Функция возвращает ключ кэша для сущности (person, phones, emails) контакта с указанным person_id"""
+    return f'{entity}:{int(person_id)}'
+
+
+class LRUCache:
+    """Класс LRU кэша в памяти процесса с ограничением по количеству записей и временем жизни записей"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self.watermark_lsn = 0
+
+    def get(self, key):
+        """Метод возвращает значение по ключу или None, если ключа нет или время жизни записи истекло"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if value == tombstone:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, nx=False):
+        """Метод сохраняет значение по ключу на ttl секунд (по умолчанию - время жизни кэша), при переполнении удаляя
+        давно не использованные записи. С nx=True значение сохраняется, только если ключа нет или его запись истекла"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            item = self._data.get(key)
+            if nx and item is not None and item[0] >= time.monotonic():
+                return
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        """Метод удаляет из кэша указанные ключи"""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        """Метод удаляет из кэша все записи"""
+        with self._lock:
+            self._data.clear()
+
+    def raise_watermark(self, value):
+        """Метод увеличивает позицию WAL последнего изменения контактов (значение никогда не уменьшается). Позиция
+        хранится вне записей кэша, чтобы ее не вытеснили"""
+        with self._lock:
+            self.watermark_lsn = max(self.watermark_lsn, value)
+
+    def watermark(self):
+        """Метод возвращает позицию WAL последнего изменения контактов или 0, если изменений не было"""
+        return self.watermark_lsn
+
+    def stats(self):
+        """Метод возвращает счетчики попаданий, промахов и вытеснений для подбора размера кэша"""
+        return {'backend': 'memory', 'size': len(self._data), 'max_size': self.max_size, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'expirations': self.expirations}
+
+
+class LocalBackend:
+    """Класс локального хранилища с подмножеством интерфейса клиента Redis (get, set c ex, delete). Используется
+    вместо Redis в тестах и при локальной разработке"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or (item[0] is not None and item[0] < time.monotonic()):
+                self._data.pop(key, None)
+                return None
+            return item[1]
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            item = self._data.get(key)
+            if nx and item is not None and (item[0] is None or item[0] >= time.monotonic()):
+                return None
+            self._data[key] = (time.monotonic() + ex if ex else None, value)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def set_max(self, key, value):
+        """Метод сохраняет число без времени жизни, только если оно больше сохраненного (аналог скрипта
+        raise_watermark_script для Redis)"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < value:
+                self._data[key] = (None, value)
+
+
+# скрипт Redis, атомарно увеличивающий позицию WAL: одновременные изменения в разных процессах не заменят большую
+# позицию меньшей
+raise_watermark_script = """
+if tonumber(ARGV[1]) > tonumber(redis.call('GET', KEYS[1]) or '0') then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+"""
+
+
+class SharedCache:
+    """Класс кэша в общем хранилище (Redis или LocalBackend). Значения хранятся в формате JSON, время жизни и
+    вытеснение записей обеспечивает само хранилище"""
+
+    def __init__(self, backend, ttl, prefix='orion:'):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        raw = self.backend.get(self.prefix + key)
+        value = None if raw is None else json.loads(raw)
+        with self._lock:
+            if value is None or value == tombstone:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None, nx=False):
+        # SET NX выполняется хранилищем атомарно, поэтому метка инвалидации не перезаписывается и между процессами
+        self.backend.set(self.prefix + key, json.dumps(value), ex=ttl or self.ttl, nx=nx)
+
+    def delete(self, *keys):
+        if keys:
+            self.backend.delete(*[self.prefix + key for key in keys])
+
+    def raise_watermark(self, value):
+        if isinstance(self.backend, LocalBackend):
+            self.backend.set_max(self.prefix + 'watermark', value)
+        else:
+            self.backend.eval(raise_watermark_script, 1, self.prefix + 'watermark', value)
+
+    def watermark(self):
+        raw = self.backend.get(self.prefix + 'watermark')
+        return int(raw) if raw else 0
+
+    def stats(self):
+        return {'backend': self.backend.__class__.__name__, 'ttl': self.ttl, 'hits': self.hits,
+                'misses': self.misses, 'evictions': None}
+
+
+def create_cache():
+    """Функция создает кэш по настройкам секции CACHE файла config.ini. Если кэш выключен, создается LRU кэш
+    нулевого размера, который ничего не сохраняет"""
+    if not config.getboolean('CACHE', 'enabled', fallback=True):
+        return LRUCache(max_size=0, ttl=0)
+    ttl = config.getint('CACHE', 'ttl', fallback=60)
+    redis_url = config.get('CACHE', 'redis_url', fallback='')
+    if redis_url:
+        if redis is None:
+            raise ImportError('Для использования redis_url из config.ini установите библиотеку redis')
+        return SharedCache(redis.Redis.from_url(redis_url), ttl)
+    return LRUCache(max_size=config.getint('CACHE', 'max_size', fallback=100000), ttl=ttl)
+
+
+contact_cache = create_cache()
+tombstone_ttl = config.getint('CACHE', 'tombstone_ttl', fallback=5)
+
+
+def invalidate_contact(person_id, *entities):
+    """Функция заменяет в кэше ключи указанных сущностей (person, phones, emails) контакта с указанным person_id
+    метками инвалидации на tombstone_ttl секунд"""
+    for entity in entities:
+        contact_cache.set(cache_key(entity, person_id), tombstone, ttl=tombstone_ttl)
+    if has_request_context():
+        # позицию WAL после изменения сохраняет модуль replicas (raise_watermark)
+        g.invalidated = True
+
+
+def raise_watermark(lsn):
+    """Функция сохраняет позицию WAL основной БД после изменения контактов. Позиция сохраняется в том же запросе, что
+    и метки инвалидации, поэтому она известна кэшу раньше, чем метки истекут"""
+    contact_cache.raise_watermark(lsn)
+
+
+def read_cache(key):
+    """Функция возвращает значение из кэша или None, если ключа нет в кэше или запрос требует свежих данных
+    (токен согласованности, модуль replicas). При промахе запроса к реплике до чтения данных из БД запоминается
+    позиция WAL, которую реплика уже применила: по ней fill_cache решает, можно ли сохранить прочитанное в кэш"""
+    value = None
+    if not (has_request_context() and g.get('fresh_read')):
+        value = contact_cache.get(key)
+    if value is None and has_request_context() and g.get('read_bind') is not None and 'replica_lsn' not in g:
+        # модуль replicas импортируется при обращении, чтобы не менять порядок обработчиков запросов приложения
+        from orion.replicas import replay_lsn
+        g.replica_lsn = replay_lsn(g.read_bind)
+    return value
+
+
+def fill_cache(key, value):
+    """Функция сохраняет в кэш значение, прочитанное из БД при промахе. Ключ не перезаписывается (SET NX): если
+    контакт был изменен во время чтения, метка инвалидации остается в кэше до истечения tombstone_ttl. Значение,
+    прочитанное на реплике (модуль replicas), сохраняется, только если реплика до чтения уже применила последнее
+    изменение контактов: иначе отстающая реплика вернула бы в кэш старые данные после истечения метки инвалидации"""
+    if has_request_context() and g.get('read_bind') is not None:
+        replica_lsn = g.get('replica_lsn')
+        if replica_lsn is None or replica_lsn < contact_cache.watermark():
+            return
+    contact_cache.set(key, value, nx=True)
@@ -0,0 +1,45 @@
+import click
+from flask.cli import AppGroup
+from orion import app
+from orion.importer import import_contacts, import_batch_size
+from orion.plan_check import check_plans, plan_check_min_rows
+
+# В данном модуле описаны консольные команды приложения. Команды вызываются через flask orion <команда>
+
+
+orion_cli = AppGroup('orion', help='Команды обслуживания адресной книги')
+
+
+@orion_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='Формат файла. По умолчанию определяется по расширению')
+@click.option('--batch-size', type=click.IntRange(min=1), default=import_batch_size, show_default=True,
+              help='Количество строк файла, загружаемых в БД за одну транзакцию')
+@click.option('--restart', is_flag=True, help='Начать импорт заново, а не продолжать прерванный')
+@click.option('--rejects', 'rejects_path', type=click.Path(dir_okay=False), default=None,
+              help='Файл для отклоненных строк. По умолчанию <файл>.rejected.ndjson')
+def import_command(path, file_format, batch_size, restart, rejects_path):
+    """Импортирует контакты из файла NDJSON или CSV в таблицы persons, phones и emails"""
+    result = import_contacts(path, file_format, batch_size, restart, rejects_path, report=click.echo)
+    if 'error' in result:
+        raise click.ClickException(result['error'])
+    click.echo(result['response'])
+
+
+@orion_cli.command('check-plans')
+@click.option('--min-rows', type=click.IntRange(min=0), default=plan_check_min_rows, show_default=True,
+              help='Минимальное количество строк таблицы, начиная с которого Seq Scan считается ошибкой')
+@click.option('--analyze/--no-analyze', default=True, show_default=True,
+              help='Обновить статистику таблиц командой ANALYZE перед проверкой')
+def check_plans_command(min_rows, analyze):
+    """Проверяет планы (EXPLAIN) всех видов запросов моделей и завершается с ошибкой при последовательном чтении
+    больших таблиц"""
+    violations = check_plans(min_rows, analyze, report=click.echo)
+    if violations:
+        raise click.ClickException(f'Последовательное чтение таблиц в {len(violations)} запросах: '
+                                   + '; '.join(f'{name} ({table})' for name, table in violations))
+    click.echo('Последовательного чтения больших таблиц не найдено')
+
+
+app.cli.add_command(orion_cli)
@@ -0,0 +1,91 @@
+import zlib
+from flask import request
+from orion import app, config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# В данном модуле находится сжатие ответов API. Кодировка выбирается по заголовку Accept-Encoding клиента из
+# поддерживаемых сервером: zstd (если установлена библиотека zstandard), gzip и deflate. Ответы меньше порога
+# min_size не сжимаются. Потоковые ответы сжимаются по мере отправки, каждая пачка сбрасывается клиенту сразу.
+
+compression_enabled = config.getboolean('COMPRESSION', 'enabled', fallback=True)
+# минимальный размер тела ответа в байтах, начиная с которого ответ сжимается
+compression_min_size = config.getint('COMPRESSION', 'min_size', fallback=1024)
+# уровень сжатия gzip/deflate (1-9) и zstd (1-22)
+compression_level = config.getint('COMPRESSION', 'level', fallback=6)
+zstd_level = config.getint('COMPRESSION', 'zstd_level', fallback=3)
+
+
+def available_encodings():
+    """Функция возвращает поддерживаемые кодировки в порядке предпочтения сервера"""
+    return (['zstd'] if zstandard else []) + ['gzip', 'deflate']
+
+
+def choose_encoding(accept_encodings):
+    """Функция выбирает кодировку из заголовка Accept-Encoding: наибольший вес клиента, при равных весах - порядок
+    предпочтения сервера. Возвращает None, если подходящей кодировки нет"""
+    weighted = [(accept_encodings[encoding], -ind, encoding) for ind, encoding in enumerate(available_encodings())
+                if accept_encodings[encoding] > 0]
+    return max(weighted)[2] if weighted else None
+
+
+def compressor(encoding):
+    """Функция возвращает объект инкрементального сжатия для кодировки и функцию сброса накопленных данных"""
+    if encoding == 'zstd':
+        compress_obj = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+        return compress_obj, lambda: compress_obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+    # wbits 31 - формат gzip, 15 - формат zlib, который в HTTP называется deflate
+    compress_obj = zlib.compressobj(compression_level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+    return compress_obj, lambda: compress_obj.flush(zlib.Z_SYNC_FLUSH)
+
+
+def compress_stream(chunks, encoding):
+    """Функция сжимает поток частей ответа, сбрасывая сжатые данные после каждой части"""
+    compress_obj, flush = compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compress_obj.compress(chunk) + flush()
+            if data:
+                yield data
+        yield compress_obj.flush()
+    finally:
+        # закрываем исходный поток, чтобы освободить контекст запроса и серверный курсор
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_body(body, encoding):
+    """Функция сжимает тело ответа целиком"""
+    compress_obj, _ = compressor(encoding)
+    return compress_obj.compress(body) + compress_obj.flush()
+
+
+@app.after_request
+def compress_response(response):
+    """Обработчик сжимает ответ, если клиент поддерживает одну из кодировок и ответ не меньше порога"""
+    if not compression_enabled or response.status_code < 200 or response.status_code in (204, 304) \
+            or 'Content-Encoding' in response.headers or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if not encoding:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < compression_min_size:
+            return response
+        response.set_data(compress_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # сжатое тело отличается от несжатого побайтно, поэтому ETag становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
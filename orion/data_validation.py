@@ -1,124 +1,90 @@
-from typing import List
-from pydantic import BaseModel, EmailStr, validator
+from typing import List, ClassVar
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy.util import await_only
+from pydantic import BaseModel, EmailStr, ValidationError, validator, root_validator
 from datetime import date
-import re
+from orion import app, config
+from orion.search import search_default_limit, search_max_limit
+from orion.autocomplete import autocomplete_tables, autocomplete_default_limit, autocomplete_max_limit
+# правила проверки контактов выполняются в процессах пула пакетной валидации, поэтому находятся в модуле
+# orion_validation без зависимостей от приложения, а остальные модули импортируют их отсюда
+from orion_validation import file_path_pattern, address_pattern, canonical_phone_number, numeric_person_id, \
+    EmailData, PhoneData, PersonData, validate_chunk
+import asyncio
+import multiprocessing
+import os
 
-# блок с регулярными выражениями для проверки валидности данных
 from pydantic.class_validators import Optional
 
-file_path_validation_regexp = "^\\/([а-яА-Яa-zA-Z-_]+\\/)+([а-яА-Яa-zA-Z-_]+)(\\.)([a-zA-Z]{3,4})$"
-full_name_validation_regexp = "^[А-ЯЁ][а-яёА-ЯЁ\\-]{0,}\\s[А-ЯЁ][а-яёА-ЯЁ\\-]{1,}(\\s[А-ЯЁ][а-яёА-ЯЁ\\-]{1,})?$"
-address_validation_regexp = "^([А-Я][а-яёА-Я\\-]{1,})(?: +[А-Я][а-яёА-Я\\-]{1,})?, +(?:\\d+(?:-[яЯ])? +)?([А-Я]" \
-                            "[а-яёА-Я\\-]{1,})(?:( +[а-яёА-Я][а-яёА-Я\\-]{1,})|( +[а-я]))*?( +\\d+(\\-)?[а-яёА-Я])?," \
-                            " +д. +\\d+[А-Я]{0,1}, +кв. +\\d+$"
-phone_number_validation_regexp = '^((8|\\+7))(\\(?\\d{3}\\)?)([\\d]{7})$'
-person_id_validation_regexp = "^(\\d+)$"
+# максимальный размер страницы при постраничной выборке списков
+max_page_limit = 10000
+# максимальное количество записей в одном запросе к пакетным маршрутам
+max_batch_size = 10000
+# атрибуты контакта, которые можно изменить маршрутом update_persons
+person_patch_fields = ['file_path', 'full_name', 'gender', 'birthday', 'address']
+# атрибуты записей, которые можно выбрать атрибутом fields маршрутов чтения (столбцы json_columns моделей)
+person_fields = ['person_id', 'file_path', 'full_name', 'gender', 'birthday', 'address']
+phone_fields = ['person_id', 'phone_type', 'phone_number']
+email_fields = ['person_id', 'email_type', 'email_address']
+# пакетная валидация: списки от parallel_threshold контактов проверяются в пуле из validation_workers процессов
+# (0 - по количеству ядер) частями по validation_chunk_size контактов
+validation_workers = config.getint('VALIDATION', 'workers', fallback=0)
+validation_chunk_size = config.getint('VALIDATION', 'chunk_size', fallback=2000)
+parallel_threshold = config.getint('VALIDATION', 'parallel_threshold', fallback=5000)
 
 
-# определяем модели в классах библиотеки pydantic
-class EmailData(BaseModel):
-    email_address: EmailStr
-    email_type: str
-    person_id: Optional[str]
-    old_email_address: Optional[EmailStr]
-
-    @validator('email_type')
-    def email_type_validator(cls, v):
-        email_types = ['Личная', 'Рабочая']
-        if v not in email_types:
-            raise ValueError(f'Значение атрибута email_type должно соответствовать одному из вариантов -  '
-                             f'{", ".join(email_types)}. Было получено - {v}')
-        return v.title()
+class PersonFilterData(PersonData):
+    """Атрибуты контакта для выбора контактов по точному совпадению (маршрут delete_persons) и основа изменений
+    контакта PersonPatchData: переданные атрибуты проверяются по правилам PersonData, нужен хотя бы один из них.
+    Фильтр удаления не принимает person_id и неизвестные атрибуты: иначе они были бы пропущены при выборе контактов,
+    и фильтр удалил бы больше контактов, чем ожидает клиент"""
+    file_path: Optional[str]
+    full_name: Optional[str]
+    gender: Optional[str]
+    birthday: Optional[date]
+    address: Optional[str]
+    person_id_allowed: ClassVar[bool] = False
 
-    @validator('person_id')
-    def order_validator(cls, v):
-        if not v.isdigit():
-            raise ValueError(f'Значение атрибута person_id должно быть числовым')
-        return v.title()
-
-
-class PhoneData(BaseModel):
-    phone_number: str
-    phone_type: str
-    person_id: Optional[str]
-    old_phone_number: Optional[str]
-
-    @validator('phone_type')
-    def phone_type_validator(cls, v):
-        phone_types = ['Городской', 'Мобильный']
-        if v not in phone_types:
-            raise ValueError(f'Значение атрибута phone_number должно соответствовать одному из вариантов -  '
-                             f'{", ".join(phone_types)}. Было получено - {v}')
-        return v.title()
-
-    @validator('phone_number')
-    def phone_number_validator(cls, v):
-        if not re.match(phone_number_validation_regexp, v):
-            raise ValueError(f'Неверный формат атрибута phone_number. Ожидается номер в одном из форматов -'
-                             f' +7хххххххххх/+7(ххх)ххххххх/8хххххххххх/8(ххх)ххххххх. Было получено - {v}')
-        return v.title()
-
-    @validator('old_phone_number')
-    def old_phone_number_validator(cls, v):
-        if not re.match(phone_number_validation_regexp, v):
-            raise ValueError(f'Неверный формат атрибута old_phone_number. Ожидается номер в одном из форматов -'
-                             f' +7хххххххххх/+7(ххх)ххххххх/8хххххххххх/8(ххх)ххххххх. Было получено - {v}')
-        return v.title()
-
-    @validator('person_id')
-    def order_validator(cls, v):
-        if not v.isdigit():
-            raise ValueError(f'Значение атрибута person_id должно быть числовым')
-        return v.title()
+    class Config:
+        extra = 'forbid'
 
+    @root_validator(skip_on_failure=True)
+    def fields_validator(cls, values):
+        if values.get('person_id') is not None and not cls.person_id_allowed:
+            raise ValueError('Атрибут person_id в фильтре не поддерживается. Для удаления контактов по идентификаторам '
+                             'используйте атрибут person_ids')
+        if values.get('phones') is not None or values.get('emails') is not None:
+            raise ValueError('Атрибуты phones и emails в этом запросе не поддерживаются. Телефоны и email контакта '
+                             'изменяются маршрутами update_phone и update_email')
+        if all(values.get(field) is None for field in person_patch_fields):
+            raise ValueError(f'Должен быть передан хотя бы один из атрибутов - {", ".join(person_patch_fields)}')
+        return values
 
-class PersonData(BaseModel):
-    file_path: str
-    full_name: str
-    gender: str
-    birthday: date
-    address: str
-    person_id: Optional[str]
-    phones: Optional[List[PhoneData]]
-    emails: Optional[List[EmailData]]
-
-    @validator('file_path')
-    def file_path_validator(cls, v):
-        if not re.match(file_path_validation_regexp, v):
-            raise ValueError(f'Неверный формат атрибута file_path. Ожидается путь в подобном формате - '
-                             f'/media/profile_images/profile_photo.jpg. Было получено - {v}')
-        return v.title()
 
-    @validator('full_name')
-    def full_name_validator(cls, v):
-        if not re.match(full_name_validation_regexp, v):
-            raise ValueError(f'Неверный формат атрибута full_name. Ожидается ФИО в подобном формате - '
-                             f'Иванов Иван Иванович. Было получено - {v}')
-        return v.title()
+class PersonPatchData(PersonFilterData):
+    """Изменение контакта для пакетного маршрута update_persons: обязателен только person_id, остальные атрибуты
+    контакта проверяются по правилам PersonData, если переданы. Непереданные атрибуты не изменяются"""
+    person_id: str
+    person_id_allowed: ClassVar[bool] = True
 
-    @validator('gender')
-    def gender_validator(cls, v):
-        genders = ['Мужской', 'Женский']
-        if v not in genders:
-            raise ValueError(f'Значение атрибута genders должно соответствовать одному из вариантов - '
-                             f'{", ".join(genders)}. Было получено - {v}')
-        return v.title()
+    class Config:
+        extra = 'ignore'
 
-    @validator('address')
-    def address_validator(cls, v):
-        if not re.match(address_validation_regexp, v):
-            raise ValueError('Неверный формат атрибута address. Ожидается адрес в  подобном формате - '
-                             'Красноярск, Мира, д. 1, кв. 3 (элементы - "город", "улица", "дом", "квартира",'
-                             ' разделены запятой и пробелом, количество пробелов между элементами  и внутри'
-                             ' них может быть больше одного, названия улиц и городов начинаются с заглавной '
-                             f'буквы). Было получено - {v}')
-        return v.title()
 
-    @validator('person_id')
-    def order_validator(cls, v):
-        if not v.isdigit():
-            raise ValueError(f'Значение атрибута person_id должно быть числовым')
-        return v.title()
+def validate_person_patches(items):
+    """Функция проверяет список изменений контактов за один проход и возвращает список проверенных изменений
+    PersonPatchData и полный список ошибок с индексами невалидных изменений"""
+    if not 1 <= len(items) <= max_batch_size:
+        return [], [{'index': None, 'error': f'Количество изменений должно быть в диапазоне от 1 до {max_batch_size}'}]
+    patches, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            patches.append(PersonPatchData(**item))
+        except ValidationError as ve:
+            errors.append({'index': index, 'error': ve.errors()})
+        except TypeError:
+            errors.append({'index': index, 'error': 'Изменение должно быть объектом JSON с атрибутами контакта'})
+    return patches, errors
 
 
 class SortedData(BaseModel):
@@ -143,12 +109,182 @@ class SortedData(BaseModel):
         return v.title()
 
 
+class PageData(BaseModel):
+    limit: Optional[int]
+    cursor: Optional[str]
+    stream: Optional[bool]
+
+    @validator('limit')
+    def limit_validator(cls, v):
+        if not 1 <= v <= max_page_limit:
+            raise ValueError(f'Значение атрибута limit должно быть в диапазоне от 1 до {max_page_limit}')
+        return v
+
+
+class ExpandData(BaseModel):
+    expand: Optional[List[str]]
+
+    @validator('expand', pre=True)
+    def expand_validator(cls, v):
+        relationships = ['phones', 'emails']
+        # связанные сущности можно передать списком или строкой через запятую - "phones,emails"
+        if isinstance(v, str):
+            v = [item.strip() for item in v.split(',') if item.strip()]
+        if isinstance(v, list):
+            if not set(v) <= set(relationships):
+                raise ValueError(f'Значения атрибута expand должны соответствовать вариантам - '
+                                 f'{", ".join(relationships)}')
+            # повторяющиеся сущности отбрасываем, сохраняя порядок, чтобы не загружать их дважды
+            v = list(dict.fromkeys(v))
+        return v
+
+
+class FieldsData(BaseModel):
+    """Набор атрибутов записей, которые возвращают маршруты чтения контактов. person_id возвращается всегда"""
+    fields: Optional[List[str]]
+    available_fields: ClassVar[List[str]] = person_fields
+
+    @validator('fields', pre=True)
+    def fields_validator(cls, v):
+        # атрибуты можно передать списком или строкой через запятую - "person_id,full_name"
+        if isinstance(v, str):
+            v = [item.strip() for item in v.split(',') if item.strip()]
+        if isinstance(v, list):
+            if not v or not set(v) <= set(cls.available_fields):
+                raise ValueError(f'Значения атрибута fields должны соответствовать вариантам - '
+                                 f'{", ".join(cls.available_fields)}')
+            # повторяющиеся атрибуты отбрасываем, сохраняя порядок
+            v = list(dict.fromkeys(v))
+        return v
+
+
+class PhoneFieldsData(FieldsData):
+    available_fields: ClassVar[List[str]] = phone_fields
+
+
+class EmailFieldsData(FieldsData):
+    available_fields: ClassVar[List[str]] = email_fields
+
+
 class IdData(BaseModel):
     person_id: str
 
     @validator('person_id')
     def order_validator(cls, v):
-        if not v.isdigit():
-            raise ValueError(f'Значение атрибута person_id должно быть числовым')
-        return v.title()
+        return numeric_person_id(v)
+
+
+class IdsData(BaseModel):
+    person_ids: List[str]
+
+    @validator('person_ids')
+    def person_ids_validator(cls, v):
+        if not 1 <= len(v) <= max_batch_size:
+            raise ValueError(f'Количество значений в атрибуте person_ids должно быть в диапазоне от 1 до {max_batch_size}')
+        if not all(person_id.isascii() and person_id.isdigit() for person_id in v):
+            raise ValueError(f'Значения атрибута person_ids должны быть числовыми')
+        # идентификаторы приводятся к виду person_id в ответе ("007" -> "7"), повторяющиеся отбрасываем, сохраняя порядок
+        return list(dict.fromkeys(str(int(person_id)) for person_id in v))
+
+
+class PhoneNumberData(BaseModel):
+    phone_number: str
+
+    @validator('phone_number')
+    def phone_number_validator(cls, v):
+        return canonical_phone_number(v, 'phone_number')
+
+
+class EmailAddressData(BaseModel):
+    email_address: EmailStr
+
+
+_validation_pool = None
+
+
+def validation_pool():
+    """Функция возвращает пул процессов для пакетной валидации. Пул создается при первой большой пачке и
+    переиспользуется, процессы запускаются через spawn, чтобы не наследовать соединения с БД и потоки сервера.
+    Функция validate_chunk находится в модуле orion_validation, поэтому процессы пула не импортируют приложение и
+    не читают config.ini: настройки пакетной валидации применяются только в этом процессе"""
+    global _validation_pool
+    if _validation_pool is None:
+        _validation_pool = ProcessPoolExecutor(max_workers=validation_workers or None,
+                                               mp_context=multiprocessing.get_context('spawn'))
+    return _validation_pool
+
+
+def validate_persons(items):
+    """Функция проверяет список контактов за один проход и возвращает список проверенных контактов ValidPerson и
+    полный список ошибок с индексами невалидных контактов. Большие списки проверяются частями в пуле процессов"""
+    if len(items) < parallel_threshold or (validation_workers or os.cpu_count() or 1) == 1:
+        return validate_chunk(0, items)
+    chunks = [validation_pool().submit(validate_chunk, start, items[start:start + validation_chunk_size])
+              for start in range(0, len(items), validation_chunk_size)]
+    if app.config.get('ORION_ASYNC_DB'):
+        # в асинхронном режиме (модуль asgi) ожидание пула не блокирует цикл событий
+        chunks = await_only(asyncio.gather(*[asyncio.wrap_future(chunk) for chunk in chunks]))
+    else:
+        chunks = [chunk.result() for chunk in chunks]
+    persons, errors = [], []
+    for chunk_persons, chunk_errors in chunks:
+        persons += chunk_persons
+        errors += chunk_errors
+    return persons, errors
+
+
+class SearchData(BaseModel):
+    query: str
+    search_in: Optional[List[str]]
+    limit: Optional[int] = search_default_limit
+    cursor: Optional[str]
+
+    @validator('query')
+    def query_validator(cls, v):
+        v = ' '.join(v.split())
+        # поиск по сходству триграмм требует не меньше трех символов
+        if not 3 <= len(v) <= 200:
+            raise ValueError('Длина атрибута query должна быть от 3 до 200 символов')
+        return v
+
+    @validator('search_in', pre=True)
+    def search_in_validator(cls, v):
+        fields = ['email_address', 'phone_number']
+        # дополнительные поля для поиска можно передать списком или строкой через запятую
+        if isinstance(v, str):
+            v = [item.strip() for item in v.split(',') if item.strip()]
+        if isinstance(v, list) and not set(v) <= set(fields):
+            raise ValueError(f'Значения атрибута search_in должны соответствовать вариантам - {", ".join(fields)}')
+        return v
+
+    @validator('limit')
+    def limit_validator(cls, v):
+        if not 1 <= v <= search_max_limit:
+            raise ValueError(f'Значение атрибута limit должно быть в диапазоне от 1 до {search_max_limit}')
+        return v
+
+
+class AutocompleteData(BaseModel):
+    field: str
+    prefix: str
+    limit: Optional[int] = autocomplete_default_limit
+
+    @validator('field')
+    def field_validator(cls, v):
+        if v not in autocomplete_tables:
+            raise ValueError(f'Значение атрибута field должно соответствовать одному из вариантов - '
+                             f'{", ".join(autocomplete_tables)}')
+        return v
+
+    @validator('prefix')
+    def prefix_validator(cls, v):
+        # пробел в конце префикса не удаляется: "Иванов " подсказывает только контакты с фамилией Иванов
+        if not v.strip() or len(v) > 100:
+            raise ValueError('Длина атрибута prefix должна быть от 1 до 100 символов')
+        return v.lstrip()
 
+    @validator('limit')
+    def limit_validator(cls, v):
+        if not 1 <= v <= autocomplete_max_limit:
+            raise ValueError(f'Значение атрибута limit должно быть в диапазоне от 1 до {autocomplete_max_limit}')
+        return v
@@ -0,0 +1,68 @@
+import hashlib
+import json
+from flask import request, Response
+from sqlalchemy import exc
+from orion import db
+from orion.models import Person, TableVersion
+from orion.serialization import json_response
+
+# В данном модуле находятся функции для условных запросов (If-None-Match). ETag вычисляется не из тела ответа, а из
+# дешевого маркера версии: для отдельного контакта - из столбца persons.version, для списков - из счетчиков изменений
+# таблиц table_versions. Поэтому на неизменившиеся данные отвечаем 304 без выборки и сериализации самих данных.
+
+
+def make_etag(*parts):
+    """Функция вычисляет ETag из маркера версии и параметров запроса, от которых зависит тело ответа"""
+    return hashlib.sha1(json.dumps(parts, default=str, sort_keys=True).encode()).hexdigest()
+
+
+def request_parts():
+    """Функция возвращает параметры запроса, от которых зависит тело ответа: маршрут, тело запроса и заголовок Accept"""
+    return request.path, request.get_data(as_text=True), request.headers.get('Accept', '')
+
+
+def person_etag(person_id):
+    """Функция возвращает ETag для маршрутов чтения контакта по версии контакта или None, если контакта нет в БД"""
+    try:
+        version = Person.current_version(person_id)
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        return None
+    return make_etag(version, person_id, *request_parts()) if version is not None else None
+
+
+def list_etag(*tables):
+    """Функция возвращает ETag для маршрутов получения списков по счетчикам изменений указанных таблиц. Счетчики
+    всех таблиц читаются одним запросом"""
+    try:
+        versions = TableVersion.current(*tables)
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        return None
+    return make_etag(versions, *request_parts())
+
+
+def etag_matches(etag):
+    """Функция проверяет, совпадает ли ETag с одним из значений заголовка If-None-Match запроса. Сравнение слабое,
+    так как сжатые ответы получают слабый ETag"""
+    return bool(etag) and request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag):
+    """Функция возвращает пустой ответ 304 с заголовком ETag"""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def with_etag(response, etag):
+    """Функция добавляет к ответу заголовок ETag"""
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
+def etag_response(result, etag):
+    """Функция возвращает результат метода модели в формате JSON с заголовком ETag. Ответы с ошибкой не получают
+    ETag, чтобы клиент не закэшировал ошибку"""
+    return with_etag(json_response(result), None if 'error' in result else etag)
@@ -0,0 +1,244 @@
+import csv
+import io
+import json
+import os
+import traceback
+from itertools import islice
+import psycopg2
+from sqlalchemy import exc
+from orion import db
+from orion.data_validation import validate_persons
+from orion.models import ImportProgress, TableVersion
+
+# В данном модуле описан массовый импорт контактов из файлов NDJSON и CSV. Файл читается потоково, строки проверяются
+# пачками по правилам модуля data_validation и загружаются командой COPY во временные staging таблицы, откуда
+# переносятся в таблицы persons, phones и emails несколькими set-based запросами. Состояние импорта сохраняется в
+# таблице import_progress в одной транзакции с каждой пачкой, поэтому прерванный импорт продолжается с места остановки.
+
+# количество строк файла, которое проверяется и загружается в БД за одну транзакцию
+import_batch_size = 5000
+# количество попыток загрузки пачки: параллельная запись может добавить тот же телефон или email между проверкой
+# повторов и переносом пачки, тогда пачка загружается заново и такой контакт отклоняется при повторной проверке
+load_attempts = 3
+# столбцы CSV файла: телефон и email необязательны, у каждого контакта может быть не больше одного телефона и email
+csv_columns = ['file_path', 'full_name', 'gender', 'birthday', 'address', 'phone_number', 'phone_type',
+               'email_address', 'email_type']
+
+create_staging_tables_sql = '''
+    CREATE TEMP TABLE IF NOT EXISTS import_persons (
+        row_num bigint PRIMARY KEY, person_id integer, file_path varchar(100), full_name varchar(100),
+        gender varchar(30), birthday date, address varchar) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS import_phones (
+        row_num bigint, phone_type varchar(30), phone_number varchar(30)) ON COMMIT DELETE ROWS;
+    CREATE TEMP TABLE IF NOT EXISTS import_emails (
+        row_num bigint, email_type varchar(30), email_address varchar(254)) ON COMMIT DELETE ROWS;
+'''
+# телефоны и email пачки, которые уже есть в БД
+existing_values_sql = '''
+    SELECT 'phone', phone_number FROM phones WHERE phone_number = ANY(%(phones)s::varchar[])
+    UNION ALL
+    SELECT 'email', email_address FROM emails WHERE email_address = ANY(%(emails)s::varchar[])
+'''
+# идентификаторы выдаются из последовательности persons заранее, чтобы связать телефоны и email с контактами по row_num
+merge_sql = '''
+    UPDATE import_persons SET person_id = nextval(pg_get_serial_sequence('persons', 'person_id'));
+    INSERT INTO persons (person_id, file_path, full_name, gender, birthday, address)
+        SELECT person_id, file_path, full_name, gender, birthday, address FROM import_persons ORDER BY row_num;
+    INSERT INTO phones (person_id, phone_type, phone_number)
+        SELECT DISTINCT ON (s.phone_number) p.person_id, s.phone_type, s.phone_number
+        FROM import_phones s JOIN import_persons p USING (row_num);
+    INSERT INTO emails (person_id, email_type, email_address)
+        SELECT DISTINCT ON (s.email_address) p.person_id, s.email_type, s.email_address
+        FROM import_emails s JOIN import_persons p USING (row_num);
+'''
+
+
+def detect_format(path):
+    """Функция определяет формат файла импорта по его расширению"""
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def read_rows(path, file_format):
+    """Функция построчно читает файл импорта и возвращает генератор необработанных строк: для NDJSON - строки файла,
+    для CSV - словари со значениями столбцов"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            yield from f
+
+
+def parse_row(row):
+    """Функция преобразует необработанную строку файла в словарь контакта в формате маршрута /api/add_person.
+    Для пустых строк NDJSON возвращает None"""
+    if isinstance(row, str):
+        return json.loads(row) if row.strip() else None
+    item = {key: row.get(key) for key in csv_columns[:5]}
+    item['phones'] = [{'phone_number': row['phone_number'], 'phone_type': row.get('phone_type')}] \
+        if row.get('phone_number') else []
+    item['emails'] = [{'email_address': row['email_address'], 'email_type': row.get('email_type')}] \
+        if row.get('email_address') else []
+    return item
+
+
+def validate_batch(rows, first_row_num):
+    """Функция проверяет пачку строк по правилам модуля data_validation и возвращает список пар (номер строки,
+    ValidPerson) для валидных контактов и список отклоненных строк с описанием ошибок"""
+    items, row_nums, rejected = [], [], []
+    for row_num, row in enumerate(rows, start=first_row_num):
+        try:
+            item = parse_row(row)
+        except (ValueError, TypeError) as e:
+            rejected.append({'row': row_num, 'error': f'Строка не соответствует формату контакта - {e}'})
+            continue
+        if item is not None:
+            items.append(item)
+            row_nums.append(row_num)
+    # вся пачка проверяется за один проход, большие пачки - в пуле процессов
+    persons, errors = validate_persons(items)
+    invalid = {error['index'] for error in errors}
+    rejected += [{'row': row_nums[error['index']], 'error': error['error']} for error in errors]
+    contacts = list(zip([row_num for ind, row_num in enumerate(row_nums) if ind not in invalid], persons))
+    return contacts, rejected
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Функция загружает строки в таблицу командой COPY через буфер в памяти"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def split_duplicates(contacts, existing_phones, existing_emails):
+    """Функция делит пачку контактов на принимаемые и номера отклоненных строк. Контакт отклоняется, если его телефон
+    или email уже есть в БД или есть у принятого контакта выше по файлу. Отклоненный контакт не занимает свои значения,
+    поэтому контакт ниже по файлу с тем же телефоном или email из-за него не отклоняется"""
+    accepted, duplicate_rows = [], []
+    taken_phones, taken_emails = set(existing_phones), set(existing_emails)
+    for row_num, item in contacts:
+        phones = {phone.phone_number for phone in item.phones or []}
+        emails = {email.email_address for email in item.emails or []}
+        if phones & taken_phones or emails & taken_emails:
+            duplicate_rows.append(row_num)
+            continue
+        taken_phones |= phones
+        taken_emails |= emails
+        accepted.append((row_num, item))
+    return accepted, duplicate_rows
+
+
+def load_batch(contacts):
+    """Функция загружает пачку проверенных контактов в staging таблицы и переносит их в таблицы persons, phones и
+    emails. Возвращает количество добавленных контактов и номера строк, отклоненных из-за повторяющихся телефонов
+    и email. Транзакцию завершает вызывающая функция"""
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(existing_values_sql,
+                   {'phones': [phone.phone_number for _, item in contacts for phone in item.phones or []],
+                    'emails': [email.email_address for _, item in contacts for email in item.emails or []]})
+    existing = cursor.fetchall()
+    contacts, duplicate_rows = split_duplicates(contacts, {value for kind, value in existing if kind == 'phone'},
+                                                {value for kind, value in existing if kind == 'email'})
+    if not contacts:
+        return 0, duplicate_rows
+    cursor.execute(create_staging_tables_sql)
+    copy_rows(cursor, 'import_persons', ['row_num', 'file_path', 'full_name', 'gender', 'birthday', 'address'],
+              [(row_num, item.file_path, item.full_name, item.gender, item.birthday.isoformat(), item.address)
+               for row_num, item in contacts])
+    copy_rows(cursor, 'import_phones', ['row_num', 'phone_type', 'phone_number'],
+              [(row_num, phone.phone_type, phone.phone_number) for row_num, item in contacts
+               for phone in item.phones or []])
+    copy_rows(cursor, 'import_emails', ['row_num', 'email_type', 'email_address'],
+              [(row_num, email.email_type, email.email_address) for row_num, item in contacts
+               for email in item.emails or []])
+    cursor.execute(merge_sql)
+    TableVersion.bump('persons', 'phones', 'emails')
+    return len(contacts), duplicate_rows
+
+
+def load_contacts(contacts):
+    """Функция загружает пачку проверенных контактов функцией load_batch в точке сохранения транзакции. При нарушении
+    уникальности из-за параллельной записи загрузка повторяется, после load_attempts неудачных попыток отклоняется вся
+    пачка. Возвращает количество добавленных контактов и список отклоненных строк с описанием ошибок"""
+    for attempt in range(load_attempts):
+        savepoint = db.session.begin_nested()
+        try:
+            imported, duplicate_rows = load_batch(contacts)
+        except (exc.IntegrityError, psycopg2.IntegrityError):
+            savepoint.rollback()
+            continue
+        savepoint.commit()
+        return imported, [{'row': row_num, 'error': 'Телефон или email контакта уже есть в БД или повторяется в файле'}
+                          for row_num in duplicate_rows]
+    return 0, [{'row': row_num, 'error': 'Пачка не загружена: телефоны или email контактов одновременно добавляются '
+                                         'другим процессом'} for row_num, item in contacts]
+
+
+def truncate_rejects(rejects_path, rows_done):
+    """Функция удаляет из файла отклоненных строк записи строк после rows_done. Они записываются до фиксации транзакции
+    пачки и остаются в файле, если импорт был прерван до ее фиксации, а при продолжении импорта записываются заново"""
+    if not os.path.exists(rejects_path):
+        return
+    with open(rejects_path, encoding='utf-8') as f:
+        lines = [line for line in f if line.strip() and json.loads(line)['row'] <= rows_done]
+    with open(rejects_path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+
+
+def import_contacts(path, file_format=None, batch_size=import_batch_size, restart=False, rejects_path=None,
+                    report=print):
+    """Функция импортирует контакты из файла NDJSON или CSV пачками по batch_size строк. Если предыдущий импорт этого
+    файла был прерван, он продолжается с первой незагруженной строки (restart=True начинает импорт заново).
+    Отклоненные строки с описанием ошибок записываются в файл rejects_path в формате NDJSON, о ходе импорта
+    сообщается через функцию report"""
+    source = os.path.abspath(path)
+    file_format = file_format or detect_format(path)
+    rejects_path = rejects_path or source + '.rejected.ndjson'
+    try:
+        progress = ImportProgress.query.get(source)
+        if progress and progress.finished and not restart:
+            return {'error': f'Файл {source} уже был импортирован. Для повторного импорта используйте --restart'}
+        if progress is None:
+            progress = ImportProgress(source=source)
+            db.session.add(progress)
+        if restart or not progress.rows_done:
+            progress.rows_done, progress.rows_imported, progress.rows_rejected = 0, 0, 0
+            progress.finished = False
+            open(rejects_path, 'w').close()
+        db.session.commit()
+        if progress.rows_done:
+            truncate_rejects(rejects_path, progress.rows_done)
+            report(f'Продолжаем импорт {source} со строки {progress.rows_done + 1}')
+        rows = islice(read_rows(source, file_format), progress.rows_done, None)
+        with open(rejects_path, 'a', encoding='utf-8') as rejects_file:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                contacts, rejected = validate_batch(batch, progress.rows_done + 1)
+                imported, load_rejected = load_contacts(contacts) if contacts else (0, [])
+                rejected += load_rejected
+                # отклоненные строки записываются до фиксации пачки, лишние записи прерванной пачки удаляет
+                # truncate_rejects при продолжении импорта
+                for rejected_row in sorted(rejected, key=lambda r: r['row']):
+                    rejects_file.write(json.dumps(rejected_row, ensure_ascii=False, default=str) + '\n')
+                rejects_file.flush()
+                # состояние импорта фиксируется в той же транзакции, что и данные пачки
+                progress.rows_done += len(batch)
+                progress.rows_imported += imported
+                progress.rows_rejected += len(rejected)
+                db.session.commit()
+                report(f'Обработано строк: {progress.rows_done}, добавлено контактов: {progress.rows_imported}, '
+                       f'отклонено: {progress.rows_rejected}')
+        progress.finished = True
+        db.session.commit()
+        return {'response': f'Импорт {source} завершен. Добавлено контактов: {progress.rows_imported}, отклонено '
+                            f'строк: {progress.rows_rejected} (см. {rejects_path})'}
+    except exc.OperationalError as oe:
+        db.session.rollback()
+        return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+    except OSError as oe:
+        db.session.rollback()
+        return {'error': f'Не удалось прочитать файл {source} или записать файл {rejects_path} - {oe}',
+                'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
@@ -0,0 +1,223 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from flask import request, g, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from orion import app
+
+# В данном модуле находятся метрики приложения в текстовом формате Prometheus (маршрут GET /metrics): количество
+# запросов, гистограммы времени ответа и количество ошибок по маршрутам, количество и время SQL запросов по маршрутам
+# (события движка SQLAlchemy), время ожидания соединения из пула и заполненность пулов. Ошибки делятся по категориям,
+# которые различают обработчики, - по атрибуту exception_name ответа (BadRequest, ValidationError, OperationalError и
+# т.д.), а необработанные исключения - по классу исключения. Метрики собираются в памяти процесса: при запуске
+# нескольких процессов каждый процесс отдает свои метрики.
+
+# границы корзин гистограмм в секундах
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+sql_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+# ответы обработчиков с ошибкой начинаются с ключа error (ключи JSON отсортированы), категория - атрибут exception_name
+error_body_pattern = re.compile(rb'^\{\s*"error"')
+exception_name_pattern = re.compile(rb'"exception_name":\s*"(\w+)"')
+# маршрут для метрик фоновых запросов к БД (построение индексов автодополнения и т.д.)
+background_route = 'background'
+
+
+class Histogram:
+    """Класс гистограммы Prometheus: количество наблюдений по корзинам, сумма и количество для каждого набора меток"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self, labels, value):
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def render(self, name, label_names):
+        lines = []
+        for labels, counts in self.counts.items():
+            base = format_labels(label_names, labels)
+            total = 0
+            for bucket, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                lines.append(f'{name}_bucket{{{base}{"," if base else ""}le="{bucket}"}} {total}')
+            lines.append(f'{name}_sum{{{base}}} {self.sums[labels]}')
+            lines.append(f'{name}_count{{{base}}} {total}')
+        return lines
+
+
+class Metrics:
+    """Класс метрик процесса. Изменения выполняются под блокировкой одним коротким участком на запрос"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.errors = {}
+        self.latency = Histogram(latency_buckets)
+        self.sql = Histogram(sql_buckets)
+        self.checkout_wait = Histogram(latency_buckets)
+        self.engines = []
+
+    def count(self, counter, labels, value=1):
+        counter[labels] = counter.get(labels, 0) + value
+
+    def record_request(self, route, method, status, error, seconds, sql_timings):
+        with self.lock:
+            self.count(self.requests, (route, method, status))
+            if error:
+                self.count(self.errors, (route, error))
+            self.latency.observe((route, method), seconds)
+            for sql_seconds in sql_timings:
+                self.sql.observe((route,), sql_seconds)
+
+    def record_sql(self, route, seconds):
+        with self.lock:
+            self.sql.observe((route,), seconds)
+
+    def record_checkout(self, pool_name, seconds):
+        with self.lock:
+            self.checkout_wait.observe((pool_name,), seconds)
+
+    def render(self):
+        """Метод возвращает метрики в текстовом формате Prometheus"""
+        with self.lock:
+            lines = ['# HELP orion_http_requests_total Количество запросов по маршрутам',
+                     '# TYPE orion_http_requests_total counter']
+            lines += [f'orion_http_requests_total{{{format_labels(("route", "method", "status"), labels)}}} {value}'
+                      for labels, value in self.requests.items()]
+            lines += ['# HELP orion_http_errors_total Количество ответов с ошибкой по маршрутам и категориям ошибок',
+                      '# TYPE orion_http_errors_total counter']
+            lines += [f'orion_http_errors_total{{{format_labels(("route", "error"), labels)}}} {value}'
+                      for labels, value in self.errors.items()]
+            lines += ['# HELP orion_http_request_duration_seconds Время обработки запроса',
+                      '# TYPE orion_http_request_duration_seconds histogram']
+            lines += self.latency.render('orion_http_request_duration_seconds', ('route', 'method'))
+            lines += ['# HELP orion_db_statement_duration_seconds Время выполнения SQL запросов по маршрутам',
+                      '# TYPE orion_db_statement_duration_seconds histogram']
+            lines += self.sql.render('orion_db_statement_duration_seconds', ('route',))
+            lines += ['# HELP orion_db_pool_checkout_wait_seconds Время ожидания соединения из пула',
+                      '# TYPE orion_db_pool_checkout_wait_seconds histogram']
+            lines += self.checkout_wait.render('orion_db_pool_checkout_wait_seconds', ('pool',))
+        lines += render_pools(self.engines)
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(names, values):
+    """Функция возвращает метки Prometheus в виде name="value" через запятую с экранированием значений"""
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def pool_name(engine):
+    """Функция возвращает название пула движка для меток: адрес сервера и имя БД без пароля"""
+    return f'{engine.url.host}:{engine.url.port or 5432}/{engine.url.database}'
+
+
+def render_pools(engines):
+    """Функция возвращает метрики заполненности пулов соединений движков. Заполненность - доля выданных соединений
+    от максимального количества (pool_size + max_overflow)"""
+    lines = ['# HELP orion_db_pool_checked_out Количество выданных соединений пула',
+             '# TYPE orion_db_pool_checked_out gauge',
+             '# HELP orion_db_pool_saturation Доля выданных соединений от максимального размера пула',
+             '# TYPE orion_db_pool_saturation gauge']
+    for engine in engines:
+        pool = engine.pool
+        if not hasattr(pool, 'checkedout'):
+            continue
+        labels = format_labels(('pool',), (pool_name(engine),))
+        capacity = pool.size() + max(getattr(pool, '_max_overflow', 0), 0)
+        lines.append(f'orion_db_pool_checked_out{{{labels}}} {pool.checkedout()}')
+        if capacity:
+            lines.append(f'orion_db_pool_saturation{{{labels}}} {round(pool.checkedout() / capacity, 4)}')
+    return lines
+
+
+metrics = Metrics()
+
+
+def current_route():
+    """Функция возвращает шаблон маршрута текущего запроса или background вне запроса"""
+    if not has_request_context():
+        return background_route
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def instrument_engine(engine):
+    """Функция добавляет к движку замер времени ожидания соединения из пула. Обертка ставится на метод движка, а не
+    пула, потому что при dispose пул создается заново"""
+    raw_connection = engine.raw_connection
+    name = pool_name(engine)
+
+    def timed_raw_connection(*args, **kwargs):
+        start = time.perf_counter()
+        connection = raw_connection(*args, **kwargs)
+        metrics.record_checkout(name, time.perf_counter() - start)
+        return connection
+
+    engine.raw_connection = timed_raw_connection
+    metrics.engines.append(engine)
+    return engine
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def sql_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info['orion_sql_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def sql_finished(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['orion_sql_start']
+    # время запросов копится в g и переносится в метрики один раз в конце запроса
+    if has_request_context():
+        g.setdefault('sql_timings', []).append(seconds)
+    else:
+        metrics.record_sql(background_route, seconds)
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def detect_error(response):
+    """Обработчик определяет категорию ошибки ответа: обработчики маршрутов отвечают на ошибки JSON с атрибутом
+    exception_name, остальные ошибки определяются по коду ответа"""
+    g.response_status = response.status_code
+    if response.status_code >= 400:
+        g.error_category = f'HTTP {response.status_code}'
+    if not response.is_streamed and not response.direct_passthrough:
+        body = response.get_data()
+        if error_body_pattern.match(body):
+            match = exception_name_pattern.search(body)
+            g.error_category = match.group(1).decode() if match else 'error'
+    return response
+
+
+@app.teardown_request
+def record_request(exception=None):
+    """Обработчик записывает метрики запроса. Необработанное исключение записывается как категория ошибки по
+    названию класса исключения"""
+    start = g.get('request_start')
+    if start is None:
+        return
+    error = exception.__class__.__name__ if exception is not None else g.get('error_category')
+    status = 500 if exception is not None else g.get('response_status', 200)
+    metrics.record_request(current_route(), request.method, status, error, time.perf_counter() - start,
+                           g.get('sql_timings', ()))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Функция возвращает метрики процесса в текстовом формате Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -1,59 +1,265 @@
 from orion import db
-from sqlalchemy import text, exc
+from orion.pagination import keyset_page, cursor_columns, CursorError
+from orion.streaming import iter_batches
+from orion.cache import cache_key, invalidate_contact, read_cache, fill_cache
+from orion.serialization import rows_to_dicts, group_by_person, selected, select_fields
+from orion.search import search_config, search_rows
+from orion.autocomplete import autocomplete, autocomplete_enabled, index_add, index_remove, note_bumps
+from orion.data_validation import person_patch_fields, max_batch_size
+from sqlalchemy import text, exc, insert, delete, select, func, and_, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 import traceback
+import re
 
 
 # В данном модуле находятся классы моделей таблиц и их методы обработки данных
 
+# канонический вид номера телефона, в котором номера хранятся в таблице phones
+canonical_phone_regexp = '^\\+7[0-9]{10}$'
+# количество контактов, которые изменяются одним запросом UPDATE в методе update_persons
+update_chunk_size = 1000
+# количество строк в одном многострочном INSERT метода add_person: у asyncpg не больше 32767 параметров на запрос
+insert_chunk_size = 1000
+# person_id новых контактов выделяются из последовательности заранее одним запросом (как в importer.merge_sql),
+# поэтому телефоны и email связываются с контактом по его собственному person_id, а не по порядку строк RETURNING
+next_person_ids_sql = "SELECT nextval(pg_get_serial_sequence('persons', 'person_id')) FROM generate_series(1, :count)"
+# пакетное изменение контактов: значения передаются массивами по столбцам (NULL - атрибут не изменяется), поэтому
+# текст запроса не зависит от количества контактов. Подзапрос old блокирует строки в порядке person_id и
+# возвращает ФИО до изменения для индекса автодополнения
+update_persons_sql = '''
+    UPDATE persons p
+    SET file_path = COALESCE(v.file_path, p.file_path), full_name = COALESCE(v.full_name, p.full_name),
+        gender = COALESCE(v.gender, p.gender), birthday = COALESCE(v.birthday, p.birthday),
+        address = COALESCE(v.address, p.address), version = p.version + 1
+    FROM unnest(CAST(:person_ids AS integer[]), CAST(:file_paths AS varchar[]), CAST(:full_names AS varchar[]),
+                CAST(:genders AS varchar[]), CAST(:birthdays AS date[]), CAST(:addresses AS varchar[]))
+             AS v(person_id, file_path, full_name, gender, birthday, address),
+         (SELECT person_id, full_name FROM persons WHERE person_id = ANY(CAST(:person_ids AS integer[]))
+          ORDER BY person_id FOR UPDATE) old
+    WHERE p.person_id = v.person_id AND old.person_id = v.person_id
+    RETURNING p.person_id, old.full_name, p.full_name
+'''
+# запросы изменения одной записи таблицы phones или emails выполняются одним обращением к БД: строка изменяется в
+# CTE changed, а версия контакта и счетчик изменений таблицы увеличиваются в том же запросе, если строка изменилась.
+# Последний столбец результата запроса - имя таблицы, счетчик которой был увеличен (NULL, если строка не изменилась)
+bump_related_sql = '''
+    bumped AS (UPDATE persons SET version = version + 1 WHERE person_id = :person_id AND EXISTS (SELECT FROM changed)),
+    counted AS (INSERT INTO table_versions (table_name, version) SELECT '{table}', 1 WHERE EXISTS (SELECT FROM changed)
+                ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1 RETURNING table_name)
+'''
+# добавление: строка вставляется, только если контакт есть в БД, конфликт по первичному ключу обрабатывается по режиму
+# on_conflict. Запрос возвращает, найден ли контакт, person_id владельца значения до запроса и признак вставки
+# (TRUE - строка добавлена, FALSE - изменен тип, NULL - строка не изменилась)
+add_related_sql = '''
+    WITH person AS (SELECT person_id FROM persons WHERE person_id = :person_id),
+    existing AS (SELECT person_id FROM {table} WHERE {value_column} = :value),
+    changed AS (INSERT INTO {table} (person_id, {type_column}, {value_column})
+                SELECT person_id, :value_type, :value FROM person
+                ON CONFLICT ({value_column}) DO {conflict_action}
+                RETURNING (xmax = 0) AS inserted),
+    {bump}
+    SELECT EXISTS (SELECT FROM person), (SELECT person_id FROM existing), (SELECT inserted FROM changed),
+           (SELECT table_name FROM counted)
+'''
+upsert_conflict_actions = {
+    'error': 'NOTHING',
+    'ignore': 'NOTHING',
+    # тип изменяется, только если значение принадлежит тому же контакту и тип отличается
+    'update': 'UPDATE SET {type_column} = EXCLUDED.{type_column} WHERE {table}.person_id = EXCLUDED.person_id '
+              'AND {table}.{type_column} <> EXCLUDED.{type_column}'}
+# изменение и удаление: запрос возвращает признак изменения строки и значения контакта на начало запроса для ответа
+# о ненайденном значении
+update_related_sql = '''
+    WITH changed AS (UPDATE {table} SET {type_column} = :value_type, {value_column} = :value
+                     WHERE person_id = :person_id AND {value_column} = :old_value RETURNING person_id),
+    {bump}
+    SELECT EXISTS (SELECT FROM changed),
+           (SELECT array_agg({value_column} ORDER BY {value_column}) FROM {table} WHERE person_id = :person_id),
+           (SELECT table_name FROM counted)
+'''
+delete_related_sql = '''
+    WITH changed AS (DELETE FROM {table}
+                     WHERE person_id = :person_id AND {value_column} = :value AND {type_column} = :value_type
+                     RETURNING person_id),
+    {bump}
+    SELECT EXISTS (SELECT FROM changed),
+           (SELECT array_agg({value_column} ORDER BY {value_column}) FROM {table} WHERE person_id = :person_id),
+           (SELECT table_name FROM counted)
+'''
+
+
+def find_duplicate_contact(integrity_error, data):
+    """Функция по тексту ошибки нарушения уникальности от PostgreSQL (Key (phone_number)=(...) already exists)
+    находит в списке добавляемых контактов тот, которому принадлежит повторяющийся номер телефона или email.
+    Возвращает индекс контакта и повторяющееся значение или (None, None), если контакт определить не удалось"""
+    # psycopg2 передает текст в diag.message_detail, asyncpg (модуль asgi) - в detail исходного исключения
+    detail = getattr(getattr(integrity_error.orig, 'diag', None), 'message_detail', None) \
+        or getattr(integrity_error.orig.__cause__, 'detail', None) or ''
+    match = re.search(r'\((\w+)\)=\((.*)\)', detail)
+    if not match:
+        return None, None
+    column, value = match.groups()
+    for ind, item in enumerate(data):
+        if column == 'phone_number' and value in [phone.phone_number for phone in item.phones or []]:
+            return ind, value
+        if column == 'email_address' and value in [email.email_address for email in item.emails or []]:
+            return ind, value
+    return None, None
+
+
+def id_array(person_ids):
+    """Функция возвращает список person_id в виде одного параметра-массива для условий вида
+    person_id = ANY(:person_ids). Текст запроса не зависит от количества идентификаторов"""
+    return any_(bindparam('person_ids', [int(person_id) for person_id in person_ids], type_=ARRAY(db.Integer)))
+
+
+def related_statements(table, type_column, value_column):
+    """Функция возвращает запросы добавления (add_<режим> для каждого режима upsert_conflict_actions), изменения
+    (update) и удаления (delete) одной записи таблицы phones или emails"""
+    names = {'table': table, 'type_column': type_column, 'value_column': value_column}
+    bump = bump_related_sql.format(**names).strip()
+    statements = {f'add_{mode}': add_related_sql.format(conflict_action=action.format(**names), bump=bump, **names)
+                  for mode, action in upsert_conflict_actions.items()}
+    statements['update'] = update_related_sql.format(bump=bump, **names)
+    statements['delete'] = delete_related_sql.format(bump=bump, **names)
+    return {name: text(sql).bindparams(bindparam('person_id', type_=db.Integer)) for name, sql in statements.items()}
+
+
+def execute_related(statement, person_id, **params):
+    """Функция выполняет запрос изменения записи телефона или email, завершает транзакцию и возвращает строку
+    результата запроса без столбца с именем таблицы увеличенного счетчика изменений"""
+    params['person_id'] = int(person_id) if person_id else None
+    *row, bumped_table = db.session.execute(statement, params).one()
+    if bumped_table:
+        note_bumps(bumped_table)
+    db.session.commit()
+    return row
+
+
+phone_statements = related_statements('phones', 'phone_type', 'phone_number')
+email_statements = related_statements('emails', 'email_type', 'email_address')
+
 
 class Person(db.Model):
     """Класс содержит модель таблицы persons и ее методы обработки данных"""
     __tablename__ = "persons"
-    __table_args__ = {'extend_existing': True}
+    # индексы (столбец сортировки, person_id) для постраничной выборки и сортировки списка по каждому столбцу
+    __table_args__ = (db.Index('ix_persons_full_name_person_id', 'full_name', 'person_id'),
+                      db.Index('ix_persons_birthday_person_id', 'birthday', 'person_id'),
+                      db.Index('ix_persons_file_path_person_id', 'file_path', 'person_id'),
+                      db.Index('ix_persons_gender_person_id', 'gender', 'person_id'),
+                      db.Index('ix_persons_address_person_id', 'address', 'person_id'),
+                      # GIN индексы поиска контактов (модуль search)
+                      db.Index('ix_persons_search_document', text(f"to_tsvector('{search_config}', full_name || ' ' || "
+                                                                  f"address)"), postgresql_using='gin'),
+                      db.Index('ix_persons_full_name_trgm', 'full_name', postgresql_using='gin',
+                               postgresql_ops={'full_name': 'gin_trgm_ops'}),
+                      db.Index('ix_persons_address_trgm', 'address', postgresql_using='gin',
+                               postgresql_ops={'address': 'gin_trgm_ops'}),
+                      {'extend_existing': True})
     person_id = db.Column(db.Integer, primary_key=True)
     file_path = db.Column(db.String(100), nullable=False)
     full_name = db.Column(db.String(100), nullable=False)
     gender = db.Column(db.String(30), nullable=False)
     birthday = db.Column(db.Date, nullable=False)
     address = db.Column(db.String, nullable=False)
+    # версия контакта увеличивается при любом изменении контакта, его телефонов и email и используется для ETag
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     phones = db.relationship("Phone", backref="persons", passive_deletes=True, cascade='all, delete-orphan')
     emails = db.relationship("Email", backref="persons", passive_deletes=True, cascade='all, delete-orphan')
 
-    def json(self):
-        """Метод сериализует данные полученные из БД в формат JSON"""
-        return {'person_id': self.person_id, 'file_path': self.file_path,
-                'full_name': self.full_name, 'gender': self.gender,
-                'birthday': self.birthday, 'address': self.address}
+    def json(self, expand=None):
+        """Метод сериализует данные полученные из БД в формат JSON. В expand можно передать список связанных
+        сущностей (phones, emails), которые нужно добавить в данные контакта"""
+        person = {'person_id': self.person_id, 'file_path': self.file_path,
+                  'full_name': self.full_name, 'gender': self.gender,
+                  'birthday': self.birthday, 'address': self.address}
+        for relationship in expand or []:
+            person[relationship] = [item.json() for item in getattr(self, relationship)]
+        return person
 
     @staticmethod
-    def get_all_persons(sorted_data=None):
+    def json_columns(fields=None):
+        """Метод возвращает столбцы таблицы persons, которые отдаются в API (только атрибуты из fields, если он
+        передан)"""
+        table = Person.__table__
+        return [column for column in [table.c.person_id, table.c.file_path, table.c.full_name, table.c.gender,
+                                      table.c.birthday, table.c.address] if selected(column.key, fields)]
+
+    @staticmethod
+    def rows_json(rows, expand=None, fields=None):
+        """Метод сериализует строки таблицы persons, полученные из БД кортежами столбцов json_columns, без создания
+        ORM объектов. Связанные сущности из expand загружаются одним запросом WHERE person_id = ANY(...) на каждую
+        сущность для всех строк, а не на каждый контакт"""
+        persons = rows_to_dicts(Person.json_columns(fields), rows)
+        if expand and persons:
+            person_ids = [person['person_id'] for person in persons]
+            related = {'phones': Phone, 'emails': Email}
+            for relationship in expand:
+                grouped = group_by_person(related[relationship].json_by_person_ids(person_ids))
+                for person in persons:
+                    person[relationship] = grouped.get(person['person_id'], [])
+        return persons
+
+    @staticmethod
+    def get_all_persons(sorted_data=None, page_data=None, expand=None, fields=None):
         """"Метод принимает на вход параметры сортировки (если они есть) и возвращает список всех записей из
-        таблицы persons"""
+        таблицы persons. Если передан page_data с limit, возвращается одна страница записей и курсор следующей страницы.
+        Связанные сущности из expand добавляются в данные каждого контакта, из БД выбираются только столбцы fields"""
         try:
+            columns = Person.json_columns(fields)
+            query = db.session.query(*columns)
+            if page_data and page_data.limit:
+                # постраничная выборка по курсору вместо выгрузки всей таблицы
+                query = db.session.query(*columns, *cursor_columns(Person, sorted_data, columns))
+                persons, next_cursor = keyset_page(Person, sorted_data, page_data, query)
+                return {'response': Person.rows_json(persons, expand, fields), 'next_cursor': next_cursor}
             if sorted_data:
-                return {'response':
-                        [Person.json(person) for person in Person.query.order_by(text(
-                         sorted_data.sorted_by + ' ' + sorted_data.order)).all()]}
-            return {'response': [Person.json(person) for person in Person.query.all()]}
-        except exc.ProgrammingError as pe:
+                query = query.order_by(text(sorted_data.sorted_by + ' ' + sorted_data.order))
+            return {'response': Person.rows_json(query.all(), expand, fields)}
+        except (exc.ProgrammingError, KeyError) as pe:
             return {
                 'error': f'аттрибута {sorted_data.sorted_by} нет в таблице persons. Выберите один из следующих атрибутов - '
                          f'{", ".join([m.key for m in Person.__table__.columns])}',
                          'exception_name': pe.__class__.__name__,
                          'info': traceback.format_exc()}
+        except CursorError as ce:
+            return {'error': str(ce), 'exception_name': ce.__class__.__name__, 'info': traceback.format_exc()}
+        except exc.OperationalError as oe:
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
+    @staticmethod
+    def stream_all_persons(sorted_data=None, expand=None, fields=None):
+        """Метод принимает на вход параметры сортировки (если они есть) и возвращает генератор пачек всех записей из
+        таблицы persons для потоковой выдачи. Записи читаются из БД через серверный курсор"""
+        try:
+            query = db.session.query(*Person.json_columns(fields))
+            if sorted_data:
+                query = query.order_by(text(sorted_data.sorted_by + ' ' + sorted_data.order))
+            return {'response': iter_batches(query, lambda rows: Person.rows_json(rows, expand, fields))}
+        except exc.ProgrammingError as pe:
+            return {'error': f'аттрибута {sorted_data.sorted_by} нет в таблице persons. Выберите один из следующих '
+                             f'атрибутов - {", ".join([m.key for m in Person.__table__.columns])}',
+                    'exception_name': pe.__class__.__name__, 'info': traceback.format_exc()}
         except exc.OperationalError as oe:
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
 
     @staticmethod
-    def get_person(person_id_obj):
-        """"Метод принимает на вход person_id и возвращает соотвествующую запись из таблицы persons"""
+    def get_person(person_id_obj, expand=None, fields=None):
+        """"Метод принимает на вход person_id и возвращает соотвествующую запись из таблицы persons. Связанные
+        сущности из expand (phones, emails) возвращаются вместе с контактом, атрибуты контакта - только из fields"""
         try:
             if not person_id_obj.person_id:
                 return {'response': 'Запрос должен содержать обязательный атрибут person_id'}
-            person = Person.query.filter_by(person_id=person_id_obj.person_id).first().json()
+            person = Person.cached_json(person_id_obj.person_id, fields)
             if not person:
                 return {'response': 'Контакт с указанным person_id не найден в БД'}
+            if expand:
+                related = {'phones': Phone.cached_json, 'emails': Email.cached_json}
+                person = dict(person, **{relationship: related[relationship](person_id_obj.person_id)
+                                         for relationship in expand})
             return {'response': person}
         except exc.OperationalError as oe:
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
@@ -65,45 +271,159 @@ class Person(db.Model):
             return {'error': 'Контакт с указанным person_id не найден', 'exception_name': ae.__class__.__name__,
                     'info': traceback.format_exc()}
 
+    @staticmethod
+    def cached_json(person_id, fields=None):
+        """Метод возвращает данные контакта из read-through кэша, при промахе загружает их из БД и сохраняет в кэш.
+        Для несуществующего контакта возвращает None. Если передан fields, из кэша отдаются только его атрибуты, а
+        при промахе из БД выбираются только его столбцы, и неполная запись в кэш не сохраняется"""
+        key = cache_key('person', person_id)
+        person = read_cache(key)
+        if person is None:
+            row = db.session.query(*Person.json_columns(fields)).filter(Person.person_id == person_id).first()
+            if not row:
+                return None
+            person = Person.rows_json([row], fields=fields)[0]
+            if not fields:
+                fill_cache(key, person)
+            return person
+        return select_fields(person, fields)
+
+    @staticmethod
+    def current_version(person_id):
+        """Метод возвращает версию контакта (из кэша или одним запросом по первичному ключу) или None, если контакта
+        нет в БД. Версия читается до данных контакта, поэтому ETag никогда не оказывается новее отданных данных"""
+        key = cache_key('version', person_id)
+        version = read_cache(key)
+        if version is None:
+            version = db.session.query(Person.version).filter(Person.person_id == person_id).scalar()
+            if version is None:
+                return None
+            fill_cache(key, version)
+        return version
+
+    @staticmethod
+    def get_persons(ids_obj, expand=None, fields=None):
+        """"Метод принимает на вход список person_id и одним запросом возвращает соответствующие записи из таблицы
+        persons (со связанными сущностями из expand, атрибутами из fields) в виде словаря по person_id. Для
+        ненайденных person_id в словаре возвращается null, а сами идентификаторы перечисляются в not_found"""
+        try:
+            rows = db.session.query(*Person.json_columns(fields)).filter(
+                Person.person_id == id_array(ids_obj.person_ids)).all()
+            found = {str(person['person_id']): person for person in Person.rows_json(rows, expand, fields)}
+            return {'response': {person_id: found.get(person_id) for person_id in ids_obj.person_ids},
+                    'not_found': [person_id for person_id in ids_obj.person_ids if person_id not in found]}
+        except exc.OperationalError as oe:
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
+    @staticmethod
+    def get_person_by_related(column, value, expand=None):
+        """Метод одним запросом по первичному ключу таблицы phones или emails (column) и первичному ключу persons
+        возвращает контакт, которому принадлежит номер телефона или адрес почты, или None, если значения нет в БД"""
+        row = db.session.query(*Person.json_columns()).join(column.table, column.table.c.person_id ==
+                                                            Person.person_id).filter(column == value).first()
+        return Person.rows_json([row], expand)[0] if row else None
+
+    @staticmethod
+    def get_person_by_phone(phone_number_data, expand=None):
+        """"Метод принимает на вход номер телефона в каноническом виде и возвращает контакт, которому принадлежит
+        номер. Связанные сущности из expand (phones, emails) возвращаются вместе с контактом"""
+        try:
+            person = Person.get_person_by_related(Phone.__table__.c.phone_number, phone_number_data.phone_number,
+                                                  expand)
+            if not person:
+                return {'response': f'Номер телефона {phone_number_data.phone_number} не найден в БД'}
+            return {'response': person}
+        except exc.OperationalError as oe:
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
+    @staticmethod
+    def get_person_by_email(email_address_data, expand=None):
+        """"Метод принимает на вход адрес почты и возвращает контакт, которому принадлежит адрес. Связанные
+        сущности из expand (phones, emails) возвращаются вместе с контактом"""
+        try:
+            person = Person.get_person_by_related(Email.__table__.c.email_address, email_address_data.email_address,
+                                                  expand)
+            if not person:
+                return {'response': f'Адрес почты {email_address_data.email_address} не найден в БД'}
+            return {'response': person}
+        except exc.OperationalError as oe:
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
+    @staticmethod
+    def search_persons(search_data, expand=None):
+        """Метод принимает на вход поисковый запрос и возвращает страницу найденных контактов, отсортированных по
+        релевантности (rank), и курсор следующей страницы. Связанные сущности из expand добавляются в данные контактов"""
+        try:
+            rows, next_cursor = search_rows(search_data)
+            persons = Person.rows_json(rows, expand)
+            for person, row in zip(persons, rows):
+                person['rank'] = round(row.rank, 4)
+            return {'response': persons, 'next_cursor': next_cursor}
+        except CursorError as ce:
+            return {'error': str(ce), 'exception_name': ce.__class__.__name__, 'info': traceback.format_exc()}
+        except exc.OperationalError as oe:
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
+    @staticmethod
+    def autocomplete(autocomplete_data):
+        """Метод принимает на вход поле (full_name, phone_number, email_address) и префикс значения и возвращает
+        подсказки из индекса автодополнения в памяти процесса без запроса к таблицам"""
+        if not autocomplete_enabled:
+            return {'error': 'Автодополнение выключено в секции AUTOCOMPLETE файла config.ini'}
+        try:
+            return {'response': autocomplete.complete(autocomplete_data.field, autocomplete_data.prefix,
+                                                      autocomplete_data.limit)}
+        except exc.OperationalError as oe:
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
     @staticmethod
     def add_person(data):
         """Метод принимает на вход атрибуты сущности Person и related сущностей (если они есть) и добавляет записи в
-        соответствующие таблицы"""
-        # В цикле добавляем в базу контакты из списка. Если все контакты были добавлены делаем commit, если была ошибка
-        # при добавлении хотя бы одного из контактов отменяем всё.
-        for ind, item in enumerate(data):
-            try:
-                new_person = Person(file_path=item.file_path, full_name=item.full_name,
-                                    gender=item.gender, birthday=item.birthday, address=item.address)
-                db.session.add(new_person)
-                db.session.flush()
-                for phone in item.phones:
-                    new_person_phone = Phone(person_id=new_person.person_id, phone_type=phone.phone_type,
-                                             phone_number=phone.phone_number)
-                    db.session.add(new_person_phone)
-                    db.session.flush()
-                for email in item.emails:
-                    new_person_email = Email(person_id=new_person.person_id, email_type=email.email_type,
-                                             email_address=email.email_address)
-                    db.session.add(new_person_email)
-                    db.session.flush()
-            # ловим ошибку нарушения уникальности по столбцам email_address и phone_number
-            except exc.IntegrityError as ie:
-                db.session.rollback()
-                return {
-                    'error': f'При добавлении данных контакта {item["full_name"]} произошла ошибка нарушения уникальности, '
-                             f'по одному из столбцов - email_address, phone_number.',
-                    'exception_name': ie.__class__.__name__,
-                    'info': traceback.format_exc()}
-            except exc.OperationalError as oe:
-                return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
-                        'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
-            except KeyError as ke:
-                db.session.rollback()
-                return {
-                    'error': f'В полученных данных контакта номер {ind + 1} отсутствует обязательный аргумент - {ke}',
-                    'exception_name': ke.__class__.__name__, 'info': traceback.format_exc()}
-        db.session.commit()
+        соответствующие таблицы. Контакты вставляются многострочными запросами по insert_chunk_size строк"""
+        # Все контакты списка добавляются в одной транзакции. Если все контакты были добавлены делаем commit, если была
+        # ошибка при добавлении хотя бы одного из контактов отменяем всё.
+        if not data:
+            return {'response': '0 контактов было добавлено в БД'}
+        try:
+            person_ids = db.session.execute(text(next_person_ids_sql), {'count': len(data)}).scalars().all()
+            new_persons = [{'person_id': person_id, 'file_path': item.file_path, 'full_name': item.full_name,
+                            'gender': item.gender, 'birthday': item.birthday, 'address': item.address}
+                           for person_id, item in zip(person_ids, data)]
+            new_phones = [{'person_id': person_id, 'phone_type': phone.phone_type, 'phone_number': phone.phone_number}
+                          for person_id, item in zip(person_ids, data) for phone in item.phones or []]
+            new_emails = [{'person_id': person_id, 'email_type': email.email_type, 'email_address': email.email_address}
+                          for person_id, item in zip(person_ids, data) for email in item.emails or []]
+            for table, rows in [(Person.__table__, new_persons), (Phone.__table__, new_phones),
+                                (Email.__table__, new_emails)]:
+                for start in range(0, len(rows), insert_chunk_size):
+                    db.session.execute(insert(table).values(rows[start:start + insert_chunk_size]))
+            TableVersion.bump('persons', *(['phones'] if new_phones else []), *(['emails'] if new_emails else []))
+            db.session.commit()
+            index_add('full_name', [(item.full_name, person_id) for person_id, item in zip(person_ids, data)])
+            index_add('phone_number', [(phone['phone_number'], phone['person_id']) for phone in new_phones])
+            index_add('email_address', [(email['email_address'], email['person_id']) for email in new_emails])
+        # ловим ошибку нарушения уникальности по столбцам email_address и phone_number
+        except exc.IntegrityError as ie:
+            db.session.rollback()
+            ind, duplicate_value = find_duplicate_contact(ie, data)
+            if ind is None:
+                return {'error': 'При добавлении контактов произошла ошибка нарушения уникальности, по одному из '
+                                 'столбцов - email_address, phone_number.',
+                        'exception_name': ie.__class__.__name__, 'info': traceback.format_exc()}
+            return {
+                'error': f'При добавлении данных контакта номер {ind + 1} {data[ind].full_name} произошла ошибка '
+                         f'нарушения уникальности, значение {duplicate_value} уже есть в БД или повторяется в запросе.',
+                'exception_name': ie.__class__.__name__,
+                'info': traceback.format_exc()}
+        except exc.OperationalError as oe:
+            db.session.rollback()
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
         return {'response': f'{len(data)} контактов было добавлено в БД'}
 
     @staticmethod
@@ -114,33 +434,151 @@ class Person(db.Model):
             person_to_update = Person.query.filter_by(person_id=person_data.person_id).first()
             if not person_to_update:
                 return {'response': f'Контакт с person_id = {person_data.person_id} не найден в БД'}
+            old_full_name = person_to_update.full_name
             person_to_update.file_path = person_data.file_path
             person_to_update.full_name = person_data.full_name
             person_to_update.gender = person_data.gender
             person_to_update.birthday = person_data.birthday
             person_to_update.address = person_data.address
+            person_to_update.version = Person.version + 1
+            TableVersion.bump('persons')
             db.session.commit()
+            invalidate_contact(person_data.person_id, 'person', 'version')
+            index_remove('full_name', [(old_full_name, person_to_update.person_id)])
+            index_add('full_name', [(person_data.full_name, person_to_update.person_id)])
             return {'response': f'Данные контакта с person_id = {person_data.person_id} были изменены'}
         except exc.OperationalError as oe:
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
 
+    @staticmethod
+    def update_persons_statement(patches):
+        """Метод возвращает запрос пакетного изменения контактов из словаря {person_id: изменяемые атрибуты}"""
+        columns = [('person_ids', 'person_id', db.Integer), ('file_paths', 'file_path', db.String),
+                   ('full_names', 'full_name', db.String), ('genders', 'gender', db.String),
+                   ('birthdays', 'birthday', db.Date), ('addresses', 'address', db.String)]
+        rows = [dict(fields, person_id=person_id) for person_id, fields in patches.items()]
+        return text(update_persons_sql).bindparams(*[
+            bindparam(name, [row.get(column) for row in rows], type_=ARRAY(column_type))
+            for name, column, column_type in columns])
+
+    @staticmethod
+    def update_persons(patches):
+        """Метод принимает на вход список изменений контактов PersonPatchData и изменяет переданные атрибуты
+        контактов одним запросом UPDATE на каждые update_chunk_size контактов в одной транзакции. Если один person_id
+        встречается в списке несколько раз, изменения применяются по порядку. person_id, которых нет в БД,
+        возвращаются в not_found"""
+        merged = {}
+        for patch in patches:
+            merged.setdefault(int(patch.person_id), {}).update(
+                {field: getattr(patch, field) for field in person_patch_fields if getattr(patch, field) is not None})
+        person_ids = list(merged)
+        try:
+            updated = []
+            for start in range(0, len(person_ids), update_chunk_size):
+                chunk = {person_id: merged[person_id] for person_id in person_ids[start:start + update_chunk_size]}
+                updated += db.session.execute(Person.update_persons_statement(chunk)).all()
+            if updated:
+                TableVersion.bump('persons')
+            db.session.commit()
+        except exc.OperationalError as oe:
+            db.session.rollback()
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+        for person_id, _, _ in updated:
+            invalidate_contact(person_id, 'person', 'version')
+        renamed = [(person_id, old_full_name, full_name) for person_id, old_full_name, full_name in updated
+                   if old_full_name != full_name]
+        index_remove('full_name', [(old_full_name, person_id) for person_id, old_full_name, _ in renamed])
+        index_add('full_name', [(full_name, person_id) for person_id, _, full_name in renamed])
+        found = {person_id for person_id, _, _ in updated}
+        return {'response': f'Данные {len(updated)} контактов были изменены',
+                'not_found': [str(person_id) for person_id in person_ids if person_id not in found]}
+
+    @staticmethod
+    def delete_persons_statement(condition):
+        """Метод возвращает запрос удаления контактов по условию, который возвращает person_id, ФИО, номера телефонов
+        и адреса почты удаленных контактов. Телефоны и email удаляются в БД каскадно (ON DELETE CASCADE), а
+        подзапросы к ним видят данные на начало запроса, поэтому удаление выполняется одним запросом"""
+        persons, phones, emails = Person.__table__, Phone.__table__, Email.__table__
+        deleted = delete(persons).where(condition).returning(persons.c.person_id, persons.c.full_name).cte('deleted')
+        return select(deleted.c.person_id, deleted.c.full_name,
+                      select(func.array_agg(phones.c.phone_number))
+                      .where(phones.c.person_id == deleted.c.person_id).scalar_subquery(),
+                      select(func.array_agg(emails.c.email_address))
+                      .where(emails.c.person_id == deleted.c.person_id).scalar_subquery())
+
+    @staticmethod
+    def delete_persons(condition, max_count=None):
+        """Метод удаляет контакты по условию одним запросом без загрузки ORM объектов и возвращает список person_id
+        удаленных контактов. Если условию соответствует больше max_count контактов, удаление отменяется и метод
+        возвращает None. Транзакция завершается внутри метода, исключения обрабатывает вызывающий метод"""
+        if max_count is not None:
+            # удаляется не больше max_count + 1 контактов, лишний контакт означает превышение ограничения
+            table = Person.__table__
+            condition = table.c.person_id.in_(select(table.c.person_id).where(condition).limit(max_count + 1))
+        deleted = db.session.execute(Person.delete_persons_statement(condition)).all()
+        if max_count is not None and len(deleted) > max_count:
+            db.session.rollback()
+            return None
+        if deleted:
+            TableVersion.bump('persons', 'phones', 'emails')
+        db.session.commit()
+        for person_id, _, _, _ in deleted:
+            invalidate_contact(person_id, 'person', 'phones', 'emails', 'version')
+        index_remove('full_name', [(full_name, person_id) for person_id, full_name, _, _ in deleted])
+        index_remove('phone_number', [(number, person_id) for person_id, _, numbers, _ in deleted
+                                      for number in numbers or []])
+        index_remove('email_address', [(address, person_id) for person_id, _, _, addresses in deleted
+                                       for address in addresses or []])
+        return [person_id for person_id, _, _, _ in deleted]
+
     @staticmethod
     def delete_person(person_id_obj):
         """"Метод принимает на вход person_id и удаляет соответствующую запись из таблицы person и дочерних таблиц"""
         try:
-            person_to_delete = Person.query.filter_by(person_id=person_id_obj.person_id).first()
-            if not person_to_delete:
+            if not Person.delete_persons(Person.__table__.c.person_id == int(person_id_obj.person_id)):
                 return {'response': f'Контакт с person_id = {person_id_obj.person_id} не найден в БД'}
-            db.session.delete(person_to_delete)
-            db.session.commit()
             return {'response': f"Все данные контакта с person_id = {person_id_obj.person_id} были удалены"}
         except exc.OperationalError as oe:
+            db.session.rollback()
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
+    @staticmethod
+    def delete_persons_by_ids(ids_obj):
+        """"Метод принимает на вход список person_id и удаляет контакты и их телефоны и email одним запросом.
+        person_id, которых нет в БД, возвращаются в not_found"""
+        try:
+            deleted = {str(person_id) for person_id in
+                       Person.delete_persons(Person.__table__.c.person_id == id_array(ids_obj.person_ids))}
+            return {'response': f'Все данные {len(deleted)} контактов были удалены',
+                    'not_found': [person_id for person_id in ids_obj.person_ids if person_id not in deleted]}
+        except exc.OperationalError as oe:
+            db.session.rollback()
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
+    @staticmethod
+    def delete_persons_by_filter(filter_data):
+        """"Метод принимает на вход атрибуты контакта и удаляет одним запросом все контакты, у которых совпадают все
+        переданные атрибуты. person_id удаленных контактов возвращаются в deleted. Если фильтру соответствует больше
+        max_batch_size контактов, ничего не удаляется"""
+        table = Person.__table__
+        condition = and_(*[table.c[field] == getattr(filter_data, field) for field in person_patch_fields
+                           if getattr(filter_data, field) is not None])
+        try:
+            deleted = Person.delete_persons(condition, max_count=max_batch_size)
+            if deleted is None:
+                return {'error': f'Фильтру соответствует больше {max_batch_size} контактов, контакты не удалены. '
+                                 f'Уточните фильтр или удалите контакты по списку person_ids',
+                        'exception_name': ValueError.__name__}
+            return {'response': f'Все данные {len(deleted)} контактов были удалены',
+                    'deleted': [str(person_id) for person_id in deleted]}
+        except exc.OperationalError as oe:
+            db.session.rollback()
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
-        except KeyError as ke:
-            return {'error': f'В полученных данных отсутствует обязательный аргумент - {ke}',
-                    'exception_name': ke.__class__.__name__, 'info': traceback.format_exc()}
 
     def __repr__(self):
         return f'<Person {self.full_name}>'
@@ -149,7 +587,15 @@ class Person(db.Model):
 class Phone(db.Model):
     """Класс содержит модель таблицы phones и ее методы обработки данных"""
     __tablename__ = "phones"
-    __table_args__ = {'extend_existing': True}
+    # индекс (person_id, phone_number) используется и для поиска телефонов контакта, и для сортировки по person_id
+    __table_args__ = (db.Index('ix_phones_person_id_phone_number', 'person_id', 'phone_number'),
+                      db.Index('ix_phones_phone_type_phone_number', 'phone_type', 'phone_number'),
+                      db.Index('ix_phones_phone_number_trgm', 'phone_number', postgresql_using='gin',
+                               postgresql_ops={'phone_number': 'gin_trgm_ops'}),
+                      # номера хранятся только в каноническом виде +7хххххххххх (data_validation.canonical_phone_number)
+                      db.CheckConstraint(f"phone_number ~ '{canonical_phone_regexp}'",
+                                         name='ck_phones_phone_number_canonical'),
+                      {'extend_existing': True})
     person_id = db.Column(db.Integer, db.ForeignKey('persons.person_id', ondelete="CASCADE"), nullable=False)
     phone_type = db.Column(db.String(30), nullable=False)
     phone_number = db.Column(db.String(30), nullable=False, primary_key=True)
@@ -159,100 +605,176 @@ class Phone(db.Model):
         return {'person_id': self.person_id, 'phone_type': self.phone_type, 'phone_number': self.phone_number}
 
     @staticmethod
-    def get_all_phones(sorted_data=None):
+    def json_columns(fields=None):
+        """Метод возвращает столбцы таблицы phones, которые отдаются в API (только атрибуты из fields, если он
+        передан)"""
+        table = Phone.__table__
+        return [column for column in [table.c.person_id, table.c.phone_type, table.c.phone_number]
+                if selected(column.key, fields)]
+
+    @staticmethod
+    def rows_json(rows, fields=None):
+        """Метод сериализует строки таблицы phones, полученные из БД кортежами столбцов json_columns, без создания
+        ORM объектов"""
+        return rows_to_dicts(Phone.json_columns(fields), rows)
+
+    @staticmethod
+    def json_by_person_ids(person_ids):
+        """Метод одним запросом возвращает сериализованные записи таблицы phones всех контактов из списка person_ids"""
+        query = db.session.query(*Phone.json_columns()).filter(Phone.person_id == id_array(person_ids))
+        return Phone.rows_json(query.all())
+
+    @staticmethod
+    def get_all_phones(sorted_data=None, page_data=None, fields=None):
         """"Метод принимает на вход параметры сортировки (если они есть) и возвращает список всех записей из
-        таблицы phones"""
+        таблицы phones. Если передан page_data с limit, возвращается одна страница записей и курсор следующей страницы"""
         try:
+            columns = Phone.json_columns(fields)
+            query = db.session.query(*columns)
+            if page_data and page_data.limit:
+                # постраничная выборка по курсору вместо выгрузки всей таблицы
+                query = db.session.query(*columns, *cursor_columns(Phone, sorted_data, columns))
+                phones, next_cursor = keyset_page(Phone, sorted_data, page_data, query)
+                return {'response': Phone.rows_json(phones, fields), 'next_cursor': next_cursor}
             if sorted_data:
-                return {'response':
-                        [Phone.json(phone) for phone in Phone.query.order_by(text(sorted_data.sorted_by + ' '
-                         + sorted_data.order)).all()]}
-            return {'response': [Phone.json(phone) for phone in Phone.query.all()]}
-        except exc.ProgrammingError as pe:
+                query = query.order_by(text(sorted_data.sorted_by + ' ' + sorted_data.order))
+            return {'response': Phone.rows_json(query.all(), fields)}
+        except (exc.ProgrammingError, KeyError) as pe:
             return {'error': f'аттрибута {sorted_data.sorted_by} нет в таблице phones. Выберите один из следующих'
                              f'  атрибутов - {", ".join([m.key for m in Phone.__table__.columns])}',
                     'exception_name': pe.__class__.__name__,
                     'info': traceback.format_exc()}
+        except CursorError as ce:
+            return {'error': str(ce), 'exception_name': ce.__class__.__name__, 'info': traceback.format_exc()}
+        except exc.OperationalError as oe:
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
+    @staticmethod
+    def stream_all_phones(sorted_data=None, fields=None):
+        """Метод принимает на вход параметры сортировки (если они есть) и возвращает генератор пачек всех записей из
+        таблицы phones для потоковой выдачи. Записи читаются из БД через серверный курсор"""
+        try:
+            query = db.session.query(*Phone.json_columns(fields))
+            if sorted_data:
+                query = query.order_by(text(sorted_data.sorted_by + ' ' + sorted_data.order))
+            return {'response': iter_batches(query, lambda rows: Phone.rows_json(rows, fields))}
+        except exc.ProgrammingError as pe:
+            return {'error': f'аттрибута {sorted_data.sorted_by} нет в таблице phones. Выберите один из следующих '
+                             f'атрибутов - {", ".join([m.key for m in Phone.__table__.columns])}',
+                    'exception_name': pe.__class__.__name__, 'info': traceback.format_exc()}
         except exc.OperationalError as oe:
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
 
     @staticmethod
-    def get_phone(person_id_obj):
+    def cached_json(person_id, fields=None):
+        """Метод возвращает список записей таблицы phones контакта из read-through кэша, при промахе загружает их
+        из БД и сохраняет в кэш. Если передан fields, возвращаются только его атрибуты (см. Person.cached_json)"""
+        key = cache_key('phones', person_id)
+        phones = read_cache(key)
+        if phones is None:
+            rows = db.session.query(*Phone.json_columns(fields)).filter(Phone.person_id == person_id).all()
+            phones = Phone.rows_json(rows, fields)
+            if not fields:
+                fill_cache(key, phones)
+            return phones
+        return [select_fields(item, fields) for item in phones]
+
+    @staticmethod
+    def get_phone(person_id_obj, fields=None):
         """"Метод принимает на вход person_id и возвращает соотвествующую запись из таблицы phones"""
         try:
-            person = Person.query.filter_by(person_id=person_id_obj.person_id).first()
+            person = Person.cached_json(person_id_obj.person_id)
             if not person:
                 return {'response': f'Контакт с person_id = {person_id_obj.person_id} не найден в БД'}
-            phone = [Phone.json(phone) for phone in Phone.query.filter(Phone.person_id == person_id_obj.person_id).all()]
-            return {'response': phone}
+            return {'response': Phone.cached_json(person_id_obj.person_id, fields)}
         except exc.OperationalError as oe:
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
 
     @staticmethod
     def add_phone(phone_data):
-        """Метод принимает на вход атрибуты сущности Phone и добавляет запись в таблицу phones в соответствии с person_id"""
+        """Метод принимает на вход атрибуты сущности Phone и добавляет запись в таблицу phones в соответствии с person_id
+        одним запросом к БД. Если номер уже есть в БД, результат зависит от режима on_conflict: error - ошибка, ignore -
+        запись не изменяется, update - изменяется тип номера, если номер принадлежит тому же контакту"""
         try:
-            person = Person.query.filter_by(person_id=phone_data.person_id).first()
-            if not person:
-                return {'response': f'Контакт с person_id = {phone_data.person_id} не найден в БД'}
-            new_phone = Phone(person_id=phone_data.person_id, phone_type=phone_data.phone_type,
-                              phone_number=phone_data.phone_number)
-            db.session.add(new_phone)
-            db.session.commit()
-            return {'response': f'Номер телефона {phone_data.phone_number} был добавлен в контакт с person_id = '
-                                f'{phone_data.person_id}'}
+            person_found, owner_id, inserted = execute_related(
+                phone_statements[f'add_{phone_data.on_conflict}'], phone_data.person_id,
+                value=phone_data.phone_number, value_type=phone_data.phone_type)
         except exc.OperationalError as oe:
+            db.session.rollback()
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
         except exc.IntegrityError as ie:
+            db.session.rollback()
+            return {'error': f'Номер телефона {phone_data.phone_number} уже есть в БД.',
+                    'exception_name': ie.__class__.__name__, 'info': traceback.format_exc()}
+        if not person_found:
+            return {'response': f'Контакт с person_id = {phone_data.person_id} не найден в БД'}
+        if inserted is None:
+            if phone_data.on_conflict != 'error' and owner_id == int(phone_data.person_id):
+                return {'response': f'Номер телефона {phone_data.phone_number} уже есть в контакте с person_id = '
+                                    f'{phone_data.person_id}, данные не изменены'}
             return {'error': f'Номер телефона {phone_data.phone_number} уже есть в БД.',
-                             'exception_name': ie.__class__.__name__, 'info': traceback.format_exc()}
+                    'exception_name': exc.IntegrityError.__name__,
+                    'info': f'Key (phone_number)=({phone_data.phone_number}) already exists.'}
+        invalidate_contact(phone_data.person_id, 'phones', 'version')
+        if not inserted:
+            return {'response': f'Тип номера телефона {phone_data.phone_number} контакта с person_id = '
+                                f'{phone_data.person_id} был изменен на {phone_data.phone_type}'}
+        index_add('phone_number', [(phone_data.phone_number, int(phone_data.person_id))])
+        return {'response': f'Номер телефона {phone_data.phone_number} был добавлен в контакт с person_id = '
+                            f'{phone_data.person_id}'}
 
     @staticmethod
     def update_phone(phone_data):
         """Метод принимает person_id, существующий номер телефона и новый номер для замены и заменяет
-        данные указанного номера"""
+        данные указанного номера одним запросом к БД"""
         try:
-            phones_by_id = Phone.query.filter(Phone.person_id == phone_data.person_id).all()
-            phone_for_update = [phone for phone in phones_by_id if phone.phone_number == phone_data.old_phone_number]
-            if len(phone_for_update) == 0:
-                return {'response':
-                        f'Номер телефона {phone_data.old_phone_number} не был найден среди номеров контакта с person_id = '
-                        f'{phone_data.person_id}. Для замены выберите один из существующих номеров: {phones_by_id}'}
-            phone_for_update[0].phone_type = phone_data.phone_type
-            phone_for_update[0].phone_number = phone_data.phone_number
-            db.session.commit()
-            return {'response': f'Номер телефона {phone_data.old_phone_number} был заменен на {phone_data.phone_number}'}
+            updated, phone_numbers = execute_related(
+                phone_statements['update'], phone_data.person_id, old_value=phone_data.old_phone_number,
+                value=phone_data.phone_number, value_type=phone_data.phone_type)
         except exc.OperationalError as oe:
+            db.session.rollback()
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
         except exc.IntegrityError as ie:
+            db.session.rollback()
             return {'error': f'Номер телефона {phone_data.phone_number} уже есть в БД.',
-                             'exception_name': ie.__class__.__name__, 'info': traceback.format_exc()}
+                    'exception_name': ie.__class__.__name__, 'info': traceback.format_exc()}
+        if not updated:
+            return {'response':
+                    f'Номер телефона {phone_data.old_phone_number} не был найден среди номеров контакта с person_id = '
+                    f'{phone_data.person_id}. Для замены выберите один из существующих номеров: '
+                    f'{", ".join(phone_numbers or [])}'}
+        invalidate_contact(phone_data.person_id, 'phones', 'version')
+        index_remove('phone_number', [(phone_data.old_phone_number, int(phone_data.person_id))])
+        index_add('phone_number', [(phone_data.phone_number, int(phone_data.person_id))])
+        return {'response': f'Номер телефона {phone_data.old_phone_number} был заменен на {phone_data.phone_number}'}
 
     @staticmethod
     def delete_phone(phone_data):
         """Метод принимает на вход person_id и номер который нужно удалить  и удаляет соответствующую запись
-        из таблицы phones"""
+        из таблицы phones одним запросом к БД"""
         try:
-            phones_by_id = Phone.query.filter(Phone.person_id == phone_data.person_id).all()
-            if not phones_by_id:
-                return {'response': f'Контакт с person_id = {phone_data.person_id} не найден в БД'}
-            phone_to_delete = [phone for phone in phones_by_id if phone.phone_number == phone_data.phone_number and
-                               phone.phone_type == phone_data.phone_type]
-            if len(phone_to_delete) == 0:
-                return {'response':
-                        f'Номер телефона - {phone_data.phone_number} с указанным типом - {phone_data.phone_type} '
-                        f'не был найден среди номеров контакта с person_id = {phone_data.person_id}. Для удаления '
-                        f'выберите один из существующих номеров: {phones_by_id} и проверьте соответствие phone_type'}
-            db.session.delete(phone_to_delete[0])
-            db.session.commit()
-            return {'response': f'Номер телефона {phone_data.phone_number} был удален'}
+            deleted, phone_numbers = execute_related(phone_statements['delete'], phone_data.person_id,
+                                                     value=phone_data.phone_number, value_type=phone_data.phone_type)
         except exc.OperationalError as oe:
+            db.session.rollback()
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+        if not phone_numbers:
+            return {'response': f'Контакт с person_id = {phone_data.person_id} не найден в БД'}
+        if not deleted:
+            return {'response':
+                    f'Номер телефона - {phone_data.phone_number} с указанным типом - {phone_data.phone_type} '
+                    f'не был найден среди номеров контакта с person_id = {phone_data.person_id}. Для удаления '
+                    f'выберите один из существующих номеров: {", ".join(phone_numbers)} и проверьте соответствие '
+                    f'phone_type'}
+        invalidate_contact(phone_data.person_id, 'phones', 'version')
+        index_remove('phone_number', [(phone_data.phone_number, int(phone_data.person_id))])
+        return {'response': f'Номер телефона {phone_data.phone_number} был удален'}
 
     def __repr__(self):
         return f'<Phone {self.phone_number}, {self.phone_type}>'
@@ -261,7 +783,12 @@ class Phone(db.Model):
 class Email(db.Model):
     """Класс содержит модель таблицы emails и ее методы обработки данных"""
     __tablename__ = "emails"
-    __table_args__ = {'extend_existing': True}
+    # индекс (person_id, email_address) используется и для поиска email контакта, и для сортировки по person_id
+    __table_args__ = (db.Index('ix_emails_person_id_email_address', 'person_id', 'email_address'),
+                      db.Index('ix_emails_email_type_email_address', 'email_type', 'email_address'),
+                      db.Index('ix_emails_email_address_trgm', 'email_address', postgresql_using='gin',
+                               postgresql_ops={'email_address': 'gin_trgm_ops'}),
+                      {'extend_existing': True})
     person_id = db.Column(db.Integer, db.ForeignKey('persons.person_id', ondelete="CASCADE"), nullable=False)
     email_type = db.Column(db.String(30), nullable=False)
     email_address = db.Column(db.String(254), nullable=False, primary_key=True)
@@ -271,15 +798,59 @@ class Email(db.Model):
         return {'person_id': self.person_id, 'email_type': self.email_type, 'email_address': self.email_address}
 
     @staticmethod
-    def get_all_emails(sorted_data=None):
+    def json_columns(fields=None):
+        """Метод возвращает столбцы таблицы emails, которые отдаются в API (только атрибуты из fields, если он
+        передан)"""
+        table = Email.__table__
+        return [column for column in [table.c.person_id, table.c.email_type, table.c.email_address]
+                if selected(column.key, fields)]
+
+    @staticmethod
+    def rows_json(rows, fields=None):
+        """Метод сериализует строки таблицы emails, полученные из БД кортежами столбцов json_columns, без создания
+        ORM объектов"""
+        return rows_to_dicts(Email.json_columns(fields), rows)
+
+    @staticmethod
+    def json_by_person_ids(person_ids):
+        """Метод одним запросом возвращает сериализованные записи таблицы emails всех контактов из списка person_ids"""
+        query = db.session.query(*Email.json_columns()).filter(Email.person_id == id_array(person_ids))
+        return Email.rows_json(query.all())
+
+    @staticmethod
+    def get_all_emails(sorted_data=None, page_data=None, fields=None):
         """Метод принимает на вход параметры сортировки (если они есть) и возвращает список всех записей из
-        таблицы emails"""
+        таблицы emails. Если передан page_data с limit, возвращается одна страница записей и курсор следующей страницы"""
+        try:
+            columns = Email.json_columns(fields)
+            query = db.session.query(*columns)
+            if page_data and page_data.limit:
+                # постраничная выборка по курсору вместо выгрузки всей таблицы
+                query = db.session.query(*columns, *cursor_columns(Email, sorted_data, columns))
+                emails, next_cursor = keyset_page(Email, sorted_data, page_data, query)
+                return {'response': Email.rows_json(emails, fields), 'next_cursor': next_cursor}
+            if sorted_data:
+                query = query.order_by(text(sorted_data.sorted_by + ' ' + sorted_data.order))
+            return {'response': Email.rows_json(query.all(), fields)}
+        except (exc.ProgrammingError, KeyError) as pe:
+            return {'error': f'аттрибута {sorted_data.sorted_by} нет в таблице emails. Выберите один из следующих '
+                             f'атрибутов - {", ".join([m.key for m in Email.__table__.columns])}',
+                    'exception_name': pe.__class__.__name__, 'info': traceback.format_exc()}
+        except CursorError as ce:
+            return {'error': str(ce), 'exception_name': ce.__class__.__name__, 'info': traceback.format_exc()}
+        except exc.OperationalError as oe:
+            return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
+                    'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+
+    @staticmethod
+    def stream_all_emails(sorted_data=None, fields=None):
+        """Метод принимает на вход параметры сортировки (если они есть) и возвращает генератор пачек всех записей из
+        таблицы emails для потоковой выдачи. Записи читаются из БД через серверный курсор"""
         try:
+            query = db.session.query(*Email.json_columns(fields))
             if sorted_data:
-                return {'response':
-                        [Email.json(email) for email in Email.query.order_by(text(sorted_data.sorted_by + ' '
-                                                                             + sorted_data.order)).all()]}
-            return {'response': [Email.json(email) for email in Email.query.all()]}
+                query = query.order_by(text(sorted_data.sorted_by + ' ' + sorted_data.order))
+            return {'response': iter_batches(query, lambda rows: Email.rows_json(rows, fields))}
         except exc.ProgrammingError as pe:
             return {'error': f'аттрибута {sorted_data.sorted_by} нет в таблице emails. Выберите один из следующих '
                              f'атрибутов - {", ".join([m.key for m in Email.__table__.columns])}',
@@ -289,80 +860,159 @@ class Email(db.Model):
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
 
     @staticmethod
-    def get_email(person_id_obj):
+    def cached_json(person_id, fields=None):
+        """Метод возвращает список записей таблицы emails контакта из read-through кэша, при промахе загружает их
+        из БД и сохраняет в кэш. Если передан fields, возвращаются только его атрибуты (см. Person.cached_json)"""
+        key = cache_key('emails', person_id)
+        emails = read_cache(key)
+        if emails is None:
+            rows = db.session.query(*Email.json_columns(fields)).filter(Email.person_id == person_id).all()
+            emails = Email.rows_json(rows, fields)
+            if not fields:
+                fill_cache(key, emails)
+            return emails
+        return [select_fields(item, fields) for item in emails]
+
+    @staticmethod
+    def get_email(person_id_obj, fields=None):
         """"Метод принимает на вход person_id и возвращает соотвествующую запись или записи из таблицы emails"""
         try:
-            person = Person.query.filter_by(person_id=person_id_obj.person_id).first()
+            person = Person.cached_json(person_id_obj.person_id)
             if not person:
                 return {'response': f'Контакт с person_id = {person_id_obj.person_id} не найден в БД'}
-            email = [Email.json(email) for email in Email.query.filter(Email.person_id == person_id_obj.person_id).all()]
-            return {'response': email}
+            return {'response': Email.cached_json(person_id_obj.person_id, fields)}
         except exc.OperationalError as oe:
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
 
     @staticmethod
     def add_email(email_data):
-        """Метод принимает на вход атрибуты сущности Email и добавляет запись в таблицу emails в соответствии с person_id"""
+        """Метод принимает на вход атрибуты сущности Email и добавляет запись в таблицу emails в соответствии с person_id
+        одним запросом к БД. Если адрес уже есть в БД, результат зависит от режима on_conflict: error - ошибка, ignore -
+        запись не изменяется, update - изменяется тип адреса, если адрес принадлежит тому же контакту"""
         try:
-            person = Person.query.filter_by(person_id=email_data.person_id).first()
-            if not person:
-                return {'response': f'Контакт с person_id = {email_data.person_id} не найден в БД'}
-            new_email = Email(person_id=email_data.person_id, email_type=email_data.email_type,
-                              email_address=email_data.email_address)
-            db.session.add(new_email)
-            db.session.commit()
-            return {'response': f'Адрес почты {email_data.email_address} был добавлен'}
+            person_found, owner_id, inserted = execute_related(
+                email_statements[f'add_{email_data.on_conflict}'], email_data.person_id,
+                value=email_data.email_address, value_type=email_data.email_type)
         except exc.OperationalError as oe:
+            db.session.rollback()
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
         except exc.IntegrityError as ie:
+            db.session.rollback()
             return {'error': f'Email {email_data.email_address} уже есть в БД.',
                     'exception_name': ie.__class__.__name__, 'info': traceback.format_exc()}
+        if not person_found:
+            return {'response': f'Контакт с person_id = {email_data.person_id} не найден в БД'}
+        if inserted is None:
+            if email_data.on_conflict != 'error' and owner_id == int(email_data.person_id):
+                return {'response': f'Адрес почты {email_data.email_address} уже есть в контакте с person_id = '
+                                    f'{email_data.person_id}, данные не изменены'}
+            return {'error': f'Email {email_data.email_address} уже есть в БД.',
+                    'exception_name': exc.IntegrityError.__name__,
+                    'info': f'Key (email_address)=({email_data.email_address}) already exists.'}
+        invalidate_contact(email_data.person_id, 'emails', 'version')
+        if not inserted:
+            return {'response': f'Тип адреса почты {email_data.email_address} контакта с person_id = '
+                                f'{email_data.person_id} был изменен на {email_data.email_type}'}
+        index_add('email_address', [(email_data.email_address, int(email_data.person_id))])
+        return {'response': f'Адрес почты {email_data.email_address} был добавлен'}
 
     @staticmethod
     def update_email(email_data):
         """"Метод принимает person_id, существующий адрес почты и новый адрес для замены и заменяет
-        данные указанной почты."""
+        данные указанной почты одним запросом к БД."""
         try:
-            emails_by_id = Email.query.filter(Email.person_id == email_data.person_id).all()
-            email_for_update = [email for email in emails_by_id if email.email_address == email_data.old_email_address]
-            if len(email_for_update) == 0:
-                return {'response':
-                        f'Email {email_data.old_email_address} не был найден среди адресов контакта с person_id = '
-                        f'{email_data.person_id}. Для замены выберите один из существующих адресов: {emails_by_id}'}
-            email_for_update[0].email_type = email_data.email_type
-            email_for_update[0].email_address = email_data.email_address
-            db.session.commit()
-            return {'response': f'Адрес почты  {email_data.old_email_address} был заменен на {email_data.email_address}'}
+            updated, email_addresses = execute_related(
+                email_statements['update'], email_data.person_id, old_value=email_data.old_email_address,
+                value=email_data.email_address, value_type=email_data.email_type)
         except exc.OperationalError as oe:
+            db.session.rollback()
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
         except exc.IntegrityError as ie:
-            return {'error': f'Номер телефона {email_data.email_address} уже есть в БД.',
-                             'exception_name': ie.__class__.__name__, 'info': traceback.format_exc()}
+            db.session.rollback()
+            return {'error': f'Email {email_data.email_address} уже есть в БД.',
+                    'exception_name': ie.__class__.__name__, 'info': traceback.format_exc()}
+        if not updated:
+            return {'response':
+                    f'Email {email_data.old_email_address} не был найден среди адресов контакта с person_id = '
+                    f'{email_data.person_id}. Для замены выберите один из существующих адресов: '
+                    f'{", ".join(email_addresses or [])}'}
+        invalidate_contact(email_data.person_id, 'emails', 'version')
+        index_remove('email_address', [(email_data.old_email_address, int(email_data.person_id))])
+        index_add('email_address', [(email_data.email_address, int(email_data.person_id))])
+        return {'response': f'Адрес почты  {email_data.old_email_address} был заменен на {email_data.email_address}'}
 
     @staticmethod
     def delete_email(email_data):
         """Метод принимает на вход person_id и данные email которые нужно удалить  и удаляет соответствующую запись
-        из таблицы emails"""
+        из таблицы emails одним запросом к БД"""
         try:
-            emails_by_id = Email.query.filter(Email.person_id == email_data.person_id).all()
-            if not emails_by_id:
-                return {'response': f'Контакт с person_id = {email_data.person_id} не найден в БД'}
-            email_to_delete = [email for email in emails_by_id if email.email_address == email_data.email_address and
-                               email.email_type == email_data.email_type]
-            if len(email_to_delete) == 0:
-                return {'response':
-                        f'Email - {email_data.email_address} с указанным типом - {email_data.email_type} '
-                        f'не был найден среди адресов контакта с person_id = {email_data.person_id}. Для удаления '
-                        f'выберите один из существующих адресов: {emails_by_id} и проверьте соответствие email_type'}
-            db.session.delete(email_to_delete[0])
-            db.session.commit()
-            return {'response': f'адрес {email_data.email_address} был удален'}
+            deleted, email_addresses = execute_related(email_statements['delete'], email_data.person_id,
+                                                       value=email_data.email_address,
+                                                       value_type=email_data.email_type)
         except exc.OperationalError as oe:
+            db.session.rollback()
             return {'error': f'Не удалось подключиться к БД {db.engine.url.database}.',
                     'exception_name': oe.__class__.__name__, 'info': traceback.format_exc()}
+        if not email_addresses:
+            return {'response': f'Контакт с person_id = {email_data.person_id} не найден в БД'}
+        if not deleted:
+            return {'response':
+                    f'Email - {email_data.email_address} с указанным типом - {email_data.email_type} '
+                    f'не был найден среди адресов контакта с person_id = {email_data.person_id}. Для удаления '
+                    f'выберите один из существующих адресов: {", ".join(email_addresses)} и проверьте соответствие '
+                    f'email_type'}
+        invalidate_contact(email_data.person_id, 'emails', 'version')
+        index_remove('email_address', [(email_data.email_address, int(email_data.person_id))])
+        return {'response': f'адрес {email_data.email_address} был удален'}
 
     def __repr__(self):
         return f'<Email {self.email_address}, {self.email_type}>'
+
+
+class ImportProgress(db.Model):
+    """Класс содержит модель таблицы import_progress, в которой хранится состояние массового импорта контактов из
+    файла. Запись обновляется в одной транзакции с каждой загруженной пачкой, поэтому прерванный импорт можно
+    продолжить с первой незагруженной строки"""
+    __tablename__ = "import_progress"
+    __table_args__ = {'extend_existing': True}
+    source = db.Column(db.String(500), primary_key=True)
+    rows_done = db.Column(db.BigInteger, nullable=False, default=0)
+    rows_imported = db.Column(db.BigInteger, nullable=False, default=0)
+    rows_rejected = db.Column(db.BigInteger, nullable=False, default=0)
+    finished = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f'<ImportProgress {self.source}, {self.rows_done}>'
+
+
+class TableVersion(db.Model):
+    """Класс содержит модель таблицы table_versions со счетчиками изменений таблиц persons, phones и emails. Счетчики
+    увеличиваются методами записи в той же транзакции, что и изменение данных, и используются для ETag списков"""
+    __tablename__ = "table_versions"
+    __table_args__ = {'extend_existing': True}
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @staticmethod
+    def bump(*tables):
+        """Метод увеличивает счетчики изменений указанных таблиц в текущей транзакции. Строки счетчиков создаются
+        при первом изменении таблицы"""
+        # сортировка задает одинаковый порядок блокировки строк счетчиков во всех транзакциях
+        stmt = pg_insert(TableVersion.__table__).values([{'table_name': table, 'version': 1}
+                                                          for table in sorted(set(tables))])
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['table_name'],
+                                                      set_={'version': TableVersion.__table__.c.version + 1}))
+        note_bumps(*set(tables))
+
+    @staticmethod
+    def current(*tables):
+        """Метод одним запросом возвращает словарь текущих счетчиков изменений указанных таблиц"""
+        versions = dict(db.session.query(TableVersion.table_name, TableVersion.version)
+                        .filter(TableVersion.table_name.in_(tables)).all())
+        return {table: versions.get(table, 0) for table in tables}
+
+    def __repr__(self):
+        return f'<TableVersion {self.table_name}, {self.version}>'
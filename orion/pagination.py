@@ -0,0 +1,106 @@
+import base64
+import json
+from datetime import date
+from sqlalchemy import tuple_
+
+# В данном модуле находятся функции для постраничной (keyset) выборки записей из таблиц. Курсор страницы содержит
+# значение столбца сортировки и первичного ключа последней отданной записи, поэтому следующая страница выбирается
+# условием WHERE (sort_column, pk) > (значение, ключ) по индексу, а не через OFFSET, и время выборки не зависит от
+# того, насколько далеко от начала таблицы находится страница.
+
+
+class CursorError(ValueError):
+    """Исключение для курсора, который не удалось разобрать или который относится к другой сортировке"""
+
+
+def encode_cursor(sorted_by, order, last_value, last_pk):
+    """Функция упаковывает параметры сортировки и ключ последней записи страницы в непрозрачную строку курсора"""
+    payload = json.dumps([sorted_by, order, last_value, last_pk], default=str, ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, sorted_by, order, sort_column, pk_column):
+    """Функция распаковывает строку курсора и возвращает значения столбца сортировки и первичного ключа
+    последней записи предыдущей страницы"""
+    try:
+        cursor_sorted_by, cursor_order, last_value, last_pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise CursorError('Некорректное значение cursor. Используйте значение next_cursor из предыдущего ответа')
+    if (cursor_sorted_by, cursor_order) != (sorted_by, order):
+        raise CursorError(f'Курсор был получен для сортировки {cursor_sorted_by} {cursor_order}, а запрошена '
+                          f'сортировка {sorted_by} {order}')
+    return _column_value(sort_column, last_value), _column_value(pk_column, last_pk)
+
+
+def _column_value(column, value):
+    """Функция приводит значение из курсора к типу столбца (даты в курсоре хранятся в формате ISO). Содержимое
+    курсора передает клиент, поэтому значение не того типа считается некорректным курсором"""
+    python_type = column.type.python_type
+    try:
+        if python_type is date:
+            return date.fromisoformat(value)
+    except (ValueError, TypeError):
+        raise CursorError('Некорректное значение cursor. Используйте значение next_cursor из предыдущего ответа')
+    if not isinstance(value, python_type) or isinstance(value, bool):
+        raise CursorError('Некорректное значение cursor. Используйте значение next_cursor из предыдущего ответа')
+    return value
+
+
+def sort_params(model, sorted_data):
+    """Функция возвращает название столбца сортировки, направление сортировки и сам столбец модели. Если данных для
+    сортировки нет, записи сортируются по первичному ключу. Для неизвестного столбца поднимается KeyError"""
+    pk_column = model.__table__.primary_key.columns.values()[0]
+    if not sorted_data:
+        return pk_column.name, 'asc', pk_column
+    sorted_by = sorted_data.sorted_by.lower()
+    sort_column = model.__table__.columns.get(sorted_by)
+    if sort_column is None:
+        raise KeyError(sorted_by)
+    return sorted_by, sorted_data.order.lower(), sort_column
+
+
+def keyset_query(model, sorted_data, page_data, query=None):
+    """Функция возвращает запрос одной страницы записей модели (на одну запись больше page_data.limit), начиная после
+    записи из page_data.cursor, а также название и столбец сортировки. В query можно передать запрос к модели с
+    дополнительными опциями загрузки или запрос к отдельным столбцам"""
+    sorted_by, order, sort_column = sort_params(model, sorted_data)
+    pk_column = model.__table__.primary_key.columns.values()[0]
+    # первичный ключ добавляется в сортировку, чтобы порядок записей с одинаковым значением столбца был однозначным
+    key_columns = [sort_column] if sort_column is pk_column else [sort_column, pk_column]
+    query = model.query if query is None else query
+    query = query.order_by(*[column.desc() if order == 'desc' else column.asc() for column in key_columns])
+    if page_data.cursor:
+        last_value, last_pk = decode_cursor(page_data.cursor, sorted_by, order, sort_column, pk_column)
+        last_key = [last_value] if sort_column is pk_column else [last_value, last_pk]
+        if order == 'desc':
+            query = query.filter(tuple_(*key_columns) < tuple_(*last_key))
+        else:
+            query = query.filter(tuple_(*key_columns) > tuple_(*last_key))
+    # выбираем на одну запись больше, чтобы без отдельного запроса понять, есть ли следующая страница
+    return query.limit(page_data.limit + 1), sorted_by, order, sort_column
+
+
+def cursor_columns(model, sorted_data, columns):
+    """Функция возвращает столбец сортировки и первичный ключ, если их нет среди выбранных столбцов columns (атрибут
+    fields маршрутов чтения). Они добавляются в конец запроса страницы только для вычисления курсора следующей
+    страницы и в ответ не попадают"""
+    _, _, sort_column = sort_params(model, sorted_data)
+    pk_column = model.__table__.primary_key.columns.values()[0]
+    keys = {column.key for column in columns}
+    key_columns = [sort_column] if sort_column is pk_column else [sort_column, pk_column]
+    return [column for column in key_columns if column.key not in keys]
+
+
+def keyset_page(model, sorted_data, page_data, query=None):
+    """Функция возвращает одну страницу записей модели размером page_data.limit, начиная после записи из
+    page_data.cursor, и курсор следующей страницы (None, если страница последняя). В query можно передать запрос
+    к модели с дополнительными опциями загрузки"""
+    query, sorted_by, order, sort_column = keyset_query(model, sorted_data, page_data, query)
+    pk_column = model.__table__.primary_key.columns.values()[0]
+    rows = query.all()
+    if len(rows) <= page_data.limit:
+        return rows, None
+    rows = rows[:page_data.limit]
+    last_row = rows[-1]
+    next_cursor = encode_cursor(sorted_by, order, getattr(last_row, sort_column.key), getattr(last_row, pk_column.key))
+    return rows, next_cursor
@@ -0,0 +1,153 @@
+from sqlalchemy import delete, text
+from orion import db
+from orion.data_validation import SortedData, PageData
+from orion.models import Person, Phone, Email, TableVersion, id_array, phone_statements, email_statements
+from orion.pagination import keyset_query, keyset_page, cursor_columns
+from orion.search import search_sql, like_pattern, phone_pattern
+
+# В данном модуле находится проверка планов запросов. Для каждого вида запроса из модуля models (поиск контакта,
+# телефонов и email по person_id, пакетная выборка, страницы списков для каждого столбца сортировки) выполняется
+# EXPLAIN на заполненной БД, и проверка не проходит, если в плане есть последовательное чтение (Seq Scan) таблицы,
+# в которой не меньше min_rows строк. Выгрузка всей таблицы без limit читает ее целиком по определению и не проверяется.
+
+# минимальное количество строк в таблице, начиная с которого последовательное чтение считается ошибкой
+plan_check_min_rows = 10000
+# столбцы сортировки, доступные в модели данных SortedData, по таблицам
+sort_columns = {Person: ['person_id', 'full_name', 'birthday', 'file_path', 'gender', 'address'],
+                Phone: ['person_id', 'phone_type', 'phone_number'],
+                Email: ['person_id', 'email_type', 'email_address']}
+
+
+def explain(statement):
+    """Функция выполняет EXPLAIN для запроса SQLAlchemy и возвращает корневой узел плана в формате JSON"""
+    statement = getattr(statement, 'statement', statement)
+    connection = db.session.connection()
+    # параметры IN (...) раскрываются в тексте запроса, так как он выполняется напрямую через драйвер
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + compiled.string, compiled.params).scalar()
+    return plan[0]['Plan']
+
+
+def seq_scans(plan):
+    """Функция возвращает названия таблиц, которые читаются последовательно в узлах плана"""
+    nodes, tables = [plan], []
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            tables.append(node['Relation Name'])
+        nodes += node.get('Plans', [])
+    return tables
+
+
+def table_rows(tables):
+    """Функция возвращает оценку количества строк таблиц по статистике pg_class"""
+    rows = db.session.execute(text('SELECT relname, reltuples FROM pg_class WHERE relname = ANY(:tables)'),
+                              {'tables': list(tables)}).all()
+    return {name: max(int(reltuples), 0) for name, reltuples in rows}
+
+
+def page_shapes(model):
+    """Функция возвращает запросы первой и следующей страницы списка для каждого столбца и направления сортировки.
+    Курсор следующей страницы берется из ответа на первую страницу, как это делает клиент"""
+    shapes = []
+    for sorted_by in sort_columns[model]:
+        for order in ['asc', 'desc']:
+            sorted_data = SortedData(sorted_by=sorted_by, order=order)
+            query = db.session.query(*model.json_columns())
+            first_page, *_ = keyset_query(model, sorted_data, PageData(limit=100), query)
+            shapes.append((f'{model.__name__} страница, сортировка {sorted_by} {order}', first_page))
+            _, cursor = keyset_page(model, sorted_data, PageData(limit=100), query)
+            if cursor:
+                next_page, *_ = keyset_query(model, sorted_data, PageData(limit=100, cursor=cursor), query)
+                shapes.append((f'{model.__name__} следующая страница, сортировка {sorted_by} {order}', next_page))
+    return shapes
+
+
+def query_shapes():
+    """Функция возвращает список пар (описание, запрос) для всех видов запросов методов моделей с параметрами,
+    взятыми из данных БД"""
+    person_id = db.session.query(Person.person_id).order_by(Person.person_id).first()
+    person_id = person_id[0] if person_id else 1
+    person_ids = id_array([person_id, person_id + 1])
+    shapes = [
+        ('Person.cached_json: контакт по person_id',
+         db.session.query(*Person.json_columns()).filter(Person.person_id == person_id)),
+        ('Person.current_version: версия контакта',
+         db.session.query(Person.version).filter(Person.person_id == person_id)),
+        ('Person.get_persons: контакты по списку person_id',
+         db.session.query(*Person.json_columns()).filter(Person.person_id == person_ids)),
+        ('TableVersion.current: счетчики изменений таблиц',
+         db.session.query(TableVersion.table_name, TableVersion.version).filter(
+             TableVersion.table_name.in_(['persons', 'phones', 'emails']))),
+    ]
+    for model in [Phone, Email]:
+        shapes += [
+            (f'{model.__name__}.cached_json: записи контакта по person_id',
+             db.session.query(*model.json_columns()).filter(model.person_id == person_id)),
+            (f'{model.__name__}.json_by_person_ids: записи контактов по списку person_id',
+             db.session.query(*model.json_columns()).filter(model.person_id == person_ids)),
+            # каскадное удаление при удалении контакта ищет дочерние записи по person_id
+            (f'Person.delete_person: каскадное удаление из {model.__tablename__}',
+             delete(model.__table__).where(model.__table__.c.person_id == person_id)),
+        ]
+    phone_number = db.session.query(Phone.phone_number).order_by(Phone.phone_number).first()
+    phone_number = phone_number[0] if phone_number else '+79120000000'
+    email_address = db.session.query(Email.email_address).order_by(Email.email_address).first()
+    email_address = email_address[0] if email_address else 'ivanov@example.com'
+    shapes += [
+        ('Person.get_person_by_phone: контакт по номеру телефона',
+         db.session.query(*Person.json_columns()).join(Phone.__table__, Phone.person_id == Person.person_id)
+         .filter(Phone.phone_number == phone_number)),
+        ('Person.get_person_by_email: контакт по адресу почты',
+         db.session.query(*Person.json_columns()).join(Email.__table__, Email.person_id == Person.person_id)
+         .filter(Email.email_address == email_address)),
+    ]
+    for name, statements, value, value_type in [('Phone', phone_statements, phone_number, 'Мобильный'),
+                                                ('Email', email_statements, email_address, 'Личная')]:
+        params = {'person_id': person_id, 'value': value, 'value_type': value_type}
+        shapes += [
+            (f'{name}.add_{name.lower()}: добавление с изменением типа при конфликте (on_conflict update)',
+             statements['add_update'].bindparams(**params)),
+            (f'{name}.update_{name.lower()}: замена значения контакта',
+             statements['update'].bindparams(old_value=value, **params)),
+            (f'{name}.delete_{name.lower()}: удаление значения контакта', statements['delete'].bindparams(**params)),
+        ]
+    full_name = db.session.query(Person.full_name).filter(Person.person_id == person_id).scalar() or 'Иванов'
+    shapes.append(('Person.delete_persons: удаление контактов по списку person_id',
+                   Person.delete_persons_statement(Person.__table__.c.person_id == person_ids)))
+    shapes.append(('Person.update_persons: пакетное изменение контактов',
+                   Person.update_persons_statement({person_id: {'full_name': full_name}, person_id + 1: {}})))
+    shapes.append(('Person.search_persons: поиск по ФИО, адресу, email и телефону',
+                   text(search_sql).bindparams(query=full_name, pattern=like_pattern(full_name),
+                                               phone_pattern=phone_pattern(phone_number), search_emails=True,
+                                               search_phones=True, last_rank=None, last_pk=None, limit=21)))
+    for model in sort_columns:
+        shapes += page_shapes(model)
+    # страница с атрибутом fields: столбцы сортировки выбираются только для курсора
+    sorted_data = SortedData(sorted_by='full_name', order='asc')
+    columns = Person.json_columns(['full_name'])
+    fields_page, *_ = keyset_query(Person, sorted_data, PageData(limit=100),
+                                   db.session.query(*columns, *cursor_columns(Person, sorted_data, columns)))
+    shapes.append(('Person страница с fields person_id, full_name, сортировка full_name asc', fields_page))
+    return shapes
+
+
+def check_plans(min_rows=plan_check_min_rows, analyze=True, report=print):
+    """Функция выполняет EXPLAIN для всех видов запросов моделей и возвращает список нарушений - пар (описание
+    запроса, таблица), в которых таблица из min_rows и более строк читается последовательно. Перед проверкой
+    статистика таблиц обновляется командой ANALYZE, чтобы планы совпадали с планами рабочей БД"""
+    try:
+        if analyze:
+            db.session.execute(text('ANALYZE persons, phones, emails'))
+        rows = table_rows([Person.__tablename__, Phone.__tablename__, Email.__tablename__,
+                           TableVersion.__tablename__])
+        violations = []
+        for name, statement in query_shapes():
+            plan = explain(statement)
+            scanned = [table for table in seq_scans(plan) if rows.get(table, 0) >= min_rows]
+            violations += [(name, table) for table in scanned]
+            report(f'{"SEQ SCAN " + ", ".join(scanned) if scanned else "OK"} - {name} ({plan["Node Type"]}, '
+                   f'cost {plan["Total Cost"]})')
+        return violations
+    finally:
+        db.session.rollback()
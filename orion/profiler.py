@@ -0,0 +1,156 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import re
+import time
+from logging.handlers import RotatingFileHandler
+from flask import request, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from orion import app, config
+from orion.serialization import dumps
+
+# В данном модуле находится профилирование отдельных запросов к API. Профилирование включается для всех запросов
+# параметром enabled секции PROFILER файла config.ini или для отдельного запроса заголовком X-Orion-Profile (если
+# разрешено параметром allow_header). Для профилируемого запроса записываются все выполненные SQL запросы с временем
+# выполнения, одинаковые по форме запросы, повторенные n_plus_one_threshold и более раз, отмечаются как N+1, а при
+# опции cprofile собирается профиль cProfile обработчика. Результат возвращается в заголовках ответа (опция headers)
+# или в теле ответа (опция envelope: {"data": <ответ>, "profile": <профиль>}) и дописывается в файл log_file.
+# Если профилирование выключено и не разрешено заголовком, обработчики событий не регистрируются.
+
+profiler_enabled = config.getboolean('PROFILER', 'enabled', fallback=False)
+allow_header = config.getboolean('PROFILER', 'allow_header', fallback=False)
+# опции профилирования при enabled = true: headers, envelope, cprofile через запятую
+default_options = config.get('PROFILER', 'options', fallback='headers')
+# количество одинаковых по форме запросов, начиная с которого они отмечаются как N+1
+n_plus_one_threshold = config.getint('PROFILER', 'n_plus_one_threshold', fallback=3)
+# количество функций с наибольшим суммарным временем в профиле cProfile
+top_functions = config.getint('PROFILER', 'top_functions', fallback=20)
+log_file = config.get('PROFILER', 'log_file', fallback='')
+log_max_bytes = config.getint('PROFILER', 'log_max_bytes', fallback=10 * 1024 * 1024)
+log_backup_count = config.getint('PROFILER', 'log_backup_count', fallback=5)
+
+profile_header = 'X-Orion-Profile'
+profile_options = {'headers', 'envelope', 'cprofile'}
+# параметры запроса в тексте SQL (psycopg2 - %(name)s, asyncpg - $1) и списки параметров IN (...) разной длины
+placeholder_pattern = re.compile(r'%\(\w+\)s|\$\d+')
+placeholder_list_pattern = re.compile(r'\?(?:\s*,\s*\?)+')
+whitespace_pattern = re.compile(r'\s+')
+
+profile_logger = logging.getLogger('orion.profiler')
+if log_file:
+    log_handler = RotatingFileHandler(log_file, maxBytes=log_max_bytes, backupCount=log_backup_count,
+                                      encoding='utf-8')
+    log_handler.setFormatter(logging.Formatter('%(message)s'))
+    profile_logger.addHandler(log_handler)
+    profile_logger.setLevel(logging.INFO)
+    profile_logger.propagate = False
+
+
+def query_shape(statement):
+    """Функция возвращает форму SQL запроса: текст без значений параметров, списки параметров IN (...) любой длины
+    сворачиваются в один параметр, поэтому запросы, различающиеся только значениями, имеют одну форму"""
+    shape = placeholder_pattern.sub('?', statement)
+    shape = placeholder_list_pattern.sub('?', shape)
+    return whitespace_pattern.sub(' ', shape).strip()
+
+
+def requested_options():
+    """Функция возвращает опции профилирования запроса или None, если запрос не профилируется"""
+    header = request.headers.get(profile_header) if allow_header else None
+    if header is None:
+        if not profiler_enabled:
+            return None
+        header = default_options
+    options = {option.strip().lower() for option in header.split(',')} & profile_options
+    return options or {'headers'}
+
+
+def find_n_plus_one(statements):
+    """Функция группирует запросы по форме и возвращает формы, повторенные n_plus_one_threshold и более раз, в
+    порядке убывания количества повторов"""
+    shapes = {}
+    for item in statements:
+        count, total = shapes.get(item['statement'], (0, 0.0))
+        shapes[item['statement']] = (count + 1, total + item['duration_ms'])
+    return [{'statement': shape, 'count': count, 'total_ms': round(total, 3)}
+            for shape, (count, total) in sorted(shapes.items(), key=lambda item: -item[1][0])
+            if count >= n_plus_one_threshold]
+
+
+def cprofile_stats(profile):
+    """Функция возвращает текстовый отчет cProfile по функциям с наибольшим суммарным временем"""
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(top_functions)
+    return stream.getvalue()
+
+
+def sql_started(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('profile') is not None:
+        conn.info['orion_profile_start'] = time.perf_counter()
+
+
+def sql_finished(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+    profile = g.get('profile')
+    start = conn.info.pop('orion_profile_start', None)
+    if profile is None or start is None:
+        return
+    profile['statements'].append({'statement': query_shape(statement),
+                                  'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                                  'rows': cursor.rowcount, 'executemany': executemany})
+
+
+def start_profile():
+    options = requested_options()
+    if options is None:
+        return
+    g.profile = {'options': options, 'statements': [], 'start': time.perf_counter()}
+    if 'cprofile' in options:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            g.profile['cprofile'] = profile
+        except ValueError:
+            # в процессе уже работает другой профилировщик (например, в соседнем потоке)
+            g.profile['cprofile'] = None
+
+
+def finish_profile(response):
+    """Обработчик собирает результат профилирования запроса и добавляет его к ответу. Для потоковых ответов
+    учитываются только запросы, выполненные до начала отправки"""
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    duration_ms = round((time.perf_counter() - profile['start']) * 1000, 3)
+    statements = profile['statements']
+    result = {'route': request.url_rule.rule if request.url_rule else request.path, 'method': request.method,
+              'status': response.status_code, 'duration_ms': duration_ms, 'query_count': len(statements),
+              'query_ms': round(sum(item['duration_ms'] for item in statements), 3),
+              'n_plus_one': find_n_plus_one(statements), 'statements': statements}
+    if 'cprofile' in profile:
+        cprofile = profile['cprofile']
+        if cprofile is not None:
+            cprofile.disable()
+        result['cprofile'] = cprofile_stats(cprofile) if cprofile is not None else 'профилировщик занят'
+    if 'headers' in profile['options']:
+        response.headers[f'{profile_header}-Time'] = str(duration_ms)
+        response.headers[f'{profile_header}-Queries'] = str(result['query_count'])
+        response.headers[f'{profile_header}-Query-Time'] = str(result['query_ms'])
+        response.headers[f'{profile_header}-N-Plus-One'] = str(len(result['n_plus_one']))
+    if 'envelope' in profile['options'] and response.is_json and not response.is_streamed \
+            and not response.direct_passthrough:
+        response.set_data(dumps({'data': json.loads(response.get_data()), 'profile': result}))
+    if log_file:
+        profile_logger.info(dumps(result).decode())
+    return response
+
+
+if profiler_enabled or allow_header:
+    event.listen(Engine, 'before_cursor_execute', sql_started)
+    event.listen(Engine, 'after_cursor_execute', sql_finished)
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
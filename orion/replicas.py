@@ -0,0 +1,107 @@
+import itertools
+import re
+from flask import request, g
+from sqlalchemy import text, exc
+from sqlalchemy.engine import make_url
+from orion import app, db, config
+from orion.cache import raise_watermark
+
+# В данном модуле находится маршрутизация запросов к репликам БД. Если в секции REPLICAS файла config.ini указаны
+# адреса реплик, запросы маршрутов чтения (get_*, search_*) выполняются на репликах по очереди, а маршруты изменения
+# данных (add_*, update_*, delete_*) - на основной БД. Ответ на изменение данных содержит заголовок
+# X-Consistency-Token с позицией WAL основной БД после изменения. Если клиент передает этот заголовок в запросе
+# чтения, запрос выполняется на реплике, которая уже применила эту позицию, или на основной БД, если такой реплики нет.
+
+replica_uris = [uri.strip() for uri in config.get('REPLICAS', 'uris', fallback='').split(',') if uri.strip()]
+# префиксы маршрутов чтения и изменения данных
+read_prefixes = ('get_', 'search_')
+write_prefixes = ('add_', 'update_', 'delete_')
+consistency_header = 'X-Consistency-Token'
+# позиция WAL в текстовом формате pg_lsn, например 16/B374D848
+lsn_pattern = re.compile(r'^[0-9A-F]{1,8}/[0-9A-F]{1,8}$')
+
+_replica_engines = {}
+_next_replica = itertools.count()
+
+
+def replica_engines():
+    """Функция возвращает движки реплик. Движки создаются при первом запросе с тем же драйвером и настройками пула,
+    что и движок основной БД (в асинхронном режиме - asyncpg)"""
+    drivername = make_url(app.config['SQLALCHEMY_DATABASE_URI']).drivername
+    if drivername not in _replica_engines:
+        _replica_engines[drivername] = [
+            db.create_engine(make_url(uri).set(drivername=drivername),
+                             dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}))
+            for uri in replica_uris]
+    return _replica_engines[drivername]
+
+
+def replica_is_fresh(engine, token):
+    """Функция проверяет, применила ли реплика позицию WAL основной БД из токена согласованности. Недоступная
+    реплика считается отстающей"""
+    try:
+        with engine.connect() as connection:
+            return bool(connection.execute(text('SELECT pg_last_wal_replay_lsn() >= CAST(:token AS pg_lsn)'),
+                                           {'token': token}).scalar())
+    except exc.SQLAlchemyError:
+        return False
+
+
+def lsn_value(lsn):
+    """Функция переводит позицию WAL из текстового формата pg_lsn в число для сравнения позиций"""
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def replay_lsn(engine):
+    """Функция возвращает позицию WAL, которую уже применила реплика, или None, если реплика недоступна"""
+    try:
+        with engine.connect() as connection:
+            lsn = connection.execute(text('SELECT CAST(pg_last_wal_replay_lsn() AS text)')).scalar()
+    except exc.SQLAlchemyError:
+        return None
+    return lsn_value(lsn) if lsn else None
+
+
+def choose_replica(token=None):
+    """Функция возвращает движок реплики для запроса чтения: следующую реплику по очереди или, если передан токен
+    согласованности, первую реплику, применившую позицию из токена. Возвращает None, если читать нужно с основной БД"""
+    engines = replica_engines()
+    start = next(_next_replica) % len(engines)
+    engines = engines[start:] + engines[:start]
+    if token is None:
+        return engines[0]
+    if not lsn_pattern.match(token):
+        return None
+    return next((engine for engine in engines if replica_is_fresh(engine, token)), None)
+
+
+@app.before_request
+def route_to_replica():
+    """Обработчик выбирает реплику для запросов маршрутов чтения. Запрос с токеном согласованности не читает
+    данные из кэша контактов, чтобы не получить данные, записанные в кэш до изменения"""
+    if not replica_uris or not (request.endpoint or '').startswith(read_prefixes):
+        return
+    token = request.headers.get(consistency_header)
+    if token is not None:
+        token = token.strip().upper()
+        g.fresh_read = True
+    g.read_bind = choose_replica(token)
+
+
+@app.after_request
+def add_consistency_token(response):
+    """Обработчик добавляет к ответу маршрута изменения данных токен согласованности - текущую позицию WAL основной
+    БД, которая не меньше позиции только что сохраненного изменения"""
+    if not replica_uris or not (request.endpoint or '').startswith(write_prefixes) or response.status_code != 200:
+        return response
+    try:
+        lsn = db.session.execute(text('SELECT CAST(pg_current_wal_lsn() AS text)')).scalar()
+        db.session.commit()
+        response.headers[consistency_header] = lsn
+        if g.get('invalidated'):
+            # с этой позиции реплики могут снова заполнять кэш контактов (fill_cache)
+            raise_watermark(lsn_value(lsn))
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+    return response
@@ -0,0 +1,84 @@
+import re
+from sqlalchemy import Float, literal_column, text
+from orion import db
+from orion.pagination import encode_cursor, decode_cursor
+
+# В данном модуле находится поиск контактов по ФИО и адресу (и, по запросу, по email и номеру телефона). Совпадения
+# ищутся полнотекстовым поиском PostgreSQL с русской морфологией (иванова находит Иванов) и по сходству триграмм
+# (pg_trgm), которое находит слова с опечатками. Каждая ветка поиска использует свой GIN индекс из миграции
+# 5c2e8f1d7b34, найденные контакты ранжируются и отдаются постранично по курсору (rank, person_id).
+
+# конфигурация полнотекстового поиска должна совпадать с выражением индекса ix_persons_search_document
+search_config = 'russian'
+# размер страницы результатов поиска по умолчанию и максимальный
+search_default_limit = 20
+search_max_limit = 100
+
+# Ветки UNION выбирают person_id совпадений по отдельным индексам. Полнотекстовое совпадение и совпадение по
+# email/телефону весят больше, чем сходство триграмм. Ветки email и телефонов отключаются параметрами-флагами,
+# планировщик отбрасывает их без чтения таблиц.
+search_sql = f'''
+    WITH matches AS (
+        SELECT person_id, max(weight) AS weight FROM (
+            SELECT person_id, 1 AS weight FROM persons
+            WHERE to_tsvector('{search_config}', full_name || ' ' || address)
+                  @@ websearch_to_tsquery('{search_config}', :query)
+            UNION ALL
+            SELECT person_id, 0 FROM persons WHERE CAST(:query AS text) <% full_name
+            UNION ALL
+            SELECT person_id, 0 FROM persons WHERE CAST(:query AS text) <% address
+            UNION ALL
+            SELECT person_id, 1 FROM emails WHERE :search_emails AND email_address ILIKE :pattern
+            UNION ALL
+            SELECT person_id, 1 FROM phones WHERE :search_phones AND phone_number LIKE :phone_pattern
+        ) found
+        GROUP BY person_id
+    ), ranked AS (
+        SELECT p.person_id, p.file_path, p.full_name, p.gender, p.birthday, p.address,
+               CAST(m.weight
+                    + ts_rank_cd(to_tsvector('{search_config}', p.full_name || ' ' || p.address),
+                                 websearch_to_tsquery('{search_config}', :query))
+                    + word_similarity(:query, p.full_name) + word_similarity(:query, p.address) AS float8) AS rank
+        FROM persons p JOIN matches m USING (person_id)
+    )
+    SELECT person_id, file_path, full_name, gender, birthday, address, rank FROM ranked
+    WHERE CAST(:last_rank AS float8) IS NULL OR rank < :last_rank OR (rank = :last_rank AND person_id > :last_pk)
+    ORDER BY rank DESC, person_id
+    LIMIT :limit
+'''
+
+
+def like_pattern(query):
+    """Функция возвращает шаблон ILIKE для поиска подстроки с экранированием символов шаблона"""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def phone_pattern(query):
+    """Функция возвращает шаблон LIKE для поиска подстроки номера телефона. Номера хранятся в виде +7хххххххххх,
+    поэтому из строки поиска берутся только цифры, а начальная 8 (8(912)...) заменяется на 7. Для строки без цифр
+    возвращается None"""
+    digits = re.sub(r'\D', '', query)
+    if not digits:
+        return None
+    return like_pattern(re.sub(r'^8', '7', digits) if query.lstrip().startswith('8') else digits)
+
+
+def search_rows(search_data):
+    """Функция выполняет поиск контактов и возвращает строки страницы результатов (столбцы Person.json_columns и
+    rank) и курсор следующей страницы или None, если страница последняя"""
+    rank_column, pk_column = literal_column('rank', Float), literal_column('person_id', db.Integer)
+    last_rank, last_pk = None, None
+    if search_data.cursor:
+        # курсор действителен только для того же поискового запроса
+        last_rank, last_pk = decode_cursor(search_data.cursor, search_data.query, 'rank', rank_column, pk_column)
+    search_in = search_data.search_in or []
+    rows = db.session.execute(text(search_sql), {
+        'query': search_data.query, 'pattern': like_pattern(search_data.query),
+        'phone_pattern': phone_pattern(search_data.query), 'search_emails': 'email_address' in search_in,
+        'search_phones': 'phone_number' in search_in and phone_pattern(search_data.query) is not None,
+        'last_rank': last_rank, 'last_pk': last_pk, 'limit': search_data.limit + 1}).all()
+    if len(rows) <= search_data.limit:
+        return rows, None
+    rows = rows[:search_data.limit]
+    return rows, encode_cursor(search_data.query, 'rank', rows[-1].rank, rows[-1].person_id)
@@ -0,0 +1,77 @@
+from datetime import date
+from flask import current_app, json, jsonify
+from werkzeug.http import http_date
+from orion import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# В данном модуле находится быстрый путь сериализации ответов API. Записи для списков читаются из БД кортежами
+# столбцов (без создания ORM объектов) и превращаются в словари функцией rows_to_dicts. Ответ кодируется в JSON
+# библиотекой orjson, если она установлена, иначе стандартным модулем json. Результат побайтно совпадает с ответом
+# jsonify: ключи отсортированы, даты в формате HTTP-date, не-ASCII символы не экранируются, разделители без пробелов.
+
+# библиотека для кодирования JSON: auto - orjson, если установлена, orjson - только orjson, json - стандартный модуль
+json_backend = config.get('SERIALIZATION', 'backend', fallback='auto')
+if json_backend == 'orjson' and orjson is None:
+    raise ImportError('Для использования backend = orjson из config.ini установите библиотеку orjson')
+
+
+def selected(key, fields):
+    """Функция проверяет, входит ли атрибут в набор fields маршрута чтения. person_id входит в любой набор: по нему
+    клиент связывает телефоны и email с контактом. Пустой набор означает все атрибуты"""
+    return not fields or key == 'person_id' or key in fields
+
+
+def select_fields(item, fields):
+    """Функция оставляет в словаре записи только атрибуты из набора fields"""
+    if not fields:
+        return item
+    return {key: value for key, value in item.items() if selected(key, fields)}
+
+
+def rows_to_dicts(columns, rows):
+    """Функция превращает кортежи значений столбцов, полученные из БД, в словари с ключами по названиям столбцов.
+    Значения сверх количества столбцов (служебные столбцы в конце запроса) отбрасываются"""
+    keys = [column.key for column in columns]
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def group_by_person(items):
+    """Функция группирует словари записей связанной таблицы (phones, emails) по person_id"""
+    grouped = {}
+    for item in items:
+        grouped.setdefault(item['person_id'], []).append(item)
+    return grouped
+
+
+def orjson_default(obj):
+    """Функция кодирует типы, которые orjson не сериализует сам, так же, как JSONEncoder flask"""
+    if isinstance(obj, date):
+        return http_date(obj)
+    raise TypeError(f'Объект типа {obj.__class__.__name__} не сериализуется в JSON')
+
+
+def use_orjson():
+    """Функция проверяет, можно ли кодировать ответ через orjson без расхождения с jsonify: orjson всегда сортирует
+    ключи по опции и не экранирует не-ASCII символы, поэтому настройки приложения должны совпадать с этим поведением"""
+    return orjson is not None and json_backend != 'json' and current_app.config['JSON_SORT_KEYS'] \
+        and not current_app.config['JSON_AS_ASCII']
+
+
+def dumps(data):
+    """Функция кодирует данные в компактный JSON и возвращает bytes"""
+    if use_orjson():
+        return orjson.dumps(data, default=orjson_default,
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def json_response(data):
+    """Функция возвращает ответ в формате JSON, побайтно совпадающий с ответом jsonify. В режиме отладки и при
+    JSONIFY_PRETTYPRINT_REGULAR ответ форматируется с отступами, поэтому используется сам jsonify"""
+    if current_app.debug or current_app.config['JSONIFY_PRETTYPRINT_REGULAR']:
+        return jsonify(data)
+    return current_app.response_class(dumps(data) + b'\n', mimetype=current_app.config['JSONIFY_MIMETYPE'])
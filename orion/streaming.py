@@ -0,0 +1,32 @@
+from itertools import chain, islice
+from flask import Response, stream_with_context
+from orion.serialization import dumps
+
+# В данном модуле находятся функции для потоковой выдачи больших списков записей в формате NDJSON (одна JSON запись
+# на строку). Записи читаются из БД через серверный курсор пачками и сериализуются по мере отправки, поэтому память
+# процесса не зависит от размера таблицы.
+
+# количество записей, которое читается из серверного курсора и отправляется клиенту за один раз
+stream_batch_size = 1000
+ndjson_mimetype = 'application/x-ndjson'
+
+
+def iter_batches(query, serializer, batch_size=stream_batch_size):
+    """Функция выполняет запрос через серверный курсор и возвращает генератор пачек сериализованных записей.
+    serializer принимает список строк пачки и возвращает список словарей, что позволяет догружать связанные
+    сущности одним запросом на пачку. Первая пачка выбирается сразу, чтобы ошибки БД возникли до начала отправки
+    ответа"""
+    rows = iter(query.yield_per(batch_size))
+    batches = iter(lambda: serializer(list(islice(rows, batch_size))), [])
+    first_batch = next(batches, None)
+    if first_batch is None:
+        return iter(())
+    return chain([first_batch], batches)
+
+
+def ndjson_response(batches):
+    """Функция принимает генератор пачек записей и возвращает потоковый ответ в формате NDJSON"""
+    def generate():
+        for batch in batches:
+            yield b''.join(dumps(item) + b'\n' for item in batch)
+    return Response(stream_with_context(generate()), mimetype=ndjson_mimetype)
@@ -0,0 +1,189 @@
+from typing import List
+from collections import namedtuple
+from pydantic import BaseModel, EmailStr, ValidationError, validator
+from pydantic.class_validators import Optional
+from datetime import date
+import re
+
+# В данном модуле находятся правила проверки контактов, которые выполняются в процессах пула пакетной валидации.
+# Модуль не импортирует пакет orion: процессы пула запускаются через spawn и импортируют только его, а не приложение
+# Flask с подключением к БД. Остальные модели запросов и настройки валидации находятся в модуле orion.data_validation
+
+# блок с регулярными выражениями для проверки валидности данных
+file_path_validation_regexp = "^\\/([а-яА-Яa-zA-Z-_]+\\/)+([а-яА-Яa-zA-Z-_]+)(\\.)([a-zA-Z]{3,4})$"
+full_name_validation_regexp = "^[А-ЯЁ][а-яёА-ЯЁ\\-]{0,}\\s[А-ЯЁ][а-яёА-ЯЁ\\-]{1,}(\\s[А-ЯЁ][а-яёА-ЯЁ\\-]{1,})?$"
+address_validation_regexp = "^([А-Я][а-яёА-Я\\-]{1,})(?: +[А-Я][а-яёА-Я\\-]{1,})?, +(?:\\d+(?:-[яЯ])? +)?([А-Я]" \
+                            "[а-яёА-Я\\-]{1,})(?:( +[а-яёА-Я][а-яёА-Я\\-]{1,})|( +[а-я]))*?( +\\d+(\\-)?[а-яёА-Я])?," \
+                            " +д. +\\d+[А-Я]{0,1}, +кв. +\\d+$"
+phone_number_validation_regexp = '^((8|\\+7))(\\(?\\d{3}\\)?)([\\d]{7})$'
+person_id_validation_regexp = "^(\\d+)$"
+
+# регулярные выражения компилируются один раз при импорте модуля, а не при каждой проверке
+file_path_pattern = re.compile(file_path_validation_regexp)
+full_name_pattern = re.compile(full_name_validation_regexp)
+address_pattern = re.compile(address_validation_regexp)
+# \d без флага ASCII совпадает с любыми цифрами Unicode, а номер хранится в БД только цифрами ASCII
+phone_number_pattern = re.compile(phone_number_validation_regexp, re.ASCII)
+
+# режимы добавления телефона или email, который уже есть в БД: error - ошибка, ignore - ничего не менять, update -
+# изменить тип, если номер или адрес принадлежит тому же контакту
+upsert_modes = ['error', 'ignore', 'update']
+
+
+def canonical_phone_number(v, attribute='phone_number'):
+    """Функция проверяет номер телефона и возвращает его в каноническом виде +7хххххххххх. Номер хранится в БД только
+    в этом виде, поэтому один номер, переданный в разных форматах, не обходит проверку уникальности первичного ключа"""
+    if not phone_number_pattern.match(v):
+        raise ValueError(f'Неверный формат атрибута {attribute}. Ожидается номер в одном из форматов -'
+                         f' +7хххххххххх/+7(ххх)ххххххх/8хххххххххх/8(ххх)ххххххх. Было получено - {v}')
+    return '+7' + re.sub(r'\D', '', v)[-10:]
+
+
+def numeric_person_id(v):
+    """Функция проверяет, что person_id состоит из цифр ASCII (int() принимает и другие цифры Unicode, например "²"
+    проходит isdigit(), но не int()), и приводит его к виду person_id в ответах ("007" -> "7")"""
+    if not (v.isascii() and v.isdigit()):
+        raise ValueError(f'Значение атрибута person_id должно быть числовым')
+    return str(int(v))
+
+
+# определяем модели в классах библиотеки pydantic
+class EmailData(BaseModel):
+    email_address: EmailStr
+    email_type: str
+    person_id: Optional[str]
+    old_email_address: Optional[EmailStr]
+    on_conflict: str = 'error'
+
+    @validator('email_type')
+    def email_type_validator(cls, v):
+        email_types = ['Личная', 'Рабочая']
+        if v not in email_types:
+            raise ValueError(f'Значение атрибута email_type должно соответствовать одному из вариантов -  '
+                             f'{", ".join(email_types)}. Было получено - {v}')
+        return v.title()
+
+    @validator('person_id')
+    def order_validator(cls, v):
+        return numeric_person_id(v)
+
+    @validator('on_conflict')
+    def on_conflict_validator(cls, v):
+        if v not in upsert_modes:
+            raise ValueError(f'Значение атрибута on_conflict должно соответствовать одному из вариантов - '
+                             f'{", ".join(upsert_modes)}. Было получено - {v}')
+        return v
+
+
+class PhoneData(BaseModel):
+    phone_number: str
+    phone_type: str
+    person_id: Optional[str]
+    old_phone_number: Optional[str]
+    on_conflict: str = 'error'
+
+    @validator('phone_type')
+    def phone_type_validator(cls, v):
+        phone_types = ['Городской', 'Мобильный']
+        if v not in phone_types:
+            raise ValueError(f'Значение атрибута phone_number должно соответствовать одному из вариантов -  '
+                             f'{", ".join(phone_types)}. Было получено - {v}')
+        return v.title()
+
+    @validator('phone_number')
+    def phone_number_validator(cls, v):
+        return canonical_phone_number(v, 'phone_number')
+
+    @validator('old_phone_number')
+    def old_phone_number_validator(cls, v):
+        return canonical_phone_number(v, 'old_phone_number')
+
+    @validator('person_id')
+    def order_validator(cls, v):
+        return numeric_person_id(v)
+
+    @validator('on_conflict')
+    def on_conflict_validator(cls, v):
+        if v not in upsert_modes:
+            raise ValueError(f'Значение атрибута on_conflict должно соответствовать одному из вариантов - '
+                             f'{", ".join(upsert_modes)}. Было получено - {v}')
+        return v
+
+
+class PersonData(BaseModel):
+    file_path: str
+    full_name: str
+    gender: str
+    birthday: date
+    address: str
+    person_id: Optional[str]
+    phones: Optional[List[PhoneData]]
+    emails: Optional[List[EmailData]]
+
+    @validator('file_path')
+    def file_path_validator(cls, v):
+        if not file_path_pattern.match(v):
+            raise ValueError(f'Неверный формат атрибута file_path. Ожидается путь в подобном формате - '
+                             f'/media/profile_images/profile_photo.jpg. Было получено - {v}')
+        return v.title()
+
+    @validator('full_name')
+    def full_name_validator(cls, v):
+        if not full_name_pattern.match(v):
+            raise ValueError(f'Неверный формат атрибута full_name. Ожидается ФИО в подобном формате - '
+                             f'Иванов Иван Иванович. Было получено - {v}')
+        return v.title()
+
+    @validator('gender')
+    def gender_validator(cls, v):
+        genders = ['Мужской', 'Женский']
+        if v not in genders:
+            raise ValueError(f'Значение атрибута genders должно соответствовать одному из вариантов - '
+                             f'{", ".join(genders)}. Было получено - {v}')
+        return v.title()
+
+    @validator('address')
+    def address_validator(cls, v):
+        if not address_pattern.match(v):
+            raise ValueError('Неверный формат атрибута address. Ожидается адрес в  подобном формате - '
+                             'Красноярск, Мира, д. 1, кв. 3 (элементы - "город", "улица", "дом", "квартира",'
+                             ' разделены запятой и пробелом, количество пробелов между элементами  и внутри'
+                             ' них может быть больше одного, названия улиц и городов начинаются с заглавной '
+                             f'буквы). Было получено - {v}')
+        return v.title()
+
+    @validator('person_id')
+    def order_validator(cls, v):
+        return numeric_person_id(v)
+
+    @validator('phones', 'emails', each_item=True)
+    def on_conflict_validator(cls, v):
+        # новый контакт добавляется целиком, поэтому повторяющийся номер или адрес всегда ошибка
+        if 'on_conflict' in v.__fields_set__:
+            raise ValueError('Атрибут on_conflict поддерживается только маршрутами add_phone и add_email')
+        return v
+
+
+# проверенный контакт в компактном виде: кортежи быстро передаются из процессов пула, в отличие от моделей pydantic
+ValidPhone = namedtuple('ValidPhone', ['phone_number', 'phone_type'])
+ValidEmail = namedtuple('ValidEmail', ['email_address', 'email_type'])
+ValidPerson = namedtuple('ValidPerson', ['file_path', 'full_name', 'gender', 'birthday', 'address', 'phones', 'emails'])
+
+
+def validate_chunk(first_index, items):
+    """Функция проверяет часть списка контактов и возвращает список проверенных контактов ValidPerson и список
+    ошибок с индексами контактов в исходном списке. Проверка не останавливается на первом невалидном контакте"""
+    persons, errors = [], []
+    for index, item in enumerate(items, start=first_index):
+        try:
+            person = PersonData(**item)
+        except ValidationError as ve:
+            errors.append({'index': index, 'error': ve.errors()})
+            continue
+        except TypeError:
+            errors.append({'index': index, 'error': 'Контакт должен быть объектом JSON с атрибутами контакта'})
+            continue
+        persons.append(ValidPerson(person.file_path, person.full_name, person.gender, person.birthday, person.address,
+                                   [ValidPhone(phone.phone_number, phone.phone_type) for phone in person.phones or []],
+                                   [ValidEmail(email.email_address, email.email_type) for email in person.emails or []]))
+    return persons, errors
@@ -1,2 +1,17 @@
-from orion import app
-app.run(debug=True)
+import argparse
+
+# Запуск приложения: python runserver.py - синхронный режим (сервер разработки Flask),
+# python runserver.py --asgi - асинхронный режим (модуль orion/asgi.py, требуются библиотеки asyncpg и uvicorn)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Запуск REST API сервера «Адресная книга»')
+    parser.add_argument('--asgi', action='store_true', help='асинхронный режим с драйвером asyncpg')
+    parser.add_argument('--host', default='127.0.0.1', help='адрес сервера')
+    parser.add_argument('--port', type=int, default=None, help='порт сервера (по умолчанию 5000, для --asgi - 8000)')
+    args = parser.parse_args()
+    if args.asgi:
+        import uvicorn
+        uvicorn.run('orion.asgi:application', host=args.host, port=args.port or 8000, lifespan='on')
+    else:
+        from orion import app
+        app.run(host=args.host, port=args.port or 5000, debug=True)
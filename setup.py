@@ -3,6 +3,7 @@ from setuptools import setup
 setup(
     name='orion',
     packages=['orion'],
+    py_modules=['orion_validation'],
     include_package_data=True,
     install_requires=[
         'flask',
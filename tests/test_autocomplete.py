@@ -0,0 +1,67 @@
+import unittest
+from orion.autocomplete import PrefixIndex, merge_threshold, normalize
+
+# Индекс автодополнения: вставка и удаление по одной записи и слиянием больших пачек дают одинаковый индекс, поиск
+# по префиксу не выходит за границы записей с этим префиксом
+
+
+class PrefixIndexTest(unittest.TestCase):
+
+    def names(self, count):
+        return [(f'Иванов {ind:03}', ind) for ind in range(count)]
+
+    def test_add_small_and_merge(self):
+        pairs = self.names(merge_threshold * 2)
+        small, merged = PrefixIndex('full_name'), PrefixIndex('full_name')
+        for pair in pairs:
+            small.add([pair])
+        merged.add(pairs[:merge_threshold])
+        # пачка пересекается с уже добавленными записями, повторные записи не дублируются
+        merged.add(pairs)
+        self.assertEqual(merged._entries, small._entries)
+        self.assertEqual(merged._entries, sorted(merged._entries))
+        self.assertEqual(len(merged._entries), len(pairs))
+
+    def test_add_duplicates(self):
+        index = PrefixIndex('full_name')
+        index.add([('Иванов', 1), ('Иванов', 1)])
+        index.add([('Иванов', 1), ('Иванов', 2)])
+        self.assertEqual(index.complete('иванов', 10), [{'person_id': 1, 'full_name': 'Иванов'},
+                                                        {'person_id': 2, 'full_name': 'Иванов'}])
+
+    def test_remove_small_and_large(self):
+        pairs = self.names(merge_threshold * 3)
+        for removed in [pairs[:2], pairs[:merge_threshold * 2]]:
+            with self.subTest(count=len(removed)):
+                index = PrefixIndex('full_name')
+                index.add(pairs)
+                # удаление отсутствующей записи ничего не меняет
+                index.remove(removed + [('Петров', 1)])
+                self.assertEqual([item['person_id'] for item in index.complete('иванов', 1000)],
+                                 [person_id for _, person_id in pairs[len(removed):]])
+
+    def test_prefix_equal_to_key(self):
+        index = PrefixIndex('full_name')
+        index.add([('Иван', 1), ('Иванов', 2), ('Иванова', 3), ('Ивашов', 4), ('Ива', 5)])
+        self.assertEqual([item['person_id'] for item in index.complete('Иванов', 10)], [2, 3])
+        self.assertEqual([item['person_id'] for item in index.complete('иван', 10)], [1, 2, 3])
+        self.assertEqual([item['person_id'] for item in index.complete('Ивановы', 10)], [])
+        self.assertEqual([item['person_id'] for item in index.complete('иванов', 1)], [2])
+
+    def test_boundaries(self):
+        index = PrefixIndex('full_name')
+        index.add([('Яковлев', 1), ('Абрамов', 2)])
+        self.assertEqual(index.complete('я', 10), [{'person_id': 1, 'full_name': 'Яковлев'}])
+        self.assertEqual(index.complete('а', 10), [{'person_id': 2, 'full_name': 'Абрамов'}])
+        self.assertEqual(index.complete('ё', 10), [])
+        self.assertEqual(PrefixIndex('full_name').complete('а', 10), [])
+
+    def test_phone_number(self):
+        index = PrefixIndex('phone_number')
+        index.add([('+79161234567', 1), ('+79261234567', 2)])
+        self.assertEqual(normalize('phone_number', '8 (916) 12'), '791612')
+        self.assertEqual(index.complete('8 (916) 12', 10), [{'person_id': 1, 'phone_number': '+79161234567'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+from unittest import mock
+from flask import g
+from orion import app, cache
+from orion.cache import LRUCache, SharedCache, LocalBackend, tombstone, read_cache, fill_cache, raise_watermark
+from orion.replicas import lsn_value
+
+# Кэш отдельных контактов: вытеснение давно не использованных записей, время жизни записей и заполнение при промахе
+# (SET NX), которое не перезаписывает метку инвалидации, и заполнение данными реплики не старше последнего изменения
+
+
+class Clock:
+    """Управляемые часы вместо time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('orion.cache.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class LRUCacheTest(CacheTestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # чтение делает запись a недавно использованной, поэтому вытесняется b
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        cache = LRUCache(max_size=10, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=5)
+        self.clock.now += 10
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.clock.now += 60
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 2)
+
+    def test_disabled(self):
+        cache = LRUCache(max_size=0, ttl=0)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_nx_keeps_tombstone(self):
+        cache = LRUCache(max_size=10, ttl=60)
+        cache.set('a', 1)
+        cache.set('a', tombstone, ttl=5)
+        # промах по метке инвалидации не заполняет ключ значением, прочитанным до изменения
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1, nx=True)
+        self.assertIsNone(cache.get('a'))
+        # после истечения метки ключ снова заполняется
+        self.clock.now += 10
+        cache.set('a', 2, nx=True)
+        self.assertEqual(cache.get('a'), 2)
+
+    def test_nx_keeps_value(self):
+        cache = LRUCache(max_size=10, ttl=60)
+        cache.set('a', 1, nx=True)
+        cache.set('a', 2, nx=True)
+        self.assertEqual(cache.get('a'), 1)
+
+
+class SharedCacheTest(CacheTestCase):
+
+    def test_nx_keeps_tombstone(self):
+        cache = SharedCache(LocalBackend(), ttl=60)
+        cache.set('a', {'person_id': 1})
+        self.assertEqual(cache.get('a'), {'person_id': 1})
+        cache.set('a', tombstone, ttl=5)
+        cache.set('a', {'person_id': 1}, nx=True)
+        self.assertIsNone(cache.get('a'))
+        self.clock.now += 10
+        cache.set('a', {'person_id': 2}, nx=True)
+        self.assertEqual(cache.get('a'), {'person_id': 2})
+
+    def test_ttl(self):
+        cache = SharedCache(LocalBackend(), ttl=60)
+        cache.set('a', 1)
+        self.clock.now += 61
+        self.assertIsNone(cache.get('a'))
+
+    def test_watermark(self):
+        cache = SharedCache(LocalBackend(), ttl=60)
+        self.assertEqual(cache.watermark(), 0)
+        cache.raise_watermark(200)
+        cache.raise_watermark(100)
+        self.assertEqual(cache.watermark(), 200)
+
+
+class ReplicaFillTest(unittest.TestCase):
+    """Заполнение кэша при чтении на реплике: реплика, которая до чтения не применила последнее изменение
+    контактов, кэш не заполняет"""
+
+    def setUp(self):
+        patcher = mock.patch.object(cache, 'contact_cache', LRUCache(max_size=10, ttl=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_on_replica(self, replica_lsn, token=False):
+        with app.test_request_context(), \
+                mock.patch('orion.replicas.replay_lsn', return_value=replica_lsn) as replay_lsn:
+            g.read_bind = object()
+            g.fresh_read = token
+            self.assertIsNone(read_cache('person:1'))
+            self.assertIsNone(read_cache('phones:1'))
+            fill_cache('person:1', {'person_id': 1})
+            # позиция реплики запрашивается один раз за запрос, до чтения данных
+            replay_lsn.assert_called_once_with(g.read_bind)
+        return cache.contact_cache.get('person:1')
+
+    def test_replica_behind(self):
+        raise_watermark(lsn_value('0/3000060'))
+        self.assertIsNone(self.read_on_replica(lsn_value('0/3000000')))
+        self.assertIsNone(self.read_on_replica(None))
+
+    def test_replica_caught_up(self):
+        raise_watermark(lsn_value('0/3000060'))
+        self.assertEqual(self.read_on_replica(lsn_value('0/3000060')), {'person_id': 1})
+
+    def test_no_changes(self):
+        self.assertEqual(self.read_on_replica(lsn_value('0/0'), token=True), {'person_id': 1})
+
+    def test_primary(self):
+        raise_watermark(lsn_value('1/0'))
+        with app.test_request_context():
+            fill_cache('person:1', {'person_id': 1})
+        self.assertEqual(cache.contact_cache.get('person:1'), {'person_id': 1})
+
+    def test_lsn_value(self):
+        self.assertLess(lsn_value('0/FFFFFFFF'), lsn_value('1/0'))
+        self.assertLess(lsn_value('16/B374D848'), lsn_value('16/B374D849'))
+
+
+if __name__ == '__main__':
+    unittest.main()
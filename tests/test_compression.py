@@ -0,0 +1,50 @@
+import unittest
+from unittest import mock
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+from orion import compression
+from orion.compression import choose_encoding
+
+# Выбор кодировки сжатия по заголовку Accept-Encoding: вес клиента важнее порядка предпочтения сервера, кодировки
+# с весом 0 не выбираются
+
+
+def accept(header):
+    return parse_accept_header(header, Accept)
+
+
+class ChooseEncodingTest(unittest.TestCase):
+
+    def setUp(self):
+        # результат не зависит от того, установлена ли библиотека zstandard
+        patcher = mock.patch.object(compression, 'zstandard', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_server_preference(self):
+        self.assertEqual(choose_encoding(accept('deflate, gzip')), 'gzip')
+        self.assertEqual(choose_encoding(accept('*')), 'gzip')
+
+    def test_q_values(self):
+        self.assertEqual(choose_encoding(accept('gzip;q=0.5, deflate')), 'deflate')
+        self.assertEqual(choose_encoding(accept('gzip;q=0.8, deflate;q=0.9')), 'deflate')
+        self.assertEqual(choose_encoding(accept('gzip;q=0, *')), 'deflate')
+
+    def test_nothing_acceptable(self):
+        for header in ['', 'identity', 'identity;q=0', 'br', 'gzip;q=0, deflate;q=0']:
+            with self.subTest(header=header):
+                self.assertIsNone(choose_encoding(accept(header)))
+
+    def test_identity_refused(self):
+        # identity;q=0 запрещает несжатый ответ, поэтому выбирается любая поддерживаемая кодировка, даже с малым весом
+        self.assertEqual(choose_encoding(accept('identity;q=0, deflate;q=0.1')), 'deflate')
+
+    def test_zstd(self):
+        with mock.patch.object(compression, 'zstandard', object()):
+            self.assertEqual(choose_encoding(accept('gzip, zstd')), 'zstd')
+            self.assertEqual(choose_encoding(accept('gzip, zstd;q=0.5')), 'gzip')
+        self.assertEqual(choose_encoding(accept('zstd, gzip')), 'gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from unittest import mock
+from pydantic import ValidationError
+from sqlalchemy.dialects import postgresql
+from orion import app
+from orion.data_validation import PersonFilterData, max_batch_size
+from orion.models import Person
+
+# Удаление контактов по фильтру (маршрут delete_persons) - путь, на котором ошибка в фильтре удаляет лишние контакты.
+# Тесты не требуют БД: проверяются модель фильтра и ограничение количества удаляемых контактов
+
+
+class PersonFilterDataTest(unittest.TestCase):
+
+    def test_person_id_is_rejected(self):
+        # person_id не участвует в условии удаления, поэтому фильтр с ним удалил бы всех мужчин, а не один контакт
+        with self.assertRaises(ValidationError):
+            PersonFilterData(person_id='5', gender='Мужской')
+
+    def test_phones_and_emails_are_rejected(self):
+        with self.assertRaises(ValidationError):
+            PersonFilterData(gender='Мужской', phones=[])
+        with self.assertRaises(ValidationError):
+            PersonFilterData(gender='Мужской', emails=[])
+
+    def test_unknown_attribute_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            PersonFilterData(gendr='Мужской', full_name='Иванов Иван')
+
+    def test_empty_filter_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            PersonFilterData()
+
+    def test_valid_filter(self):
+        self.assertEqual(PersonFilterData(gender='Мужской').gender, 'Мужской')
+
+
+class DeletePersonsByFilterTest(unittest.TestCase):
+
+    def delete(self, rows):
+        session = mock.MagicMock()
+        session.execute.return_value.all.return_value = rows
+        with app.app_context(), mock.patch('orion.models.db.session', session):
+            result = Person.delete_persons_by_filter(PersonFilterData(gender='Мужской'))
+        return result, session
+
+    def test_over_limit_is_rolled_back(self):
+        rows = [(person_id, 'Иванов Иван', None, None) for person_id in range(1, max_batch_size + 2)]
+        result, session = self.delete(rows)
+        self.assertIn('error', result)
+        session.rollback.assert_called_once()
+        session.commit.assert_not_called()
+
+    def test_delete_statement_is_limited(self):
+        result, session = self.delete([(1, 'Иванов Иван', None, None)])
+        self.assertEqual(result['deleted'], ['1'])
+        session.commit.assert_called_once()
+        statement = session.execute.call_args_list[0].args[0]
+        sql = str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+        self.assertIn(f'LIMIT {max_batch_size + 1}', sql)
+        self.assertIn("persons.gender = 'Мужской'", sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
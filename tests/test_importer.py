@@ -0,0 +1,39 @@
+import unittest
+from datetime import date
+from orion.importer import split_duplicates
+from orion_validation import ValidPerson, ValidPhone, ValidEmail
+
+# Отбор повторяющихся контактов пачки импорта. Тесты не требуют БД: значения, которые уже есть в БД, передаются
+# в split_duplicates явно
+
+
+def contact(phone, email):
+    return ValidPerson('/media/a/b.jpg', 'Иванов Иван', 'Мужской', date(1990, 1, 1), 'Москва, Мира, д. 1, кв. 1',
+                       [ValidPhone(phone, 'Мобильный')], [ValidEmail(email, 'Личная')])
+
+
+class SplitDuplicatesTest(unittest.TestCase):
+
+    def test_rejected_row_does_not_reject_later_rows(self):
+        # строка 1 отклоняется из-за телефона, который уже есть в БД, поэтому ее email не занят и строка 2 с тем же
+        # email принимается; строка 3 повторяет телефон принятой строки 2 и отклоняется
+        contacts = [(1, contact('+79000000001', 'a@example.com')),
+                    (2, contact('+79000000002', 'a@example.com')),
+                    (3, contact('+79000000002', 'b@example.com'))]
+        accepted, duplicate_rows = split_duplicates(contacts, {'+79000000001'}, set())
+        self.assertEqual([row_num for row_num, _ in accepted], [2])
+        self.assertEqual(duplicate_rows, [1, 3])
+
+    def test_existing_email(self):
+        contacts = [(1, contact('+79000000001', 'a@example.com')), (2, contact('+79000000002', 'b@example.com'))]
+        accepted, duplicate_rows = split_duplicates(contacts, set(), {'b@example.com'})
+        self.assertEqual([row_num for row_num, _ in accepted], [1])
+        self.assertEqual(duplicate_rows, [2])
+
+    def test_no_duplicates(self):
+        contacts = [(1, contact('+79000000001', 'a@example.com')), (2, contact('+79000000002', 'b@example.com'))]
+        self.assertEqual(split_duplicates(contacts, set(), set()), (contacts, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
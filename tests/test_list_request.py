@@ -0,0 +1,48 @@
+import unittest
+from pydantic import ValidationError
+from orion import app
+from orion.api.handlers import parse_list_request
+
+# Разбор запросов маршрутов списков: данные для сортировки необязательны при любом наборе остальных атрибутов
+
+
+def parse(body=None, **kwargs):
+    with app.test_request_context('/api/get_persons_list', method='POST', json=body, **kwargs):
+        return parse_list_request()
+
+
+class ParseListRequestTest(unittest.TestCase):
+
+    def test_without_sorting(self):
+        for body in [None, {}, {'fields': ['full_name']}, {'expand': ['phones']},
+                     {'expand': 'emails', 'fields': 'full_name'}]:
+            with self.subTest(body=body):
+                sorted_data, page_data = parse(body)
+                self.assertIsNone(sorted_data)
+                self.assertIsNone(page_data.limit)
+                self.assertFalse(page_data.stream)
+
+    def test_sorting(self):
+        for body in [{'sorted_by': 'full_name', 'order': 'desc'},
+                     {'sorted_by': 'full_name', 'order': 'desc', 'fields': ['full_name'], 'expand': ['phones']}]:
+            with self.subTest(body=body):
+                sorted_data, _ = parse(body)
+                self.assertEqual((sorted_data.sorted_by, sorted_data.order), ('Full_Name', 'Desc'))
+
+    def test_incomplete_sorting(self):
+        for body in [{'sorted_by': 'full_name'}, {'order': 'asc', 'fields': ['full_name']},
+                     {'order': 'asc', 'limit': 10}]:
+            with self.subTest(body=body), self.assertRaises(ValidationError):
+                parse(body)
+
+    def test_page_and_stream(self):
+        _, page_data = parse({'limit': 10, 'expand': ['phones']})
+        self.assertEqual(page_data.limit, 10)
+        _, page_data = parse({}, headers={'Accept': 'application/x-ndjson'})
+        self.assertTrue(page_data.stream)
+        _, page_data = parse({'stream': False}, headers={'Accept': 'application/x-ndjson'})
+        self.assertFalse(page_data.stream)
+
+
+if __name__ == '__main__':
+    unittest.main()
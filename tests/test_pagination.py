@@ -0,0 +1,54 @@
+import base64
+import json
+import unittest
+from datetime import date
+from orion.models import Person
+from orion.pagination import encode_cursor, decode_cursor, CursorError
+
+# Курсор постраничной выборки передает клиент, поэтому любое его искажение должно давать CursorError, а не ошибку
+# сервера. Тесты не требуют БД
+
+
+def tampered(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+class CursorTest(unittest.TestCase):
+    pk = Person.__table__.c.person_id
+
+    def test_round_trip_date(self):
+        cursor = encode_cursor('birthday', 'asc', date(1990, 5, 17), 42)
+        self.assertEqual(decode_cursor(cursor, 'birthday', 'asc', Person.__table__.c.birthday, self.pk),
+                         (date(1990, 5, 17), 42))
+
+    def test_round_trip_string(self):
+        cursor = encode_cursor('full_name', 'desc', 'Иванов Иван', 7)
+        self.assertEqual(decode_cursor(cursor, 'full_name', 'desc', Person.__table__.c.full_name, self.pk),
+                         ('Иванов Иван', 7))
+
+    def test_mismatched_sort(self):
+        cursor = encode_cursor('full_name', 'asc', 'Иванов Иван', 7)
+        with self.assertRaises(CursorError):
+            decode_cursor(cursor, 'full_name', 'desc', Person.__table__.c.full_name, self.pk)
+        with self.assertRaises(CursorError):
+            decode_cursor(cursor, 'address', 'asc', Person.__table__.c.address, self.pk)
+
+    def test_not_base64_or_json(self):
+        for cursor in ['не курсор', base64.urlsafe_b64encode(b'{not json').decode(), tampered([1, 2])]:
+            with self.assertRaises(CursorError):
+                decode_cursor(cursor, 'full_name', 'asc', Person.__table__.c.full_name, self.pk)
+
+    def test_tampered_values(self):
+        cases = [(['birthday', 'asc', 19900517, 1], Person.__table__.c.birthday),
+                 (['birthday', 'asc', '1990-13-45', 1], Person.__table__.c.birthday),
+                 (['full_name', 'asc', 5, 1], Person.__table__.c.full_name),
+                 (['full_name', 'asc', 'Иванов Иван', '1'], Person.__table__.c.full_name),
+                 (['full_name', 'asc', 'Иванов Иван', True], Person.__table__.c.full_name),
+                 (['full_name', 'asc', None, 1], Person.__table__.c.full_name)]
+        for payload, column in cases:
+            with self.subTest(payload=payload), self.assertRaises(CursorError):
+                decode_cursor(tampered(payload), payload[0], 'asc', column, self.pk)
+
+
+if __name__ == '__main__':
+    unittest.main()
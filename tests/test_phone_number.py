@@ -0,0 +1,28 @@
+import unittest
+from orion_validation import canonical_phone_number
+
+# Канонический вид номера телефона: номер, переданный в разных форматах, хранится в БД одной строкой +7хххххххххх
+
+
+class CanonicalPhoneNumberTest(unittest.TestCase):
+
+    def test_formats(self):
+        for phone_number in ['+79161234567', '+7(916)1234567', '89161234567', '8(916)1234567']:
+            with self.subTest(phone_number=phone_number):
+                self.assertEqual(canonical_phone_number(phone_number), '+79161234567')
+
+    def test_invalid(self):
+        # 10 цифр без кода страны, 11 цифр с ведущей 7 без "+", +8, неверное количество цифр, разделители внутри
+        # номера и цифры не ASCII
+        for phone_number in ['9161234567', '79161234567', '+89161234567', '7(916)1234567', '+7916123456',
+                             '+791612345678', '8916123456', '8 916 123 45 67', '+7(916)123-45-67', '8٩١٦1234567', '']:
+            with self.subTest(phone_number=phone_number), self.assertRaises(ValueError):
+                canonical_phone_number(phone_number)
+
+    def test_attribute_in_error(self):
+        with self.assertRaisesRegex(ValueError, 'old_phone_number'):
+            canonical_phone_number('123', 'old_phone_number')
+
+
+if __name__ == '__main__':
+    unittest.main()
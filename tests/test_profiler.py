@@ -0,0 +1,53 @@
+import unittest
+from unittest import mock
+from orion import profiler
+from orion.profiler import query_shape, find_n_plus_one
+
+# Профилирование запросов: форма SQL запроса не зависит от значений параметров, повторенные формы отмечаются как N+1
+
+
+class QueryShapeTest(unittest.TestCase):
+
+    def test_parameters(self):
+        self.assertEqual(query_shape('SELECT phones.phone_number FROM phones WHERE phones.person_id = %(person_id_1)s'),
+                         'SELECT phones.phone_number FROM phones WHERE phones.person_id = ?')
+        # параметры asyncpg
+        self.assertEqual(query_shape('SELECT persons.full_name FROM persons WHERE persons.person_id = $1 LIMIT $2'),
+                         'SELECT persons.full_name FROM persons WHERE persons.person_id = ? LIMIT ?')
+
+    def test_in_lists(self):
+        shapes = {query_shape('SELECT * FROM emails WHERE person_id IN (%(p_1)s)'),
+                  query_shape('SELECT * FROM emails WHERE person_id IN (%(p_1)s, %(p_2)s, %(p_3)s)'),
+                  query_shape('SELECT * FROM emails WHERE person_id IN ($1,$2)')}
+        self.assertEqual(shapes, {'SELECT * FROM emails WHERE person_id IN (?)'})
+
+    def test_whitespace(self):
+        self.assertEqual(query_shape('\n  SELECT 1\n    FROM persons\t WHERE person_id = %(id)s  '),
+                         'SELECT 1 FROM persons WHERE person_id = ?')
+
+
+class FindNPlusOneTest(unittest.TestCase):
+
+    def statements(self, *shapes):
+        return [{'statement': shape, 'duration_ms': 0.5} for shape in shapes]
+
+    @mock.patch.object(profiler, 'n_plus_one_threshold', 3)
+    def test_threshold_and_order(self):
+        statements = self.statements('SELECT persons', 'phones', 'phones', 'emails', 'emails', 'emails', 'phones',
+                                     'emails', 'SELECT count')
+        self.assertEqual(find_n_plus_one(statements), [{'statement': 'emails', 'count': 4, 'total_ms': 2.0},
+                                                       {'statement': 'phones', 'count': 3, 'total_ms': 1.5}])
+
+    @mock.patch.object(profiler, 'n_plus_one_threshold', 3)
+    def test_below_threshold(self):
+        self.assertEqual(find_n_plus_one(self.statements('phones', 'phones', 'emails')), [])
+        self.assertEqual(find_n_plus_one([]), [])
+
+    @mock.patch.object(profiler, 'n_plus_one_threshold', 2)
+    def test_total_rounding(self):
+        statements = [{'statement': 'phones', 'duration_ms': 0.1}, {'statement': 'phones', 'duration_ms': 0.2}]
+        self.assertEqual(find_n_plus_one(statements), [{'statement': 'phones', 'count': 2, 'total_ms': 0.3}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from pydantic import ValidationError
+from orion.data_validation import ExpandData, FieldsData, PhoneFieldsData, EmailFieldsData, IdData, PersonPatchData
+
+# Модели атрибутов запросов: значения списком или строкой через запятую и идентификаторы контактов
+
+
+class ExpandDataTest(unittest.TestCase):
+
+    def test_string_and_list(self):
+        self.assertEqual(ExpandData(expand='phones,emails').expand, ['phones', 'emails'])
+        self.assertEqual(ExpandData(expand=' phones , ').expand, ['phones'])
+        self.assertEqual(ExpandData(expand=['emails']).expand, ['emails'])
+
+    def test_duplicates(self):
+        self.assertEqual(ExpandData(expand='emails,phones,emails').expand, ['emails', 'phones'])
+
+    def test_missing(self):
+        self.assertIsNone(ExpandData().expand)
+
+    def test_unknown_relationship(self):
+        for expand in ['phones,addresses', ['persons']]:
+            with self.subTest(expand=expand), self.assertRaises(ValidationError):
+                ExpandData(expand=expand)
+
+
+class FieldsDataTest(unittest.TestCase):
+
+    def test_string_and_list(self):
+        self.assertEqual(FieldsData(fields='full_name, birthday').fields, ['full_name', 'birthday'])
+        self.assertEqual(FieldsData(fields=['address']).fields, ['address'])
+        self.assertIsNone(FieldsData().fields)
+
+    def test_duplicates(self):
+        self.assertEqual(FieldsData(fields='full_name,person_id,full_name').fields, ['full_name', 'person_id'])
+
+    def test_unknown_or_empty(self):
+        # атрибуты телефонов и email не подходят для контактов, пустой набор не выбирает ни одного атрибута
+        for fields in ['phone_number', ['full_name', 'version'], [], ' , ']:
+            with self.subTest(fields=fields), self.assertRaises(ValidationError):
+                FieldsData(fields=fields)
+
+    def test_phone_and_email_fields(self):
+        self.assertEqual(PhoneFieldsData(fields='phone_number').fields, ['phone_number'])
+        self.assertEqual(EmailFieldsData(fields=['email_type', 'email_address']).fields,
+                         ['email_type', 'email_address'])
+        for model, fields in [(PhoneFieldsData, 'email_address'), (EmailFieldsData, 'full_name')]:
+            with self.subTest(model=model.__name__), self.assertRaises(ValidationError):
+                model(fields=fields)
+
+
+class PersonIdTest(unittest.TestCase):
+
+    def test_normalized(self):
+        self.assertEqual(IdData(person_id='007').person_id, '7')
+        self.assertEqual(PersonPatchData(person_id='007', full_name='Иванов Иван Иванович').person_id, '7')
+
+    def test_non_ascii_digits(self):
+        # "²" и "٣" проходят str.isdigit(), но не являются числом для int()
+        for person_id in ['²', '٣', '1²', '', '-1']:
+            with self.subTest(person_id=person_id):
+                with self.assertRaises(ValidationError):
+                    IdData(person_id=person_id)
+                with self.assertRaises(ValidationError):
+                    PersonPatchData(person_id=person_id, full_name='Иванов Иван Иванович')
+
+
+if __name__ == '__main__':
+    unittest.main()
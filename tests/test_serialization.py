@@ -0,0 +1,53 @@
+import unittest
+from datetime import date
+from unittest import mock
+from flask import jsonify
+from orion import app, serialization
+from orion.serialization import json_response, rows_to_dicts, select_fields
+
+# Быстрый путь сериализации: ответ json_response должен побайтно совпадать с ответом jsonify
+
+data = {'persons': [{'person_id': 7, 'full_name': 'Иванов Иван Иванович', 'birthday': date(1990, 5, 17),
+                     'gender': None, 'phones': [{'phone_type': 'мобильный', 'phone_number': '79161234567'}]}],
+        'next_cursor': None, 'count': 1, 'quote': 'a "b" \\ c\n</script>'}
+
+
+class JsonResponseTest(unittest.TestCase):
+
+    def assert_same_as_jsonify(self):
+        with app.app_context():
+            expected = jsonify(data)
+            response = json_response(data)
+            self.assertEqual(response.get_data(), expected.get_data())
+            self.assertEqual(response.mimetype, expected.mimetype)
+
+    def test_json(self):
+        with mock.patch.object(serialization, 'orjson', None):
+            self.assert_same_as_jsonify()
+
+    @unittest.skipIf(serialization.orjson is None, 'библиотека orjson не установлена')
+    def test_orjson(self):
+        with mock.patch.object(serialization, 'json_backend', 'orjson'):
+            self.assert_same_as_jsonify()
+
+    def test_pretty_print(self):
+        with mock.patch.dict(app.config, JSONIFY_PRETTYPRINT_REGULAR=True):
+            self.assert_same_as_jsonify()
+
+
+class RowsTest(unittest.TestCase):
+
+    def test_rows_to_dicts(self):
+        columns = [mock.Mock(key='person_id'), mock.Mock(key='full_name')]
+        # служебные столбцы в конце строки отбрасываются
+        self.assertEqual(rows_to_dicts(columns, [(1, 'Иванов', 'x'), (2, 'Петров', 'y')]),
+                         [{'person_id': 1, 'full_name': 'Иванов'}, {'person_id': 2, 'full_name': 'Петров'}])
+
+    def test_select_fields(self):
+        item = {'person_id': 1, 'full_name': 'Иванов', 'address': 'Москва'}
+        self.assertEqual(select_fields(item, ['address']), {'person_id': 1, 'address': 'Москва'})
+        self.assertEqual(select_fields(item, None), item)
+
+
+if __name__ == '__main__':
+    unittest.main()
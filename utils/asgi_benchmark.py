@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import json
+import time
+from random import randint
+from urllib.parse import urlsplit
+
+# модуль для сравнения синхронного (python runserver.py) и асинхронного (python runserver.py --asgi) режимов работы
+# приложения под нагрузкой. Для каждого режима и уровня одновременных запросов отправляется заданное количество
+# запросов к маршруту и измеряются пропускная способность, задержки (медиана и 99-й процентиль) и количество ошибок.
+# Оба сервера должны быть запущены и подключены к одной заполненной БД.
+# Запуск: python -m utils.asgi_benchmark --route get_person --concurrency 10,100,1000 --requests 5000
+
+# тела запросов к маршрутам: person_id выбирается случайно из диапазона 1..max_person_id
+routes = {
+    'get_person': ('/api/get_person', lambda max_id: {'person_id': str(randint(1, max_id))}),
+    'get_person_expand': ('/api/get_person', lambda max_id: {'person_id': str(randint(1, max_id)),
+                                                             'expand': 'phones,emails'}),
+    'get_persons': ('/api/get_persons', lambda max_id: {'person_ids': [str(randint(1, max_id)) for _ in range(50)]}),
+    'get_persons_list': ('/api/get_persons_list', lambda max_id: {'limit': 100}),
+    'search_persons': ('/api/search_persons', lambda max_id: {'query': 'Иванов', 'limit': 20}),
+}
+
+
+async def send_request(host, port, path, payload, method='POST'):
+    """Функция отправляет запрос с телом JSON (payload None - без тела) и возвращает код и тело ответа. Соединение
+    закрывается после ответа, поэтому ответ читается до конца потока"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        body = json.dumps(payload).encode() if payload is not None else b''
+        writer.write(f'{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+        response = await reader.read()
+        return int(response.split(b' ', 2)[1]), response.partition(b'\r\n\r\n')[2]
+    finally:
+        writer.close()
+
+
+async def run_level(url, route, concurrency, requests, max_person_id):
+    """Функция отправляет requests запросов к серверу не более чем по concurrency одновременно и возвращает
+    результаты замера"""
+    address = urlsplit(url)
+    path, payload = routes[route]
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                status, _ = await send_request(address.hostname, address.port, path, payload(max_person_id))
+            except (OSError, IndexError, ValueError):
+                status = None
+            latencies.append(time.perf_counter() - start)
+            errors += status != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return {'rps': round(requests / seconds), 'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+            'p99_ms': round(p99 * 1000, 1), 'errors': errors}
+
+
+def run_benchmark(servers, route, levels, requests, max_person_id):
+    """Функция выполняет замеры для каждого сервера и уровня одновременных запросов и возвращает список
+    результатов"""
+    results = []
+    for mode, url in servers:
+        for concurrency in levels:
+            result = asyncio.run(run_level(url, route, concurrency, requests, max_person_id))
+            results.append(dict(result, mode=mode, concurrency=concurrency))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Сравнение синхронного и асинхронного режимов работы приложения')
+    parser.add_argument('--sync-url', default='http://127.0.0.1:5000', help='адрес сервера в синхронном режиме')
+    parser.add_argument('--async-url', default='http://127.0.0.1:8000', help='адрес сервера в асинхронном режиме')
+    parser.add_argument('--route', choices=list(routes), default='get_person', help='маршрут для нагрузки')
+    parser.add_argument('--concurrency', default='10,100,1000',
+                        help='уровни одновременных запросов через запятую')
+    parser.add_argument('--requests', type=int, default=5000, help='количество запросов на каждом уровне')
+    parser.add_argument('--max-person-id', type=int, default=10000, help='максимальный person_id в запросах')
+    args = parser.parse_args()
+    benchmark_results = run_benchmark([('sync', args.sync_url), ('async', args.async_url)], args.route,
+                                      [int(level) for level in args.concurrency.split(',')], args.requests,
+                                      args.max_person_id)
+    print(f'{"режим":<6} {"одновр.":>9} {"запр/с":>8} {"p50, мс":>9} {"p99, мс":>9} {"ошибок":>7}')
+    for item in benchmark_results:
+        print(f'{item["mode"]:<6} {item["concurrency"]:>9} {item["rps"]:>8} {item["p50_ms"]:>9} {item["p99_ms"]:>9} '
+              f'{item["errors"]:>7}')
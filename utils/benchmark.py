@@ -0,0 +1,370 @@
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from random import Random, choice
+from urllib.parse import urlsplit
+from utils.asgi_benchmark import send_request
+from utils.data_generator import get_random_person, genders, seed_generator
+
+# модуль воспроизводимых замеров производительности всех маршрутов API. Команды:
+#   seed - заполняет БД из config.ini контактами модуля bulk_generator (10k, 100k или 1M контактов) напрямую командой
+#          COPY или контактами модуля data_generator (--generator data_generator) через импорт с проверкой каждого
+#          контакта. Таблицы persons, phones и emails предварительно очищаются. При одинаковых scale и seed генерируются
+#          одинаковые контакты, телефоны и email уникальны, поэтому загружаются все контакты;
+#   run - для каждого маршрута и уровня одновременных запросов отправляет заданное количество запросов к запущенному
+#         серверу и записывает пропускную способность, задержки (медиана и 99-й процентиль) и количество ошибок в JSON.
+#         Маршруты изменения данных работают с контактами, телефонами и email, которые создаются во время замера, и
+#         удаляют их в конце, поэтому данные seed не меняются и замеры можно повторять;
+#   compare - сравнивает два файла результатов и отмечает регрессии: снижение пропускной способности или рост
+#             99-го процентиля задержки больше порога, рост количества ошибок. При регрессиях код завершения 1.
+# Запуск:
+#   python -m utils.benchmark seed --scale 100k --seed 42
+#   python -m utils.benchmark run --scale 100k --url http://127.0.0.1:5000 --concurrency 1,10,50 --requests 1000
+#   python -m utils.benchmark compare benchmark_base.json benchmark_new.json --threshold 10
+
+scales = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000}
+# количество контактов, данные которых используются в запросах чтения (номера телефонов, email, ФИО)
+sample_size = 500
+# количество запросов к маршруту чтения перед замером для прогрева кэшей и соединений
+warmup_requests = 50
+
+
+def seed_contact(ind, gender):
+    """Функция генерирует контакт модуля data_generator для заполнения БД. Номер телефона и email содержат номер
+    контакта, поэтому они не повторяются при любом объеме данных"""
+    data = get_random_person(gender)
+    local, domain = data['emails'][0]['email_address'].split('@')
+    data['emails'][0]['email_address'] = f'{local}.{ind}@{domain}'
+    data['phones'] = [{'phone_number': f'+79{ind:09d}', 'phone_type': 'Мобильный'}]
+    return data
+
+
+def write_seed_file(path, count, seed):
+    """Функция записывает count контактов модуля data_generator в файл NDJSON в формате команды импорта"""
+    seed_generator(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for ind in range(count):
+            f.write(json.dumps(seed_contact(ind, choice(genders)), ensure_ascii=False, default=str) + '\n')
+
+
+def seed_database(scale, seed, generator, path):
+    """Функция очищает таблицы контактов и загружает в них контакты: модуля bulk_generator - командой COPY, модуля
+    data_generator - через сгенерированный файл и импорт с проверкой каждого контакта. person_id загруженных
+    контактов - от 1 до количества контактов"""
+    from sqlalchemy import text
+    from orion import app, db
+    from orion.importer import import_contacts
+    from orion.models import TableVersion
+    if generator == 'data_generator':
+        print(f'Генерация {scales[scale]} контактов в файл {path}')
+        write_seed_file(path, scales[scale], seed)
+    with app.app_context():
+        db.session.execute(text('TRUNCATE persons, phones, emails RESTART IDENTITY'))
+        TableVersion.bump('persons', 'phones', 'emails')
+        db.session.commit()
+        if generator == 'data_generator':
+            result = import_contacts(path, restart=True)
+            if 'error' in result:
+                sys.exit(result['error'])
+            print(result['response'])
+            return
+        from utils.bulk_generator import copy_to_database
+        copy_to_database(seed, 0, scales[scale])
+    print(f'В БД загружено {scales[scale]} контактов')
+
+
+class BenchmarkContext:
+    """Класс данных для тел запросов замера: генератор случайных чисел с заданным seed, выборка существующих
+    контактов для маршрутов чтения и контакты, создаваемые маршрутами изменения данных"""
+
+    def __init__(self, max_person_id, seed, token):
+        self.random = Random(seed)
+        self.max_person_id = max_person_id
+        self.token = token
+        self.sample = []
+        self.new_contacts = []
+        self.added_ids = []
+
+    def person_id(self):
+        return str(self.random.randint(1, self.max_person_id))
+
+    def sample_person(self):
+        return self.random.choice(self.sample)
+
+    def phone_number(self, kind, ind):
+        """Номер телефона, созданный замером: номера seed начинаются с +79, номера замера - с +78"""
+        return f'+78{kind}{self.token:02d}{ind:06d}'
+
+    def email_address(self, kind, ind):
+        return f'benchmark.{kind}.{self.token}.{ind}@example.org'
+
+    def new_contact(self, ind):
+        data = get_random_person(self.random.choice(genders))
+        data['birthday'] = data['birthday'].isoformat()
+        data['phones'] = [{'phone_number': self.phone_number(1, ind), 'phone_type': 'Мобильный'}]
+        data['emails'] = [{'email_address': self.email_address(1, ind), 'email_type': 'Личная'}]
+        return data
+
+    def person_fields(self, ind):
+        return {key: self.new_contacts[ind][key] for key in ('file_path', 'full_name', 'gender', 'birthday',
+                                                             'address')}
+
+
+# маршруты в порядке замера: название, метод, путь и функция тела запроса (контекст, номер запроса). Маршруты
+# изменения данных идут после маршрутов чтения в таком порядке, чтобы каждый работал с данными предыдущих
+read_routes = [
+    ('get_persons_list', 'POST', '/api/get_persons_list', lambda ctx, ind: {'limit': 100}),
+    ('get_persons_list_sorted', 'POST', '/api/get_persons_list',
+     lambda ctx, ind: {'limit': 100, 'sorted_by': 'full_name', 'order': 'asc'}),
+    ('get_persons_list_fields', 'POST', '/api/get_persons_list',
+     lambda ctx, ind: {'limit': 100, 'sorted_by': 'full_name', 'order': 'asc', 'fields': 'full_name'}),
+    ('get_person', 'POST', '/api/get_person', lambda ctx, ind: {'person_id': ctx.person_id()}),
+    ('get_person_expand', 'POST', '/api/get_person',
+     lambda ctx, ind: {'person_id': ctx.person_id(), 'expand': 'phones,emails'}),
+    ('get_persons', 'POST', '/api/get_persons',
+     lambda ctx, ind: {'person_ids': [ctx.person_id() for _ in range(50)]}),
+    ('get_person_by_phone', 'POST', '/api/get_person_by_phone',
+     lambda ctx, ind: {'phone_number': ctx.sample_person()['phones'][0]['phone_number']}),
+    ('get_person_by_email', 'POST', '/api/get_person_by_email',
+     lambda ctx, ind: {'email_address': ctx.sample_person()['emails'][0]['email_address']}),
+    ('search_persons', 'POST', '/api/search_persons',
+     lambda ctx, ind: {'query': ctx.sample_person()['full_name'].split()[0], 'limit': 20}),
+    ('autocomplete', 'POST', '/api/autocomplete',
+     lambda ctx, ind: {'field': 'full_name', 'prefix': ctx.sample_person()['full_name'][:3]}),
+    ('get_phones_list', 'POST', '/api/get_phones_list', lambda ctx, ind: {'limit': 100}),
+    ('get_phone', 'POST', '/api/get_phone', lambda ctx, ind: {'person_id': ctx.person_id()}),
+    ('get_emails_list', 'POST', '/api/get_emails_list', lambda ctx, ind: {'limit': 100}),
+    ('get_email', 'POST', '/api/get_email', lambda ctx, ind: {'person_id': ctx.person_id()}),
+    ('cache_stats', 'GET', '/api/cache_stats', lambda ctx, ind: None),
+    ('autocomplete_stats', 'GET', '/api/autocomplete_stats', lambda ctx, ind: None),
+]
+write_routes = [
+    # каждый запрос add_person добавляет два контакта: один удаляется маршрутом delete_person, другой - delete_persons
+    ('add_person', 'PUT', '/api/add_person',
+     lambda ctx, ind: [ctx.new_contacts[2 * ind], ctx.new_contacts[2 * ind + 1]]),
+    ('update_person', 'PATCH', '/api/update_person',
+     lambda ctx, ind: dict(ctx.person_fields(ind), person_id=ctx.added_ids[ind])),
+    ('update_persons', 'PATCH', '/api/update_persons',
+     lambda ctx, ind: [dict(ctx.person_fields((ind + shift) % len(ctx.added_ids)),
+                            person_id=ctx.added_ids[(ind + shift) % len(ctx.added_ids)]) for shift in range(50)]),
+    ('add_phone', 'PUT', '/api/add_phone',
+     lambda ctx, ind: {'person_id': ctx.added_ids[ind], 'phone_number': ctx.phone_number(2, ind),
+                       'phone_type': 'Мобильный'}),
+    # повторное добавление того же номера в режиме on_conflict update изменяет тип номера
+    ('upsert_phone', 'PUT', '/api/add_phone',
+     lambda ctx, ind: {'person_id': ctx.added_ids[ind], 'phone_number': ctx.phone_number(2, ind),
+                       'phone_type': 'Городской', 'on_conflict': 'update'}),
+    ('update_phone', 'PATCH', '/api/update_phone',
+     lambda ctx, ind: {'person_id': ctx.added_ids[ind], 'old_phone_number': ctx.phone_number(2, ind),
+                       'phone_number': ctx.phone_number(3, ind), 'phone_type': 'Мобильный'}),
+    ('delete_phone', 'DELETE', '/api/delete_phone',
+     lambda ctx, ind: {'person_id': ctx.added_ids[ind], 'phone_number': ctx.phone_number(3, ind),
+                       'phone_type': 'Мобильный'}),
+    ('add_email', 'PUT', '/api/add_email',
+     lambda ctx, ind: {'person_id': ctx.added_ids[ind], 'email_address': ctx.email_address(2, ind),
+                       'email_type': 'Рабочая'}),
+    ('upsert_email', 'PUT', '/api/add_email',
+     lambda ctx, ind: {'person_id': ctx.added_ids[ind], 'email_address': ctx.email_address(2, ind),
+                       'email_type': 'Личная', 'on_conflict': 'update'}),
+    ('update_email', 'PATCH', '/api/update_email',
+     lambda ctx, ind: {'person_id': ctx.added_ids[ind], 'old_email_address': ctx.email_address(2, ind),
+                       'email_address': ctx.email_address(3, ind), 'email_type': 'Рабочая'}),
+    ('delete_email', 'DELETE', '/api/delete_email',
+     lambda ctx, ind: {'person_id': ctx.added_ids[ind], 'email_address': ctx.email_address(3, ind),
+                       'email_type': 'Рабочая'}),
+    ('delete_person', 'DELETE', '/api/delete_person', lambda ctx, ind: {'person_id': ctx.added_ids[2 * ind]}),
+    ('delete_persons', 'DELETE', '/api/delete_persons',
+     lambda ctx, ind: {'person_ids': [ctx.added_ids[2 * ind + 1]]}),
+]
+
+
+def is_error(status, body):
+    """Функция проверяет, завершился ли запрос ошибкой: обработчики возвращают ошибки с кодом 200 в JSON, который
+    начинается с ключа error"""
+    return status != 200 or body.lstrip().startswith(b'{"error"')
+
+
+async def run_level(address, method, path, payload, indexes, concurrency):
+    """Функция отправляет запросы с номерами из indexes не более чем по concurrency одновременно и возвращает
+    результаты замера"""
+    latencies, errors = [], 0
+    remaining = iter(indexes)
+
+    async def worker():
+        nonlocal errors
+        for ind in remaining:
+            body = payload(ind)
+            start = time.perf_counter()
+            try:
+                status, response = await send_request(address.hostname, address.port, path, body, method)
+            except (OSError, IndexError, ValueError):
+                status, response = None, b''
+            latencies.append(time.perf_counter() - start)
+            errors += is_error(status, response)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return {'requests': len(latencies), 'seconds': round(seconds, 3), 'rps': round(len(latencies) / seconds, 1),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2), 'p99_ms': round(p99 * 1000, 2),
+            'errors': errors}
+
+
+async def load_sample(address, ctx):
+    """Функция загружает выборку случайных контактов с телефонами и email для тел запросов чтения"""
+    ids = list(dict.fromkeys(ctx.person_id() for _ in range(sample_size)))
+    status, body = await send_request(address.hostname, address.port, '/api/get_persons',
+                                      {'person_ids': ids, 'expand': ['phones', 'emails']})
+    if is_error(status, body):
+        sys.exit(f'Не удалось получить выборку контактов: {status} {body[:500]!r}')
+    ctx.sample = [person for person in json.loads(body)['response'].values()
+                  if person and person['phones'] and person['emails']]
+    if not ctx.sample:
+        sys.exit('В БД нет контактов с телефонами и email. Заполните БД командой seed')
+
+
+async def load_added_ids(address, ctx):
+    """Функция находит person_id контактов, добавленных маршрутом add_person, по их email"""
+    async def find(ind):
+        status, body = await send_request(address.hostname, address.port, '/api/get_person_by_email',
+                                          {'email_address': ctx.email_address(1, ind)})
+        person = json.loads(body).get('response') if not is_error(status, body) else None
+        return str(person['person_id']) if isinstance(person, dict) else '0'
+
+    ctx.added_ids = []
+    for start in range(0, len(ctx.new_contacts), 100):
+        ctx.added_ids += await asyncio.gather(*[find(ind) for ind in
+                                                range(start, min(start + 100, len(ctx.new_contacts)))])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_route(address, ctx, route, levels, requests, warmup):
+    """Функция выполняет замеры маршрута на каждом уровне одновременных запросов. Номера запросов на всех уровнях
+    разные, поэтому маршруты изменения данных не повторяют одни и те же изменения"""
+    name, method, path, payload = route
+    if warmup:
+        asyncio.run(run_level(address, method, path, lambda ind: payload(ctx, ind), range(warmup_requests), 1))
+    results = []
+    for level_ind, concurrency in enumerate(levels):
+        indexes = range(level_ind * requests, (level_ind + 1) * requests)
+        result = asyncio.run(run_level(address, method, path, lambda ind: payload(ctx, ind), indexes, concurrency))
+        results.append(dict(result, route=name, concurrency=concurrency))
+        print(f'{name:<24} {concurrency:>7} {result["rps"]:>9} {result["p50_ms"]:>9} {result["p99_ms"]:>9} '
+              f'{result["errors"]:>7}')
+    return results
+
+
+def run_benchmark(url, scale, levels, requests, route_names, seed):
+    """Функция выполняет замеры маршрутов и возвращает результаты с описанием условий замера. Маршруты изменения
+    данных зависят друг от друга, поэтому при выборе любого из них замеряются все"""
+    address = urlsplit(url)
+    total = requests * len(levels)
+    if total >= 5 * 10 ** 5:
+        sys.exit('Количество запросов к маршруту на всех уровнях должно быть меньше 500000')
+    ctx = BenchmarkContext(scales[scale], seed, int(time.time()) % 100)
+    meta = {'scale': scale, 'persons': scales[scale], 'url': url, 'concurrency': levels, 'requests': requests,
+            'seed': seed, 'started_at': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+            'python': platform.python_version(), 'platform': platform.platform()}
+    asyncio.run(load_sample(address, ctx))
+    seed_generator(seed)
+    results = []
+    for route in read_routes:
+        if not route_names or route[0] in route_names:
+            results += measure_route(address, ctx, route, levels, requests, warmup=True)
+    if not route_names or route_names & {route[0] for route in write_routes}:
+        ctx.new_contacts = [ctx.new_contact(ind) for ind in range(2 * total)]
+        for route in write_routes:
+            if route[0] == 'update_person':
+                asyncio.run(load_added_ids(address, ctx))
+            results += measure_route(address, ctx, route, levels, requests, warmup=False)
+    return {'meta': meta, 'results': results}
+
+
+def compare_results(base, new, threshold):
+    """Функция сравнивает результаты двух замеров по маршрутам и уровням одновременных запросов и возвращает
+    строки сравнения. Регрессия - снижение пропускной способности или рост 99-го процентиля больше threshold
+    процентов или рост количества ошибок"""
+    base_results = {(item['route'], item['concurrency']): item for item in base['results']}
+    rows = []
+    for item in new['results']:
+        old = base_results.get((item['route'], item['concurrency']))
+        if old is None:
+            continue
+        rps_change = (item['rps'] - old['rps']) / old['rps'] * 100 if old['rps'] else 0.0
+        p99_change = (item['p99_ms'] - old['p99_ms']) / old['p99_ms'] * 100 if old['p99_ms'] else 0.0
+        rows.append({'route': item['route'], 'concurrency': item['concurrency'], 'rps_change': round(rps_change, 1),
+                     'p99_change': round(p99_change, 1), 'errors': (old['errors'], item['errors']),
+                     'regression': rps_change < -threshold or p99_change > threshold
+                     or item['errors'] > old['errors']})
+    return rows
+
+
+def print_header():
+    print(f'{"маршрут":<24} {"одновр.":>7} {"запр/с":>9} {"p50, мс":>9} {"p99, мс":>9} {"ошибок":>7}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Воспроизводимые замеры производительности маршрутов API')
+    commands = parser.add_subparsers(dest='command', required=True)
+    seed_parser = commands.add_parser('seed', help='заполнить БД контактами')
+    seed_parser.add_argument('--scale', choices=list(scales), default='10k', help='количество контактов')
+    seed_parser.add_argument('--seed', type=int, default=42, help='начальное значение генератора данных')
+    seed_parser.add_argument('--generator', choices=['bulk_generator', 'data_generator'], default='bulk_generator',
+                             help='модуль генерации контактов')
+    seed_parser.add_argument('--file', default=None, help='файл NDJSON для контактов модуля data_generator')
+    run_parser = commands.add_parser('run', help='выполнить замеры маршрутов')
+    run_parser.add_argument('--scale', choices=list(scales), default='10k', help='количество контактов в БД (seed)')
+    run_parser.add_argument('--url', default='http://127.0.0.1:5000', help='адрес сервера')
+    run_parser.add_argument('--concurrency', default='1,10,50', help='уровни одновременных запросов через запятую')
+    run_parser.add_argument('--requests', type=int, default=1000, help='количество запросов на каждом уровне')
+    run_parser.add_argument('--routes', default='', help='маршруты через запятую (по умолчанию все)')
+    run_parser.add_argument('--seed', type=int, default=42, help='начальное значение генератора тел запросов')
+    run_parser.add_argument('--output', default=None, help='файл JSON для результатов')
+    compare_parser = commands.add_parser('compare', help='сравнить результаты двух замеров')
+    compare_parser.add_argument('base', help='файл результатов базового замера')
+    compare_parser.add_argument('new', help='файл результатов нового замера')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help='порог регрессии в процентах')
+    args = parser.parse_args()
+
+    if args.command == 'seed':
+        seed_database(args.scale, args.seed, args.generator, args.file or f'benchmark_{args.scale}_{args.seed}.ndjson')
+    elif args.command == 'run':
+        unknown = set(filter(None, args.routes.split(','))) - {route[0] for route in read_routes + write_routes}
+        if unknown:
+            sys.exit(f'Неизвестные маршруты: {", ".join(sorted(unknown))}')
+        print_header()
+        benchmark_results = run_benchmark(args.url, args.scale, [int(level) for level in args.concurrency.split(',')],
+                                          args.requests, set(filter(None, args.routes.split(','))), args.seed)
+        output = args.output or f'benchmark_{args.scale}_{datetime.now():%Y%m%d_%H%M%S}.json'
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(benchmark_results, f, ensure_ascii=False, indent=2)
+        print(f'Результаты записаны в файл {output}')
+    else:
+        with open(args.base, encoding='utf-8') as f:
+            base_results = json.load(f)
+        with open(args.new, encoding='utf-8') as f:
+            new_results = json.load(f)
+        if base_results['meta']['scale'] != new_results['meta']['scale']:
+            print(f'Внимание: замеры выполнены на разном объеме данных ({base_results["meta"]["scale"]} и '
+                  f'{new_results["meta"]["scale"]})')
+        comparison = compare_results(base_results, new_results, args.threshold)
+        print(f'{"маршрут":<24} {"одновр.":>7} {"запр/с, %":>10} {"p99, %":>8} {"ошибок":>12}')
+        for row in comparison:
+            print(f'{row["route"]:<24} {row["concurrency"]:>7} {row["rps_change"]:>+10} {row["p99_change"]:>+8} '
+                  f'{"%d -> %d" % row["errors"]:>12}{"  РЕГРЕССИЯ" if row["regression"] else ""}')
+        regressions = sum(row['regression'] for row in comparison)
+        print(f'Регрессий: {regressions}')
+        sys.exit(1 if regressions else 0)
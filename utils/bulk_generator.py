@@ -0,0 +1,204 @@
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+import re
+import sys
+import time
+from datetime import date
+from random import Random
+from mimesis import Generic
+from mimesis.builtins import RussiaSpecProvider
+from mimesis.enums import Gender, FileType
+from pydantic import EmailStr
+from orion.data_validation import address_pattern, file_path_pattern
+from orion.importer import csv_columns
+
+# модуль для быстрой генерации большого количества контактов (миллионы и десятки миллионов). Значения полей (фамилии,
+# имена, отчества, города, улицы, имена файлов, email) генерируются библиотекой mimesis один раз в наборы по
+# pool_size значений, отфильтрованные по правилам модуля data_validation, а контакты собираются из них случайным
+# выбором. Контакты генерируются частями по chunk_size в пуле процессов. Каждая часть использует свой генератор
+# случайных чисел с начальным значением из seed и номера первого контакта части, поэтому результат не зависит от
+# количества процессов и одинаков при одинаковых seed и start. Номер телефона и email вычисляются из номера контакта
+# и не повторяются. Контакты записываются в файл NDJSON или CSV в формате команды flask orion import (или в stdout)
+# либо загружаются в БД напрямую командой COPY (--copy).
+# Запуск:
+#   python -m utils.bulk_generator --count 10000000 --format csv --output contacts.csv
+#   python -m utils.bulk_generator --count 1000000 --copy
+
+# количество значений в каждом наборе значений полей
+pool_size = 2000
+# количество контактов в одной части, которую генерирует процесс
+chunk_size = 20000
+genders = (('Мужской', Gender.MALE), ('Женский', Gender.FEMALE))
+name_part_pattern = re.compile('^[А-ЯЁ][а-яёА-ЯЁ\\-]{1,}$')
+first_birthday = date(1941, 1, 1).toordinal()
+last_birthday = date(2003, 12, 31).toordinal()
+# номера телефонов +79ххххххххх: номер контакта переставляется умножением на число, взаимно простое с 10^9,
+# поэтому номера разных контактов не совпадают, но не идут подряд
+phone_space = 10 ** 9
+phone_multiplier = 387420489
+
+# наборы значений полей процесса, задаются функцией init_worker
+pools = None
+
+
+def build_pools(seed):
+    """Функция генерирует наборы значений полей контактов. Значения, не проходящие проверку модуля data_validation,
+    отбрасываются"""
+    generic = Generic('ru', seed=seed)
+    russia_provider = RussiaSpecProvider(seed=seed)
+    result = {}
+    for gender_name, gender in genders:
+        result[gender_name] = [
+            [value for value in (generic.person.surname(gender) for _ in range(pool_size))
+             if name_part_pattern.match(value)],
+            [value for value in (generic.person.name(gender) for _ in range(pool_size))
+             if name_part_pattern.match(value)],
+            [value for value in (russia_provider.patronymic(gender=gender) for _ in range(pool_size))
+             if name_part_pattern.match(value)]]
+    result['cities'] = [value for value in (generic.address.city() for _ in range(pool_size))
+                        if address_pattern.match(f'{value}, Мира, д. 1, кв. 1')]
+    result['streets'] = [value for value in (generic.address.street_name().replace('.', 'а')
+                                             for _ in range(pool_size))
+                         if address_pattern.match(f'Москва, {value}, д. 1, кв. 1')]
+    result['files'] = [value for value in ('/media/profile_images/' + generic.file.file_name(FileType.IMAGE)
+                                           for _ in range(pool_size)) if file_path_pattern.match(value)]
+    result['emails'] = []
+    for _ in range(pool_size):
+        local, domain = generic.person.email().split('@')
+        try:
+            EmailStr.validate(f'{local}.0@{domain}')
+            result['emails'].append((local, domain))
+        except ValueError:
+            continue
+    # даты рождения и номера домов и квартир выбираются из готовых строк, а не вычисляются для каждого контакта
+    result['birthdays'] = [date.fromordinal(day).isoformat() for day in range(first_birthday, last_birthday + 1)]
+    result['numbers'] = [str(number) for number in range(501)]
+    return result
+
+
+def init_worker(worker_pools):
+    global pools
+    pools = worker_pools
+
+
+def contact_phone(ind):
+    return f'+79{(ind * phone_multiplier + 1) % phone_space:09d}'
+
+
+def generate_contacts(seed, start, count):
+    """Функция генерирует контакты с номерами от start до start + count - 1 в виде кортежей значений полей в
+    порядке столбцов csv_columns"""
+    choice = Random(f'{seed}:{start}').choice
+    cities, streets, files, emails = pools['cities'], pools['streets'], pools['files'], pools['emails']
+    birthdays, numbers = pools['birthdays'], pools['numbers']
+    for ind in range(start, start + count):
+        gender = choice(genders)[0]
+        surnames, names, patronymics = pools[gender]
+        local, domain = choice(emails)
+        yield (choice(files), f'{choice(surnames)} {choice(names)} {choice(patronymics)}', gender, choice(birthdays),
+               f'{choice(cities)}, {choice(streets)}, д. {choice(numbers)}, кв. {choice(numbers)}',
+               contact_phone(ind), 'Мобильный', f'{local}.{ind}@{domain}', choice(('Личная', 'Рабочая')))
+
+
+def generate_chunk(task):
+    """Функция генерирует часть контактов и возвращает ее в формате вывода: для ndjson и csv - текст строк файла,
+    для copy - тексты CSV для команд COPY в таблицы persons, phones и emails"""
+    seed, start, count, output_format = task
+    contacts = generate_contacts(seed, start, count)
+    if output_format == 'ndjson':
+        # значения наборов проверены регулярными выражениями data_validation и не содержат символов, которые нужно
+        # экранировать в JSON, поэтому строки собираются по шаблону без json.dumps
+        return ''.join(f'{{"file_path": "{file_path}", "full_name": "{full_name}", "gender": "{gender}", '
+                       f'"birthday": "{birthday}", "address": "{address}", "phones": [{{"phone_number": '
+                       f'"{phone_number}", "phone_type": "{phone_type}"}}], "emails": [{{"email_address": '
+                       f'"{email_address}", "email_type": "{email_type}"}}]}}\n'
+                       for file_path, full_name, gender, birthday, address, phone_number, phone_type,
+                       email_address, email_type in contacts)
+    buffers = [io.StringIO() for _ in range(3 if output_format == 'copy' else 1)]
+    writers = [csv.writer(buffer) for buffer in buffers]
+    if output_format == 'csv':
+        writers[0].writerows(contacts)
+        return buffers[0].getvalue()
+    # при загрузке напрямую значения приводятся к виду, в котором их сохраняет валидация (str.title)
+    for person_id, contact in enumerate(contacts, start=start + 1):
+        file_path, full_name, gender, birthday, address, phone_number, phone_type, email_address, email_type = contact
+        writers[0].writerow((person_id, file_path.title(), full_name.title(), gender, birthday, address.title()))
+        writers[1].writerow((person_id, phone_type, phone_number))
+        writers[2].writerow((person_id, email_type, email_address))
+    return tuple(buffer.getvalue() for buffer in buffers)
+
+
+def generate_parts(seed, start, count, output_format, workers=0):
+    """Функция возвращает генератор частей контактов в порядке номеров контактов. Части генерируются в пуле из
+    workers процессов (0 - по количеству ядер, 1 - без пула)"""
+    worker_pools = build_pools(seed)
+    tasks = [(seed, chunk_start, min(chunk_size, start + count - chunk_start), output_format)
+             for chunk_start in range(start, start + count, chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        init_worker(worker_pools)
+        yield from map(generate_chunk, tasks)
+        return
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(worker_pools,)) as pool:
+        yield from pool.imap(generate_chunk, tasks)
+
+
+def write_file(path, seed, start, count, output_format, workers=0):
+    """Функция записывает контакты в файл NDJSON или CSV (path '-' - в stdout)"""
+    with (open(sys.stdout.fileno(), 'w', encoding='utf-8', newline='', closefd=False) if path == '-'
+          else open(path, 'w', encoding='utf-8', newline='')) as f:
+        if output_format == 'csv':
+            csv.writer(f).writerow(csv_columns)
+        for part in generate_parts(seed, start, count, output_format, workers):
+            f.write(part)
+
+
+def copy_to_database(seed, start, count, workers=0):
+    """Функция загружает контакты в таблицы persons, phones и emails командой COPY одной транзакцией. person_id
+    контактов - от start + 1 до start + count, если start не указан, контакты добавляются после наибольшего
+    person_id в БД. Возвращает номер первого контакта"""
+    from sqlalchemy import text
+    from orion import db
+    from orion.models import TableVersion
+    if start is None:
+        start = db.session.execute(text('SELECT COALESCE(MAX(person_id), 0) FROM persons')).scalar()
+    cursor = db.session.connection().connection.cursor()
+    for persons, phones, emails in generate_parts(seed, start, count, 'copy', workers):
+        cursor.copy_expert('COPY persons (person_id, file_path, full_name, gender, birthday, address) FROM STDIN '
+                           'WITH (FORMAT csv)', io.StringIO(persons))
+        cursor.copy_expert('COPY phones (person_id, phone_type, phone_number) FROM STDIN WITH (FORMAT csv)',
+                           io.StringIO(phones))
+        cursor.copy_expert('COPY emails (person_id, email_type, email_address) FROM STDIN WITH (FORMAT csv)',
+                           io.StringIO(emails))
+    # последовательность person_id продолжается после загруженных контактов
+    db.session.execute(text("SELECT setval(pg_get_serial_sequence('persons', 'person_id'), "
+                            "(SELECT MAX(person_id) FROM persons))"))
+    TableVersion.bump('persons', 'phones', 'emails')
+    db.session.commit()
+    return start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Быстрая генерация большого количества контактов')
+    parser.add_argument('--count', type=int, required=True, help='количество контактов')
+    parser.add_argument('--seed', type=int, default=42, help='начальное значение генератора данных')
+    parser.add_argument('--start', type=int, default=None,
+                        help='номер первого контакта (по умолчанию 0, при --copy - наибольший person_id в БД)')
+    parser.add_argument('--format', dest='output_format', choices=['ndjson', 'csv'], default='ndjson',
+                        help='формат файла')
+    parser.add_argument('--output', default='-', help='файл для контактов (по умолчанию stdout)')
+    parser.add_argument('--copy', action='store_true', help='загрузить контакты в БД из config.ini командой COPY')
+    parser.add_argument('--workers', type=int, default=0, help='количество процессов (0 - по количеству ядер)')
+    args = parser.parse_args()
+    started = time.perf_counter()
+    if args.copy:
+        first = copy_to_database(args.seed, args.start, args.count, args.workers)
+        print(f'В БД загружены контакты с person_id от {first + 1} до {first + args.count}', file=sys.stderr)
+    else:
+        write_file(args.output, args.seed, args.start or 0, args.count, args.output_format, args.workers)
+    seconds = time.perf_counter() - started
+    print(f'Контактов: {args.count}, время: {seconds:.1f} с, контактов в секунду: {round(args.count / seconds)}',
+          file=sys.stderr)
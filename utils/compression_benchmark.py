@@ -0,0 +1,75 @@
+import argparse
+import json
+import time
+import zlib
+from random import choice
+from utils.data_generator import get_random_person, genders
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# модуль для оценки сжатия ответов API: генерирует тело ответа /api/get_persons_list заданного размера с помощью
+# data_generator и для каждой кодировки и уровня сжатия измеряет затраты CPU и размер сжатого ответа.
+# Запуск: python -m utils.compression_benchmark --rows 100000
+
+
+def persons_payload(rows):
+    """Функция генерирует тело ответа /api/get_persons_list с указанным количеством контактов"""
+    persons = []
+    for person_id in range(1, rows + 1):
+        data = get_random_person(choice(genders))
+        persons.append({'person_id': person_id, 'file_path': data['file_path'], 'full_name': data['full_name'],
+                        'gender': data['gender'], 'birthday': data['birthday'].strftime('%a, %d %b %Y 00:00:00 GMT'),
+                        'address': data['address']})
+    return json.dumps({'response': persons}, ensure_ascii=False, sort_keys=True).encode()
+
+
+def gzip_compress(body, level):
+    """Функция сжимает тело ответа в формате gzip"""
+    compress_obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compress_obj.compress(body) + compress_obj.flush()
+
+
+def codecs():
+    """Функция возвращает список (кодировка, уровень, функция сжатия) для сравнения"""
+    result = [('gzip', level, lambda body, level=level: gzip_compress(body, level)) for level in (1, 6, 9)]
+    # deflate в HTTP - это формат zlib
+    result += [('deflate', 6, lambda body: zlib.compress(body, 6))]
+    if zstandard:
+        result += [('zstd', level, lambda body, level=level: zstandard.ZstdCompressor(level=level).compress(body))
+                   for level in (1, 3, 9)]
+    return result
+
+
+def run_benchmark(rows, repeat):
+    """Функция измеряет время сжатия и размер ответа для каждой кодировки. Время - лучшее из repeat запусков"""
+    body = persons_payload(rows)
+    results = []
+    for encoding, level, compress in codecs():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            compressed = compress(body)
+            timings.append(time.perf_counter() - start)
+        results.append({'encoding': encoding, 'level': level, 'raw_bytes': len(body),
+                        'compressed_bytes': len(compressed), 'ratio': round(len(body) / len(compressed), 2),
+                        'cpu_ms': round(min(timings) * 1000, 2),
+                        'mb_per_s': round(len(body) / min(timings) / 1e6, 1)})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Оценка сжатия ответа /api/get_persons_list')
+    parser.add_argument('--rows', type=int, default=100000, help='количество контактов в ответе')
+    parser.add_argument('--repeat', type=int, default=3, help='количество повторов каждого замера')
+    parser.add_argument('--json', dest='json_path', help='файл для сохранения результатов в формате JSON')
+    args = parser.parse_args()
+    benchmark_results = run_benchmark(args.rows, args.repeat)
+    for item in benchmark_results:
+        print(f'{item["encoding"]:<8} уровень {item["level"]:<2} {item["raw_bytes"]:>12} -> {item["compressed_bytes"]:>10}'
+              f' байт (x{item["ratio"]}), {item["cpu_ms"]} мс CPU, {item["mb_per_s"]} МБ/с')
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(benchmark_results, f, indent=2)
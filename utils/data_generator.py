@@ -3,18 +3,29 @@ from mimesis.builtins import RussiaSpecProvider
 from mimesis.enums import Gender, FileType
 from random import choice, randint
 import json
+import random
 
 # модуль для генерации случайных данных с помощью библиотеки mimesis, а также для генерации JSON для тестирования работы API
 
 person = Generic('ru')
+russia_provider = RussiaSpecProvider()
 genders = (Gender.MALE, Gender.FEMALE)
 
 
+def seed_generator(seed):
+    """Функция задает начальное значение генераторов случайных данных: после вызова с тем же seed функции модуля
+    генерируют ту же последовательность контактов"""
+    global person, russia_provider
+    random.seed(seed)
+    person = Generic('ru', seed=seed)
+    russia_provider = RussiaSpecProvider(seed=seed)
+
+
 def get_random_person(gender):
     """Функция с помощью библиотеки mimesis генерирует случайные данные о пользователе и возвращает их в виде словаря.
     Данные соответсвуют критериям валидации описанным в модуле data_validation"""
     full_name = ' '.join(person.person.full_name(gender).split()[::-1]) + ' ' \
-                + RussiaSpecProvider().patronymic(gender=gender)
+                + russia_provider.patronymic(gender=gender)
     file_path = '/media/profile_images/' + person.file.file_name(FileType.IMAGE)
     person_gender = 'Мужской' if gender == Gender.MALE else 'Женский'
     birthday = person.datetime.date(start=1941, end=2003)
@@ -0,0 +1,76 @@
+import argparse
+import time
+from random import choice
+from flask import jsonify
+from orion import app, serialization
+from orion.models import Person
+from utils.data_generator import get_random_person, genders
+
+# модуль для сравнения путей сериализации списка контактов: прежнего (ORM объекты, Person.json и jsonify) и быстрого
+# (кортежи столбцов, Person.rows_json и json_response с orjson или стандартным модулем json). Перед замерами
+# проверяется, что ответы всех путей побайтно совпадают. БД для запуска не требуется.
+# Запуск: python -m utils.serialization_benchmark --rows 100000
+
+
+def person_rows(rows):
+    """Функция генерирует строки таблицы persons в виде кортежей значений столбцов Person.json_columns"""
+    result = []
+    for person_id in range(1, rows + 1):
+        data = get_random_person(choice(genders))
+        result.append((person_id, data['file_path'], data['full_name'], data['gender'], data['birthday'],
+                       data['address']))
+    return result
+
+
+def orm_path(rows):
+    """Прежний путь: создание ORM объектов, Person.json и jsonify"""
+    keys = [column.key for column in Person.json_columns()]
+    persons = [Person(**dict(zip(keys, row))) for row in rows]
+    return jsonify({'response': [person.json() for person in persons]}).get_data()
+
+
+def fast_path(rows, backend):
+    """Быстрый путь: словари из кортежей столбцов и json_response с указанной библиотекой кодирования JSON"""
+    serialization.json_backend = backend
+    return serialization.json_response({'response': Person.rows_json(rows)}).get_data()
+
+
+def measure(func, repeat):
+    """Функция возвращает результат функции и лучшее время из repeat запусков в секундах"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def run_benchmark(rows, repeat):
+    """Функция сравнивает пути сериализации и возвращает список результатов замеров"""
+    person_data = person_rows(rows)
+    paths = [('orm + jsonify', lambda: orm_path(person_data)),
+             ('rows + json', lambda: fast_path(person_data, 'json'))]
+    if serialization.orjson:
+        paths.append(('rows + orjson', lambda: fast_path(person_data, 'orjson')))
+    results = []
+    with app.test_request_context():
+        expected = None
+        for name, func in paths:
+            body, seconds = measure(func, repeat)
+            expected = expected or body
+            if body != expected:
+                raise AssertionError(f'Ответ пути {name} побайтно отличается от ответа jsonify')
+            results.append({'path': name, 'bytes': len(body), 'ms': round(seconds * 1000, 1)})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Сравнение путей сериализации ответа /api/get_persons_list')
+    parser.add_argument('--rows', type=int, default=100000, help='количество контактов в ответе')
+    parser.add_argument('--repeat', type=int, default=3, help='количество повторов каждого замера')
+    args = parser.parse_args()
+    benchmark_results = run_benchmark(args.rows, args.repeat)
+    baseline = benchmark_results[0]['ms']
+    for item in benchmark_results:
+        print(f'{item["path"]:<15} {item["bytes"]:>12} байт, {item["ms"]:>9} мс (x{round(baseline / item["ms"], 1)})')
+    print('Ответы всех путей побайтно совпадают')
@@ -1,34 +1,25 @@
-from orion.models import Person, Phone, Email
-from orion import db
+from orion.models import Person
+from orion.data_validation import PersonData
 from utils.data_generator import get_random_person, genders
+from pydantic.error_wrappers import ValidationError as PydanticValilationError
 from random import choice
 
-# модуль для наполнения БД данными сгеренированными в модуле data_generator
+# модуль для наполнения БД данными сгеренированными в модуле data_generator. Для загрузки больших объемов данных из
+# файла используйте команду flask orion import
 
 
 def data_uploader(number_of_persons_to_upload):
-    """Функция для наполнения БД данными сгеренированными в модуле data_generator. Данные соответсвуют критериям
-    валидации описанным в модуле data_validation"""
+    """Функция для наполнения БД данными сгеренированными в модуле data_generator. Данные проверяются по критериям
+    валидации описанным в модуле data_validation и добавляются в БД одной транзакцией"""
+    persons_list = []
     for i in range(number_of_persons_to_upload):
+        data = get_random_person(choice(genders))
         try:
-            data = get_random_person(choice(genders))
-            new_person = Person(file_path=data['file_path'], full_name=data['full_name'], gender=data['gender'],
-                                birthday=data['birthday'], address=data['address'])
-            db.session.add(new_person)
-            db.session.commit()
-            for phone in data['phones']:
-                new_phone = Phone(phone_type=phone['phone_type'], phone_number=phone['phone_number'],
-                                  person_id=new_person.person_id)
-                db.session.add(new_phone)
-                db.session.commit()
-            for email in data['emails']:
-                new_email = Email(email_type=email['email_type'], email_address=email['email_address'],
-                                  person_id=new_person.person_id)
-                db.session.add(new_email)
-                db.session.commit()
-            print(f'Контакт {data["full_name"]} добавлен в БД')
-        except Exception as e:
-            print(f'При добавлении контакта в БД произошла ошибка {e}')
+            persons_list.append(PersonData(**data))
+        except PydanticValilationError as e:
+            print(f'Контакт {data["full_name"]} не прошел валидацию: {e}')
+    print(Person.add_person(persons_list))
 
 
-data_uploader(20)
+if __name__ == "__main__":
+    data_uploader(20)